@@ -1,26 +1,51 @@
+import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
 
 from fabric import task
+from libcloud.common.exceptions import BaseHTTPError
 from libcloud.compute.base import Node
-from libcloud.compute.providers import get_driver
-from libcloud.compute.types import NodeState, Provider
-
+from libcloud.compute.types import NodeState
+
+from cloudy.aws.images import (
+    DEFAULT_IMAGE_OWNERS,
+    IMAGE_FIELDS,
+    ImageCatalog,
+    util_image_from_record,
+    util_image_record,
+)
+from cloudy.aws.index import (
+    InventoryIndex,
+    util_group_row,
+    util_node_row,
+    util_parse_filters,
+    util_volume_row,
+)
+from cloudy.aws.regions import fan_out, format_region_summary, util_region_list
+from cloudy.aws.session import DEFAULT_REGION, ec2_session
+from cloudy.aws.waiters import DEFAULT_NODE_TIMEOUT, NodeWaiter
 from cloudy.util.conf import CloudyConfig
 from cloudy.util.context import Context
+from cloudy.util.hostkeys import parse_console_host_keys, scan_host_key, seed_known_hosts
+from cloudy.util.ready import DEFAULT_SSH_TIMEOUT, wait_for_ssh
 
 
-def util_print_node(node: Node | None) -> None:
+def util_print_node(node: Node | None, region: str = "") -> None:
     if node:
+        # libcloud 3 uses image_id/key_name/instance_type; older releases the camel-case keys
+        extra = node.extra or {}
         print(
             ", ".join(
-                [
+                (["region: " + region] if region else [])
+                + [
                     "name: " + node.name,
                     "status: " + util_get_state2string(node.state),
-                    "image: " + node.extra.get("imageId", ""),
-                    "zone: " + node.extra.get("availability", ""),
-                    "key: " + node.extra.get("keyname", ""),
-                    "size: " + node.extra.get("instancetype", ""),
+                    "image: " + (extra.get("image_id") or extra.get("imageId", "")),
+                    "zone: " + extra.get("availability", ""),
+                    "key: " + (extra.get("key_name") or extra.get("keyname", "")),
+                    "size: " + (extra.get("instance_type") or extra.get("instancetype", "")),
                     "pub ip: " + str(node.public_ips),
                 ]
             ),
@@ -39,37 +64,76 @@ def util_get_state2string(state: NodeState) -> str:
     return compute_state_map.get(state, "unknown")
 
 
-def util_get_connection(c: Context):
+def util_get_region(region: str = "") -> str:
+    """Return the given region, or [AWS] region from the config, or us-east-1."""
+    return region or CloudyConfig.load().get_variable("aws", "region", DEFAULT_REGION)
+
+
+def util_get_connection(c: Context, region: str = ""):
+    """Return the shared EC2 driver for the configured credentials and region."""
     try:
-        cfg = CloudyConfig()
+        cfg = CloudyConfig.load()
         ACCESS_ID = (cfg.cfg_grid["AWS"]["access_id"] or "").strip()
         SECRET_KEY = (cfg.cfg_grid["AWS"]["secret_key"] or "").strip()
     except Exception:
         c.abort("Unable to read ACCESS_ID, SECRET_KEY")
 
-    Driver = get_driver(Provider.EC2)
-    conn = Driver(ACCESS_ID, SECRET_KEY)
-    return conn
+    return ec2_session.driver(ACCESS_ID, SECRET_KEY, util_get_region(region))
+
+
+def util_regions_fan_out(c: Context, regions: str, fetch, concurrency: int = 16):
+    """
+    Call fetch(region) in each selected region at once (see util_region_list);
+    returns the per-region results after printing the timing summary.
+    """
+    cfg = CloudyConfig.load()
+    try:
+        selected = util_region_list(regions, cfg.get_list("aws", "regions"), util_get_region())
+    except ValueError as e:
+        c.abort(str(e))
 
+    started = time.monotonic()
+    results = fan_out(selected, fetch, int(concurrency))
+    print(format_region_summary(results, time.monotonic() - started), file=sys.stderr)
+    return results
 
-def util_wait_till_node(c: Context, name: str, state: NodeState, timeout: int = 10) -> Node | None:
-    node = None
-    elapsed = 0
-    frequency = 5
-    while elapsed < timeout:
-        node = aws_get_node(c, name)
-        if node and node.state == state:
-            break
-        time.sleep(frequency)
-        elapsed += frequency
-    return node
+
+def util_cached(c: Context, kind: str, loader_name: str):
+    """Return a listing of the shared driver (e.g. list_sizes) through the TTL cache."""
+    conn = util_get_connection(c)
+    return ec2_session.cached(conn.region_name, kind, getattr(conn, loader_name))
+
+
+def util_wait_for_nodes(
+    c: Context, nodes: List[Node], state: NodeState, timeout: float = DEFAULT_NODE_TIMEOUT
+) -> List[Node]:
+    """Wait for all nodes together (one describe call per poll); returns their last state."""
+    if not nodes:
+        return []
+    waiter = NodeWaiter(util_get_connection(c), timeout=float(timeout))
+    seen = waiter.wait([n.id for n in nodes], state)
+    print(waiter.summary(len(nodes), state), file=sys.stderr)
+    return [seen[n.id] or n for n in nodes]
+
+
+def util_wait_till_node(
+    c: Context, name: str, state: NodeState, timeout: float = DEFAULT_NODE_TIMEOUT
+) -> Node | None:
+    node = aws_get_node(c, name)
+    if not node or node.state == state:
+        return node
+    return util_wait_for_nodes(c, [node], state, timeout)[0]
 
 
-def util_wait_till_node_destroyed(c: Context, name: str, timeout: int = 15) -> Node | None:
+def util_wait_till_node_destroyed(
+    c: Context, name: str, timeout: float = DEFAULT_NODE_TIMEOUT
+) -> Node | None:
     return util_wait_till_node(c, name, NodeState.TERMINATED, timeout)
 
 
-def util_wait_till_node_running(c: Context, name: str, timeout: int = 15) -> Node | None:
+def util_wait_till_node_running(
+    c: Context, name: str, timeout: float = DEFAULT_NODE_TIMEOUT
+) -> Node | None:
     return util_wait_till_node(c, name, NodeState.RUNNING, timeout)
 
 
@@ -82,12 +146,18 @@ def util_list_instances(c: Context):
     return nodes
 
 
+@task
+@Context.wrap_context
+def aws_api_stats(c: Context) -> None:
+    """Show the EC2 API calls made so far in this run - Ex: (cmd)"""
+    print(ec2_session.summary(), file=sys.stderr)
+
+
 @task
 @Context.wrap_context
 def aws_list_sizes(c: Context):
     """List node sizes - Ex: (cmd)"""
-    conn = util_get_connection(c)
-    sizes = sorted([i for i in conn.list_sizes()], key=lambda x: x.ram)
+    sizes = sorted(util_cached(c, "sizes", "list_sizes"), key=lambda x: x.ram)
     for i in sizes:
         print(" - ".join([i.id, str(i.ram), str(i.price)]), file=sys.stderr)
 
@@ -96,46 +166,92 @@ def aws_list_sizes(c: Context):
 @Context.wrap_context
 def aws_get_size(c: Context, size: str) -> object | None:
     """Get Node Size - Ex: (cmd:<size>)"""
-    conn = util_get_connection(c)
-    sizes = [i for i in conn.list_sizes()]
     if size:
-        for i in sizes:
+        for i in util_cached(c, "sizes", "list_sizes"):
             if str(i.ram) == size or i.id == size:
                 print(" - ".join([i.id, str(i.ram), str(i.price)]), file=sys.stderr)
                 return i
     return None
 
 
+def util_image_catalog(c: Context, refresh: bool = False) -> ImageCatalog:
+    """
+    Return the region's image catalog, fetching it when missing or stale.
+
+    The catalog holds the images of the owners in [AWS] image-owners
+    (default: self, amazon, Canonical), one filtered DescribeImages call per owner,
+    never the whole public catalog.
+    """
+    conn = util_get_connection(c)
+    owners = CloudyConfig.load().get_list("aws", "image-owners", DEFAULT_IMAGE_OWNERS)
+    catalog = ImageCatalog(conn.region_name)
+    if refresh or not catalog.load() or not catalog.fresh(owners):
+        rows = []
+        for owner in owners:
+            rows += [util_image_record(i) for i in conn.list_images(ex_owner=owner)]
+        catalog.replace(rows, owners)
+    return catalog
+
+
 @task
 @Context.wrap_context
-def aws_list_images(c: Context):
-    """List available images - Ex: (cmd)"""
-    conn = util_get_connection(c)
-    images = sorted([i for i in conn.list_images()], key=lambda x: x.id)
-    for i in images:
-        print(" - ".join([i.id, i.name]), file=sys.stderr)
+def aws_list_images(
+    c: Context,
+    query: str = "",
+    owner: str = "",
+    page: str = "1",
+    per_page: str = "50",
+    refresh: bool = False,
+):
+    """List images from the local catalog - Ex: (cmd:[query],[owner],[page],[per_page],[refresh])"""
+    rows = util_image_catalog(c, refresh).search(query, owner)
+    first = (max(int(page), 1) - 1) * int(per_page)
+    for row in rows[first : first + int(per_page)]:
+        print(" - ".join(row[k] for k in IMAGE_FIELDS), file=sys.stderr)
+    pages = max((len(rows) + int(per_page) - 1) // int(per_page), 1)
+    print(f"page {page} of {pages} ({len(rows)} images)", file=sys.stderr)
 
 
 @task
 @Context.wrap_context
-def aws_get_image(c: Context, name: str) -> object | None:
-    """Confirm if a node exists - Ex: (cmd:<image>)"""
+def aws_get_image(c: Context, name: str, owner: str = "") -> object | None:
+    """Get an image by ID or exact name, newest first - Ex: (cmd:<image>,[owner])"""
+    if not name:
+        return None
     conn = util_get_connection(c)
-    images = [i for i in conn.list_images()]
-    if name:
-        for i in images:
-            if name == i.id:
-                print(" - ".join([i.id, i.name]), file=sys.stderr)
-                return i
-    return None
+    catalog = ImageCatalog(conn.region_name)
+    rows = []
+    if catalog.load():
+        rows = [row for row in catalog.search(name, owner) if name in (row["id"], row["name"])]
+    if rows:
+        images = [util_image_from_record(row, conn) for row in rows]
+    else:
+        # Ask for this image only; an unfiltered listing pulls the whole public catalog
+        by_id = name.startswith("ami-")
+        try:
+            images = conn.list_images(
+                ex_image_ids=[name] if by_id else None,
+                ex_owner=owner or None,
+                ex_filters=None if by_id else {"name": name},
+            )
+        except BaseHTTPError as e:
+            # A malformed or unknown AMI ID is "not found"; auth, throttling, network propagate
+            if "InvalidAMIID" in str(e):
+                return None
+            raise
+    images = [i for i in images if name in (i.id, i.name)]
+    if not images:
+        return None
+    image = max(images, key=lambda x: str(x.extra.get("creation_date") or ""))
+    print(" - ".join([image.id, image.name or ""]), file=sys.stderr)
+    return image
 
 
 @task
 @Context.wrap_context
 def aws_list_locations(c: Context):
     """List available locations - Ex: (cmd)"""
-    conn = util_get_connection(c)
-    locations = sorted([i for i in conn.list_locations()], key=lambda x: x.id)
+    locations = sorted(util_cached(c, "locations", "list_locations"), key=lambda x: x.id)
     for i in locations:
         print(
             " - ".join(
@@ -154,8 +270,7 @@ def aws_list_locations(c: Context):
 @Context.wrap_context
 def aws_get_location(c: Context, name: str) -> object | None:
     """Confirm if a location exists - Ex: (cmd:<location>)"""
-    conn = util_get_connection(c)
-    locations = sorted([i for i in conn.list_locations()], key=lambda x: x.id)
+    locations = sorted(util_cached(c, "locations", "list_locations"), key=lambda x: x.id)
     if name:
         for i in locations:
             if getattr(i, "availability_zone", type("", (), {"name": ""})()).name == name:
@@ -178,8 +293,7 @@ def aws_get_location(c: Context, name: str) -> object | None:
 @Context.wrap_context
 def aws_list_security_groups(c: Context):
     """List available security groups - Ex: (cmd)"""
-    conn = util_get_connection(c)
-    groups = sorted([i for i in conn.ex_list_security_groups()])
+    groups = sorted(util_cached(c, "security_groups", "ex_list_security_groups"))
     for i in groups:
         print(i, file=sys.stderr)
 
@@ -188,13 +302,9 @@ def aws_list_security_groups(c: Context):
 @Context.wrap_context
 def aws_security_group_found(c: Context, name: str) -> bool:
     """Confirm if a security group exists - Ex: (cmd:<name>)"""
-    conn = util_get_connection(c)
-    groups = sorted([i for i in conn.ex_list_security_groups()])
-    if name:
-        for i in groups:
-            if i == name:
-                print(i, file=sys.stderr)
-                return True
+    if name and name in util_cached(c, "security_groups", "ex_list_security_groups"):
+        print(name, file=sys.stderr)
+        return True
     return False
 
 
@@ -202,9 +312,8 @@ def aws_security_group_found(c: Context, name: str) -> bool:
 @Context.wrap_context
 def aws_list_keypairs(c: Context):
     """List all available keypairs - Ex: (cmd)"""
-    conn = util_get_connection(c)
-    nodes = sorted([i for i in conn.ex_describe_all_keypairs()])
-    for i in nodes:
+    keys = sorted(util_cached(c, "keypairs", "ex_describe_all_keypairs"))
+    for i in keys:
         print(i, file=sys.stderr)
 
 
@@ -212,23 +321,23 @@ def aws_list_keypairs(c: Context):
 @Context.wrap_context
 def aws_keypair_found(c: Context, name: str) -> bool:
     """Confirm if a keypair exists - Ex: (cmd:<name>)"""
-    conn = util_get_connection(c)
-    keys = sorted([i for i in conn.ex_describe_all_keypairs()])
-    for i in keys:
-        if i == name:
-            print(i, file=sys.stderr)
-            return True
+    if name and name in util_cached(c, "keypairs", "ex_describe_all_keypairs"):
+        print(name, file=sys.stderr)
+        return True
     return False
 
 
 @task
 @Context.wrap_context
-def aws_list_nodes(c: Context):
-    """List all available computing nodes - Ex: (cmd)"""
-    conn = util_get_connection(c)
-    nodes = sorted([i for i in conn.list_nodes()], key=lambda x: x.name)
-    for i in nodes:
-        util_print_node(i)
+def aws_list_nodes(c: Context, regions: str = "", concurrency: int = 16):
+    """List computing nodes, in one, several or all regions at once - Ex: (cmd:[regions])"""
+    results = util_regions_fan_out(
+        c, regions, lambda r: util_get_connection(c, r).list_nodes(), concurrency
+    )
+    show_region = len(results) > 1
+    for result in results:
+        for i in sorted(result.items, key=lambda x: x.name):
+            util_print_node(i, result.region if show_region else "")
 
 
 @task
@@ -236,7 +345,9 @@ def aws_list_nodes(c: Context):
 def aws_get_node(c: Context, name: str) -> Node | None:
     """Confirm if a computing node exists - Ex: (cmd:<name>)"""
     conn = util_get_connection(c)
-    nodes = sorted([i for i in conn.list_nodes()], key=lambda x: x.name)
+    nodes = conn.list_nodes(ex_filters={"tag:Name": name}) if name else []
+    # Prefer a live node when a terminated one still carries the same name
+    nodes.sort(key=lambda x: x.state == NodeState.TERMINATED)
     for i in nodes:
         if i.name == name:
             util_print_node(i)
@@ -244,17 +355,8 @@ def aws_get_node(c: Context, name: str) -> Node | None:
     return None
 
 
-@task
-@Context.wrap_context
-def aws_create_node(
-    c: Context, name: str, image: str, size: str, security: str, key: str, timeout: int = 30
-) -> Node | None:
-    """Create a node - Ex: (cmd:<name>,<image>,<size>,[security],[key],[timeout])"""
-    conn = util_get_connection(c)
-
-    if aws_get_node(c, name):
-        c.abort(f"Node already exists ({name})")
-
+def util_validate_node_params(c: Context, image: str, size: str, security: str, key: str):
+    """Check the size, security group, keypair and image; returns (size, image) objects."""
     size_obj = aws_get_size(c, size)
     if not size_obj:
         c.abort(f"Invalid size ({size})")
@@ -268,16 +370,251 @@ def aws_create_node(
     image_obj = aws_get_image(c, image)
     if not image_obj:
         c.abort(f"Invalid image ({image})")
+    return size_obj, image_obj
+
+
+def util_node_names(names: str = "", pattern: str = "", count: int = 1, start: int = 1):
+    """
+    Expand node names from a comma-separated list, or `count` names from a
+    pattern with an `{n}` field (e.g. "web-{n:02d}" -> web-01, web-02, ...).
+
+    Raises:
+        ValueError: If the pattern has no {n} field or no name is produced.
+    """
+    if names:
+        wanted = list(dict.fromkeys(n.strip() for n in names.split(",") if n.strip()))
+    elif "{n" in pattern:
+        wanted = [pattern.format(n=i) for i in range(start, start + count)]
+    else:
+        raise ValueError(f"Name pattern needs an {{n}} field ({pattern})")
+    if not wanted:
+        raise ValueError("No node names given")
+    return wanted
+
+
+def util_node_inventory(nodes: List[Node], group: str) -> str:
+    """Render nodes as a fleet inventory group, one address per line (public IP first)."""
+    lines = [f"[{group}]"]
+    for node in nodes:
+        address = (node.public_ips or node.private_ips or [""])[0]
+        if address:
+            lines += [f"# {node.name}", address]
+    return "\n".join(lines) + "\n"
+
+
+def util_ready_context(
+    c: Context,
+    node: Node,
+    user: str = "",
+    port: str = "",
+    timeout: float = DEFAULT_SSH_TIMEOUT,
+    wait: bool = True,
+) -> Context:
+    """
+    Wait for sshd on a node, pre-seed its host key and return a Context for it.
+
+    The host key comes from the cloud-init block of the console output when
+    it is already there, otherwise from a first (login-free) connection. User
+    and port default to [AWS] ssh-user (ubuntu) and [AWS] ssh-port (22): the
+    port the image boots with, not the one the generic recipe moves sshd to.
 
+    Raises:
+        RuntimeError: If the node has no address or sshd is not ready in time.
+    """
+    cfg = CloudyConfig.load()
+    host = (node.public_ips or node.private_ips or [""])[0]
+    if not host:
+        raise RuntimeError(f"Node has no IP address ({node.name})")
+    port_num = int(port or cfg.get_variable("aws", "ssh-port", "22"))
+    started = time.monotonic()
+    if wait:
+        if not wait_for_ssh(host, port_num, float(timeout)):
+            raise RuntimeError(
+                f"sshd on {host}:{port_num} not ready after {timeout}s ({node.name})"
+            )
+        keys, source = [], "console output"
+        try:
+            output = util_get_connection(c).ex_get_console_output(node).get("output")
+            keys = parse_console_host_keys(output)
+        except Exception:
+            pass
+        try:
+            if not keys:
+                keys, source = [scan_host_key(host, port_num)], "first connection"
+            seed_known_hosts(host, port_num, keys)
+            seeded = f"{len(keys)} host key(s) from {source}"
+        except Exception as e:
+            seeded = f"host key not pre-seeded ({e})"
+        print(
+            f"{node.name}: ssh ready on {host}:{port_num} after "
+            f"{time.monotonic() - started:.0f}s; {seeded}",
+            file=sys.stderr,
+        )
+
+    key_path = cfg.get_variable("aws", "private-key-path")
+    connect_kwargs = {"key_filename": os.path.expanduser(key_path)} if key_path else {}
+    return Context(
+        host,
+        user=user or cfg.get_variable("aws", "ssh-user", "ubuntu"),
+        port=port_num,
+        config=c.config,
+        connect_kwargs=connect_kwargs,
+    )
+
+
+@task
+@Context.wrap_context
+def aws_create_node(
+    c: Context,
+    name: str,
+    image: str,
+    size: str,
+    security: str,
+    key: str,
+    timeout: int = 300,
+    user: str = "",
+    port: str = "",
+    wait_ssh: bool = True,
+) -> Context:
+    """
+    Create a node and return a Context connected to it, ready for recipes.
+
+    After the node is running, waits for sshd and pre-seeds its host key
+    (skip with --no-wait-ssh).
+
+    Ex: (cmd:<name>,<image>,<size>,[security],[key],[timeout],[user],[port])
+    """
+    conn = util_get_connection(c)
+
+    if aws_get_node(c, name):
+        c.abort(f"Node already exists ({name})")
+
+    size_obj, image_obj = util_validate_node_params(c, image, size, security, key)
     node = conn.create_node(
         name=name, image=image_obj, size=size_obj, ex_securitygroup=security, ex_keyname=key
     )
     if not node:
         c.abort(f"Failed to create node (name:{name}, image:{image}, size:{size})")
 
-    node = util_wait_till_node_running(c, name)
+    node = util_wait_for_nodes(c, [node], NodeState.RUNNING, timeout)[0]
+    if node.state != NodeState.RUNNING:
+        c.abort(f"Node did not reach running within {timeout}s ({name})")
     util_print_node(node)
-    return node
+    try:
+        ready = util_ready_context(c, node, user, port, float(timeout), wait_ssh)
+    except RuntimeError as e:
+        c.abort(str(e))
+    print(ec2_session.summary(), file=sys.stderr)
+    return ready
+
+
+@task
+@Context.wrap_context
+def aws_create_nodes(
+    c: Context,
+    image: str,
+    size: str,
+    security: str,
+    key: str,
+    count: int = 1,
+    pattern: str = "node-{n}",
+    names: str = "",
+    start: int = 1,
+    parallel: int = 5,
+    timeout: int = 300,
+    inventory: str = "",
+    group: str = "nodes",
+    port: str = "",
+    wait_ssh: bool = True,
+) -> List[Node]:
+    """
+    Create many nodes in parallel and print them as a fleet inventory.
+
+    Size, security group, keypair and image are checked once for all nodes.
+    Up to `parallel` create requests run at a time, then all nodes are waited
+    on together, first for running and then (unless --no-wait-ssh) for sshd,
+    with their host keys pre-seeded. The inventory group (written to
+    `inventory` if given) can be passed straight to `fleet.run --inventory`.
+
+    Ex: (cmd:<image>,<size>,<security>,<key>,[count],[pattern],[names],[start],[parallel])
+    """
+    try:
+        wanted = util_node_names(names, pattern, int(count), int(start))
+    except ValueError as e:
+        c.abort(str(e))
+    conn = util_get_connection(c)
+
+    existing = conn.list_nodes(ex_filters={"tag:Name": wanted})
+    taken = sorted(n.name for n in existing if n.state != NodeState.TERMINATED)
+    if taken:
+        c.abort(f"Nodes already exist ({', '.join(taken)})")
+
+    size_obj, image_obj = util_validate_node_params(c, image, size, security, key)
+
+    def create(name: str) -> Node:
+        # Each worker thread gets its own driver from the session
+        return util_get_connection(c).create_node(
+            name=name, image=image_obj, size=size_obj, ex_securitygroup=security, ex_keyname=key
+        )
+
+    created: Dict[str, Node] = {}
+    failed: List[str] = []
+    with ThreadPoolExecutor(max_workers=min(max(int(parallel), 1), len(wanted))) as pool:
+        futures = {pool.submit(create, name): name for name in wanted}
+        for future in as_completed(futures):
+            try:
+                created[futures[future]] = future.result()
+            except Exception as e:
+                failed.append(f"{futures[future]}: {e}")
+
+    nodes = util_wait_for_nodes(
+        c, [created[n] for n in wanted if n in created], NodeState.RUNNING, timeout
+    )
+    for node in nodes:
+        util_print_node(node)
+        if node.state != NodeState.RUNNING:
+            failed.append(f"{node.name}: not running after {timeout}s")
+    running = [n for n in nodes if n.state == NodeState.RUNNING]
+
+    # Only nodes whose sshd answers go into the inventory
+    if wait_ssh and running:
+        with ThreadPoolExecutor(max_workers=min(max(int(parallel), 1), len(running))) as pool:
+            futures = {
+                pool.submit(util_ready_context, c, n, "", port, float(timeout)): n for n in running
+            }
+            unready = set()
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    unready.add(futures[future].id)
+                    failed.append(f"{futures[future].name}: {e}")
+        running = [n for n in running if n.id not in unready]
+
+    text = util_node_inventory(running, group)
+    if inventory:
+        with open(os.path.expanduser(inventory), "w") as f:
+            f.write(text)
+    print(text, end="")
+    print(ec2_session.summary(), file=sys.stderr)
+    if failed:
+        c.abort(f"{len(failed)} of {len(wanted)} node(s) failed: " + "; ".join(sorted(failed)))
+    return running
+
+
+@task
+@Context.wrap_context
+def aws_wait_for_ssh(
+    c: Context, name: str, user: str = "", port: str = "", timeout: int = 180
+) -> Context:
+    """Wait for sshd on a node and pre-seed its host key - Ex: (cmd:<name>,[user],[port])"""
+    node = aws_get_node(c, name)
+    if not node or node.state != NodeState.RUNNING:
+        c.abort(f"Node is not running ({name})")
+    try:
+        return util_ready_context(c, node, user, port, float(timeout))
+    except RuntimeError as e:
+        c.abort(str(e))
 
 
 @task
@@ -289,8 +626,8 @@ def aws_destroy_node(c: Context, name: str, timeout: int = 30) -> None:
         c.abort(f"Node does not exist or terminated ({name})")
 
     if node.destroy():
-        node = util_wait_till_node_destroyed(c, name, timeout)
-        if node:
+        node = util_wait_for_nodes(c, [node], NodeState.TERMINATED, timeout)[0]
+        if node.state == NodeState.TERMINATED:
             print(f"Node is destroyed ({name})", file=sys.stderr)
         else:
             print(f"Node is being destroyed ({name})", file=sys.stderr)
@@ -318,16 +655,100 @@ def aws_create_volume(
 
 @task
 @Context.wrap_context
-def aws_list_volumes(c: Context) -> None:
-    from boto.ec2.connection import EC2Connection
+def aws_list_volumes(c: Context, regions: str = "", concurrency: int = 16) -> None:
+    """List volumes, in one, several or all regions at once - Ex: (cmd:[regions])"""
+    results = util_regions_fan_out(
+        c, regions, lambda r: util_get_connection(c, r).list_volumes(), concurrency
+    )
+    for result in results:
+        for v in sorted(result.items, key=lambda x: x.name or ""):
+            row = util_volume_row(v, result.region)
+            print(
+                ", ".join(
+                    f"{k}: {row[k]}"
+                    for k in ("region", "name", "id", "size", "zone", "state", "node_id")
+                ),
+                file=sys.stderr,
+            )
+
 
+@task
+@Context.wrap_context
+def aws_sync_inventory(c: Context, regions: str = "", concurrency: int = 16) -> Dict[str, int]:
+    """Pull nodes, volumes and security groups into the local index - Ex: (cmd:[regions])"""
+
+    def fetch(region: str):
+        conn = util_get_connection(c, region)
+        return [
+            [util_node_row(n, region) for n in conn.list_nodes()],
+            [util_volume_row(v, region) for v in conn.list_volumes()],
+            [util_group_row(g, region) for g in conn.ex_get_security_groups()],
+        ]
+
+    results = util_regions_fan_out(c, regions, fetch, concurrency)
+
+    # SQLite writes stay on this thread; a failed region keeps its previous rows
+    totals = {"nodes": 0, "volumes": 0, "security_groups": 0}
+    index = InventoryIndex()
     try:
-        cfg = CloudyConfig()
-        ACCESS_ID = (cfg.cfg_grid["AWS"]["access_id"] or "").strip()
-        SECRET_KEY = (cfg.cfg_grid["AWS"]["secret_key"] or "").strip()
-    except Exception:
-        c.abort("Unable to read ACCESS_ID, SECRET_KEY")
+        for result in results:
+            if result.error:
+                continue
+            counts = index.sync(result.region, *result.items)
+            totals = {k: totals[k] + counts[k] for k in totals}
+            print(
+                f"{result.region}: {counts['nodes']} node(s), {counts['volumes']} volume(s), "
+                f"{counts['security_groups']} security group(s)",
+                file=sys.stderr,
+            )
+    finally:
+        index.close()
+    print(f"Inventory index: {index.path}", file=sys.stderr)
+    return totals
+
+
+@task
+@Context.wrap_context
+def aws_query_inventory(
+    c: Context,
+    name: str = "",
+    state: str = "",
+    zone: str = "",
+    role: str = "",
+    tag: str = "",
+    region: str = "",
+    hosts: bool = False,
+) -> List[Dict]:
+    """
+    Query the local inventory index without calling the API.
+
+    Name may be a glob (web-*); role matches the "role" tag and tag takes
+    key=value pairs (env=prod,team=web). With --hosts only the addresses are
+    printed, one per line, e.g. for fleet.run --hosts.
 
-    conn = EC2Connection(ACCESS_ID, SECRET_KEY)
-    volumes = [v for v in conn.get_all_volumes()]
-    print(volumes, file=sys.stderr)
+    Ex: (cmd:[name],[state],[zone],[role],[tag],[region],[hosts])
+    """
+    filters = {"name": name, "state": state, "zone": zone, "region": region, "tag:role": role}
+    try:
+        if tag:
+            filters.update({f"tag:{k}": v for k, v in util_parse_filters(tag).items()})
+    except ValueError as e:
+        c.abort(str(e))
+    index = InventoryIndex()
+    try:
+        rows = index.query(**filters)
+    finally:
+        index.close()
+    if hosts:
+        for row in rows:
+            if row["public_ip"] or row["private_ip"]:
+                print(row["public_ip"] or row["private_ip"])
+        return rows
+    for row in rows:
+        print(
+            ", ".join(
+                f"{k}: {row[k]}" for k in ("name", "state", "region", "zone", "size", "public_ip")
+            ),
+            file=sys.stderr,
+        )
+    return rows
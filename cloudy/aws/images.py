@@ -0,0 +1,147 @@
+"""Compact on-disk catalog of EC2 images, searchable by ID or name prefix without API calls."""
+
+import bisect
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from libcloud.compute.base import NodeImage
+
+# Seconds a saved catalog is used before aws.list-images fetches it again
+IMAGE_CATALOG_TTL_ENV = "CLOUDY_AWS_IMAGE_TTL"
+DEFAULT_IMAGE_CATALOG_TTL = 86400
+IMAGE_CATALOG_DIR = os.path.expanduser("~/.cache/cloudy/aws")
+
+# Owners fetched into the catalog unless [AWS] image-owners says otherwise; 099720109477 is
+# Canonical, which publishes the Ubuntu images the recipes target
+DEFAULT_IMAGE_OWNERS = ["self", "amazon", "099720109477"]
+
+# One catalog row: the fields a lookup or listing needs, nothing else
+IMAGE_FIELDS = ("id", "name", "arch", "owner", "created")
+
+
+def util_image_record(image: Any) -> Dict[str, str]:
+    """Reduce a libcloud NodeImage to a catalog row."""
+    extra = image.extra or {}
+    return {
+        "id": image.id,
+        "name": image.name or "",
+        "arch": extra.get("architecture") or "",
+        "owner": extra.get("owner_alias") or extra.get("owner_id") or "",
+        "created": extra.get("creation_date") or "",
+    }
+
+
+def util_image_from_record(row: Dict[str, str], driver: Any) -> NodeImage:
+    """Rebuild a NodeImage from a catalog row (enough for create_node)."""
+    extra = {"architecture": row["arch"], "owner_id": row["owner"], "creation_date": row["created"]}
+    return NodeImage(row["id"], row["name"], driver, extra=extra)
+
+
+class ImageCatalog:
+    """
+    Image rows for one region, kept sorted by ID with a sorted name index.
+
+    The catalog is saved as one JSON file per region under
+    ~/.cache/cloudy/aws. ID and name prefix searches bisect the sorted
+    indexes, so a lookup never scans the whole list and never calls the API.
+    """
+
+    def __init__(self, region: str, cache_dir: str = IMAGE_CATALOG_DIR) -> None:
+        self.region = region
+        self.cache_dir = cache_dir
+        self.owners: List[str] = []
+        self.fetched_at = 0.0
+        self.images: List[Dict[str, str]] = []
+        self._ids: List[str] = []
+        self._names: List[Tuple[str, int]] = []
+
+    @property
+    def path(self) -> str:
+        safe_region = re.sub(r"[^A-Za-z0-9_.-]", "_", self.region)
+        return os.path.join(self.cache_dir, f"images-{safe_region}.json")
+
+    @property
+    def ttl(self) -> int:
+        try:
+            return max(
+                int(os.environ.get(IMAGE_CATALOG_TTL_ENV, str(DEFAULT_IMAGE_CATALOG_TTL))), 0
+            )
+        except ValueError:
+            return DEFAULT_IMAGE_CATALOG_TTL
+
+    def fresh(self, owners: Optional[List[str]] = None) -> bool:
+        """True if the catalog was fetched within the TTL (for these owners, if given)."""
+        if not self.fetched_at or time.time() - self.fetched_at >= self.ttl:
+            return False
+        return owners is None or sorted(owners) == sorted(self.owners)
+
+    def load(self) -> bool:
+        """Read the saved catalog; returns False if there is none."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        rows = [dict(zip(IMAGE_FIELDS, row)) for row in data.get("images", [])]
+        self._index(rows)
+        self.owners = data.get("owners", [])
+        self.fetched_at = data.get("at", 0.0)
+        return True
+
+    def replace(self, rows: List[Dict[str, str]], owners: List[str]) -> None:
+        """Set the catalog to these rows and save it."""
+        self._index(rows)
+        self.owners = list(owners)
+        self.fetched_at = time.time()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump(
+                    {
+                        "region": self.region,
+                        "owners": self.owners,
+                        "at": self.fetched_at,
+                        "images": [[row[k] for k in IMAGE_FIELDS] for row in self.images],
+                    },
+                    f,
+                    separators=(",", ":"),
+                )
+        except OSError:
+            pass
+
+    def _index(self, rows: List[Dict[str, str]]) -> None:
+        unique = {row["id"]: row for row in rows}
+        self.images = [unique[i] for i in sorted(unique)]
+        self._ids = [row["id"] for row in self.images]
+        self._names = sorted((row["name"].lower(), i) for i, row in enumerate(self.images))
+
+    def get(self, image_id: str) -> Optional[Dict[str, str]]:
+        i = bisect.bisect_left(self._ids, image_id)
+        if i < len(self._ids) and self._ids[i] == image_id:
+            return self.images[i]
+        return None
+
+    def search(self, query: str = "", owner: str = "") -> List[Dict[str, str]]:
+        """Rows whose ID or name starts with query (case-insensitive name), sorted by ID."""
+        if query:
+            found = set()
+            start = bisect.bisect_left(self._ids, query)
+            for i in range(start, len(self._ids)):
+                if not self._ids[i].startswith(query):
+                    break
+                found.add(i)
+            prefix = query.lower()
+            start = bisect.bisect_left(self._names, (prefix, -1))
+            for name, i in self._names[start:]:
+                if not name.startswith(prefix):
+                    break
+                found.add(i)
+            rows = [self.images[i] for i in sorted(found)]
+        else:
+            rows = self.images
+        if owner:
+            rows = [row for row in rows if row["owner"] == owner]
+        return rows
@@ -0,0 +1,196 @@
+"""Local SQLite index of EC2 nodes, volumes and security groups for fast queries."""
+
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List
+
+# Index file; aws.sync-inventory writes it and queries (and fleet runs) read it
+INVENTORY_DB_ENV = "CLOUDY_AWS_INVENTORY"
+INVENTORY_DB = os.path.expanduser("~/.cache/cloudy/aws/inventory.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id TEXT PRIMARY KEY, region TEXT, name TEXT, state TEXT, zone TEXT, size TEXT,
+    image TEXT, key TEXT, public_ip TEXT, private_ip TEXT, launched TEXT, synced_at REAL
+);
+CREATE TABLE IF NOT EXISTS node_tags (node_id TEXT, key TEXT, value TEXT);
+CREATE TABLE IF NOT EXISTS volumes (
+    id TEXT PRIMARY KEY, region TEXT, name TEXT, size INTEGER, zone TEXT, state TEXT,
+    node_id TEXT, synced_at REAL
+);
+CREATE TABLE IF NOT EXISTS security_groups (
+    id TEXT PRIMARY KEY, region TEXT, name TEXT, vpc TEXT, description TEXT, synced_at REAL
+);
+CREATE INDEX IF NOT EXISTS nodes_name ON nodes (name);
+CREATE INDEX IF NOT EXISTS nodes_state ON nodes (state, zone);
+CREATE INDEX IF NOT EXISTS nodes_zone ON nodes (zone);
+CREATE INDEX IF NOT EXISTS nodes_region ON nodes (region);
+CREATE INDEX IF NOT EXISTS node_tags_kv ON node_tags (key, value, node_id);
+CREATE INDEX IF NOT EXISTS node_tags_node ON node_tags (node_id);
+CREATE INDEX IF NOT EXISTS volumes_region ON volumes (region);
+CREATE INDEX IF NOT EXISTS security_groups_region ON security_groups (region);
+"""
+
+# Filters accepted by query(); anything else must be a tag ("tag:<key>" or bare "role")
+NODE_FILTERS = ("name", "state", "zone", "region", "size", "image")
+
+
+def util_node_row(node: Any, region: str) -> Dict[str, Any]:
+    """Flatten a libcloud EC2 Node into an index row."""
+    extra = node.extra or {}
+    return {
+        "id": node.id,
+        "region": region,
+        "name": node.name or "",
+        "state": str(node.state),
+        "zone": extra.get("availability") or "",
+        "size": extra.get("instance_type") or "",
+        "image": extra.get("image_id") or "",
+        "key": extra.get("key_name") or "",
+        "public_ip": (node.public_ips or [""])[0],
+        "private_ip": (node.private_ips or [""])[0],
+        "launched": str(extra.get("launch_time") or ""),
+        "tags": dict(extra.get("tags") or {}),
+    }
+
+
+def util_volume_row(volume: Any, region: str) -> Dict[str, Any]:
+    """Flatten a libcloud StorageVolume into an index row."""
+    extra = volume.extra or {}
+    return {
+        "id": volume.id,
+        "region": region,
+        "name": volume.name or "",
+        "size": int(volume.size or 0),
+        "zone": extra.get("zone") or "",
+        "state": str(extra.get("state") or getattr(volume, "state", "") or ""),
+        "node_id": extra.get("instance_id") or "",
+    }
+
+
+def util_group_row(group: Any, region: str) -> Dict[str, Any]:
+    """Flatten a libcloud EC2SecurityGroup into an index row."""
+    extra = group.extra or {}
+    return {
+        "id": group.id,
+        "region": region,
+        "name": group.name or "",
+        "vpc": extra.get("vpc_id") or "",
+        "description": extra.get("description") or "",
+    }
+
+
+def util_parse_filters(spec: str) -> Dict[str, str]:
+    """Parse "role=web,state=running" into a filter dict for InventoryIndex.query()."""
+    filters: Dict[str, str] = {}
+    for part in spec.split(","):
+        key, sep, value = part.partition("=")
+        if not sep or not key.strip():
+            raise ValueError(f"Inventory filter must be key=value ({part.strip()})")
+        filters[key.strip()] = value.strip()
+    return filters
+
+
+class InventoryIndex:
+    """
+    EC2 inventory in one SQLite file, replaced region by region on sync.
+
+    A sync rewrites a region's rows in a single transaction, so readers
+    never see a half-synced region. Queries go through indexes on name,
+    state, zone and tag key/value, and never call the API.
+    """
+
+    def __init__(self, path: str = "") -> None:
+        self.path = os.path.expanduser(path or os.environ.get(INVENTORY_DB_ENV, "") or INVENTORY_DB)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def sync(
+        self,
+        region: str,
+        nodes: Iterable[Dict[str, Any]],
+        volumes: Iterable[Dict[str, Any]] = (),
+        groups: Iterable[Dict[str, Any]] = (),
+    ) -> Dict[str, int]:
+        """Replace a region's rows with these; returns the row count per table."""
+        now = time.time()
+        counts = {"nodes": 0, "volumes": 0, "security_groups": 0}
+        with self.db:
+            self.db.execute(
+                "DELETE FROM node_tags WHERE node_id IN (SELECT id FROM nodes WHERE region = ?)",
+                (region,),
+            )
+            for table in counts:
+                self.db.execute(f"DELETE FROM {table} WHERE region = ?", (region,))
+            for row in nodes:
+                tags = row.get("tags", {})
+                columns = [k for k in row if k != "tags"] + ["synced_at"]
+                self._insert("nodes", columns, [row[k] for k in columns[:-1]] + [now])
+                self.db.executemany(
+                    "INSERT INTO node_tags (node_id, key, value) VALUES (?, ?, ?)",
+                    [(row["id"], k, v) for k, v in tags.items()],
+                )
+                counts["nodes"] += 1
+            for table, rows in (("volumes", volumes), ("security_groups", groups)):
+                for row in rows:
+                    self._insert(table, list(row) + ["synced_at"], list(row.values()) + [now])
+                    counts[table] += 1
+        return counts
+
+    def _insert(self, table: str, columns: List[str], values: List[Any]) -> None:
+        marks = ", ".join("?" for _ in columns)
+        self.db.execute(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({marks})", values
+        )
+
+    def query(self, **filters: str) -> List[Dict[str, Any]]:
+        """
+        Nodes matching every filter, sorted by name.
+
+        Column filters are name, state, zone, region, size and image; a name
+        containing * or ? is a glob. Any other key is a tag ("tag:role" or
+        just "role"). Each row has the node columns plus a "tags" dict.
+        """
+        where: List[str] = []
+        args: List[str] = []
+        for key, value in filters.items():
+            if not value:
+                continue
+            if key in NODE_FILTERS:
+                glob = key == "name" and any(ch in value for ch in "*?")
+                where.append(f"n.{key} {'GLOB' if glob else '='} ?")
+                args.append(value)
+            else:
+                tag = key[4:] if key.startswith("tag:") else key
+                where.append(
+                    "EXISTS (SELECT 1 FROM node_tags t WHERE t.node_id = n.id "
+                    "AND t.key = ? AND t.value = ?)"
+                )
+                args += [tag, value]
+        condition = (" WHERE " + " AND ".join(where)) if where else ""
+        rows = self.db.execute(
+            f"SELECT n.* FROM nodes n{condition} ORDER BY n.name, n.id", args
+        ).fetchall()
+        tags: Dict[str, Dict[str, str]] = {}
+        if rows:
+            for t in self.db.execute(
+                "SELECT node_id, key, value FROM node_tags "
+                f"WHERE node_id IN (SELECT n.id FROM nodes n{condition})",
+                args,
+            ):
+                tags.setdefault(t["node_id"], {})[t["key"]] = t["value"]
+        return [dict(r, tags=tags.get(r["id"], {})) for r in rows]
+
+    def hosts(self, **filters: str) -> List[str]:
+        """Addresses of matching nodes (public IP, else private IP) for fleet runs."""
+        return [
+            r["public_ip"] or r["private_ip"]
+            for r in self.query(**filters)
+            if r["public_ip"] or r["private_ip"]
+        ]
@@ -0,0 +1,100 @@
+"""Run an EC2 listing in many regions at once and merge the results."""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+from libcloud.common.types import InvalidCredsError
+from libcloud.compute.drivers.ec2 import EC2NodeDriver
+
+from cloudy.util.ready import backoff_delays
+
+# Attempts per region before its error is reported (throttling, timeouts, 5xx)
+REGION_ATTEMPTS = 3
+
+
+def util_region_list(spec: str, configured: List[str], default: str) -> List[str]:
+    """
+    Expand a --regions value: "" is the default region, "all" is every
+    configured region ([AWS] regions, else every EC2 region libcloud knows),
+    anything else is a comma-separated list.
+
+    Raises:
+        ValueError: If a region name is not a known EC2 region.
+    """
+    known = EC2NodeDriver.list_regions()
+    if not spec:
+        return [default]
+    if spec == "all":
+        return list(configured) or sorted(known)
+    regions = list(dict.fromkeys(r.strip() for r in spec.split(",") if r.strip()))
+    unknown = [r for r in regions if r not in known]
+    if unknown:
+        raise ValueError(f"Unknown EC2 region(s): {', '.join(unknown)}")
+    return regions
+
+
+class RegionResult:
+    """Items one region returned (or the error it ended with)."""
+
+    def __init__(self, region: str) -> None:
+        self.region = region
+        self.items: List[Any] = []
+        self.error = ""
+        self.attempts = 0
+        self.duration = 0.0
+
+
+def fan_out(
+    regions: List[str],
+    fetch: Callable[[str], List[Any]],
+    concurrency: int = 16,
+    attempts: int = REGION_ATTEMPTS,
+) -> List[RegionResult]:
+    """
+    Call fetch(region) for every region in a thread pool; results keep region order.
+
+    A failing region is retried with jittered backoff, up to `attempts` times;
+    bad credentials are not retried. One region failing does not stop the
+    others, so the caller decides how to report partial results. Request
+    rate limiting per region happens in the shared EC2 session.
+    """
+
+    def run(region: str) -> RegionResult:
+        result = RegionResult(region)
+        started = time.monotonic()
+        delays = backoff_delays(1.0, maximum=8.0, jitter=0.5)
+        while True:
+            result.attempts += 1
+            try:
+                result.items = list(fetch(region))
+                result.error = ""
+                break
+            except InvalidCredsError as e:
+                result.error = f"{type(e).__name__}: {e}"
+                break
+            except Exception as e:
+                result.error = f"{type(e).__name__}: {e}"
+                if result.attempts >= attempts:
+                    break
+                time.sleep(next(delays))
+        result.duration = time.monotonic() - started
+        return result
+
+    if not regions:
+        return []
+    with ThreadPoolExecutor(max_workers=max(min(int(concurrency), len(regions)), 1)) as pool:
+        return list(pool.map(run, regions))
+
+
+def format_region_summary(results: List[RegionResult], elapsed: float) -> str:
+    """Wall time against the one-region-at-a-time sum, plus a line per failed region."""
+    failed = [r for r in results if r.error]
+    serial = sum(r.duration for r in results)
+    slowest = max(results, key=lambda r: r.duration, default=None)
+    line = f"{len(results)} region(s) in {elapsed:.1f}s wall vs {serial:.1f}s one at a time"
+    if slowest:
+        line += f" (slowest: {slowest.region} {slowest.duration:.1f}s)"
+    for r in failed:
+        line += f"\n{r.region}: FAILED after {r.attempts} attempt(s): {r.error}"
+    return line
@@ -0,0 +1,144 @@
+"""Shared EC2 drivers, a TTL cache of slow-changing listings and API call counters."""
+
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Tuple, TypeVar
+
+from libcloud.compute.providers import get_driver
+from libcloud.compute.types import Provider
+
+T = TypeVar("T")
+
+# Seconds cached sizes, locations, security groups and keypairs stay valid (0 disables caching)
+AWS_CACHE_TTL_ENV = "CLOUDY_AWS_CACHE_TTL"
+DEFAULT_CACHE_TTL = 300
+
+# Maximum API requests per second to one region, across all threads (0 disables the limit)
+AWS_RATE_ENV = "CLOUDY_AWS_RATE"
+DEFAULT_RATE = 10.0
+
+DEFAULT_REGION = "us-east-1"
+
+
+class RateLimiter:
+    """Space calls at least 1/rate seconds apart, across threads."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self, rate: float) -> None:
+        if rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + 1.0 / rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class EC2Session:
+    """
+    Process-wide EC2 drivers and listing cache.
+
+    There is one driver per credentials, region and thread: a libcloud
+    connection keeps per-request state, so threads (parallel creates, region
+    fan-out) each get their own, while calls within a thread share one.
+    Drivers live in thread-local storage, so a thread's drivers go away with
+    the thread.
+
+    Every API request made through a shared driver is counted by its EC2
+    action (DescribeInstances, RunInstances, ...), so a task can report how
+    many calls it made. Listings that rarely change during a run (sizes,
+    locations, security groups, keypairs) are cached per region for
+    CLOUDY_AWS_CACHE_TTL seconds; node state is never cached. Requests to a
+    region are spaced to at most CLOUDY_AWS_RATE per second, so a region
+    fan-out with retries stays under EC2's request throttling.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cache: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+        self._limiters: Dict[str, RateLimiter] = {}
+        self.calls: Counter = Counter()
+        self.cache_hits = 0
+
+    @property
+    def ttl(self) -> int:
+        try:
+            return max(int(os.environ.get(AWS_CACHE_TTL_ENV, str(DEFAULT_CACHE_TTL))), 0)
+        except ValueError:
+            return DEFAULT_CACHE_TTL
+
+    @property
+    def rate(self) -> float:
+        try:
+            return max(float(os.environ.get(AWS_RATE_ENV, str(DEFAULT_RATE))), 0.0)
+        except ValueError:
+            return DEFAULT_RATE
+
+    def driver(self, access_id: str, secret_key: str, region: str = "") -> Any:
+        """Return this thread's driver for these credentials and region, creating it once."""
+        region = region or DEFAULT_REGION
+        drivers: Dict[Tuple[str, str], Any] = getattr(self._local, "drivers", {})
+        self._local.drivers = drivers
+        conn = drivers.get((access_id, region))
+        if conn is None:
+            conn = get_driver(Provider.EC2)(access_id, secret_key, region=region)
+            with self._lock:
+                limiter = self._limiters.setdefault(region, RateLimiter())
+            self._count_requests(conn, limiter)
+            drivers[(access_id, region)] = conn
+        return conn
+
+    def _count_requests(self, conn: Any, limiter: RateLimiter) -> None:
+        request = conn.connection.request
+
+        def counted(action: Any, params: Any = None, *args: Any, **kwargs: Any) -> Any:
+            name = (params or {}).get("Action", action) if isinstance(params, dict) else action
+            limiter.wait(self.rate)
+            with self._lock:
+                self.calls[name] += 1
+            return request(action, params, *args, **kwargs)
+
+        conn.connection.request = counted
+
+    def cached(self, region: str, kind: str, loader: Callable[[], T]) -> T:
+        """Return a cached listing, calling loader() when it is missing or expired."""
+        key = (region or DEFAULT_REGION, kind)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and time.monotonic() - entry[1] < self.ttl:
+                self.cache_hits += 1
+                return entry[0]
+        value = loader()
+        if self.ttl:
+            with self._lock:
+                self._cache[key] = (value, time.monotonic())
+        return value
+
+    def invalidate(self, *kinds: str) -> None:
+        """Forget cached listings of the given kinds (all of them if none are given)."""
+        with self._lock:
+            for key in list(self._cache):
+                if not kinds or key[1] in kinds:
+                    del self._cache[key]
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def summary(self) -> str:
+        detail = ", ".join(f"{name} x{count}" for name, count in sorted(self.calls.items()))
+        return (
+            f"aws: {self.total_calls} API call(s)"
+            + (f" ({detail})" if detail else "")
+            + f"; {self.cache_hits} served from cache"
+        )
+
+
+ec2_session = EC2Session()
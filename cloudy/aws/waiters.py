@@ -0,0 +1,108 @@
+"""Batched EC2 node state waiters with jittered exponential backoff and a deadline."""
+
+import time
+from typing import Any, Dict, List, Optional
+
+from libcloud.common.exceptions import BaseHTTPError
+from libcloud.compute.base import Node
+from libcloud.compute.types import NodeState
+
+from cloudy.util.ready import backoff_delays
+
+# Default deadline for nodes to reach a state, in seconds (EC2 boots usually take 30-90 s)
+DEFAULT_NODE_TIMEOUT = 300.0
+
+# EC2 errors worth polling through: throttling, server-side hiccups, and new
+# instances that DescribeInstances does not know about yet
+TRANSIENT_HTTP_CODES = (429, 500, 502, 503, 504)
+TRANSIENT_EC2_ERRORS = (
+    "InvalidInstanceID.NotFound",
+    "RequestLimitExceeded",
+    "Throttling",
+    "ServiceUnavailable",
+    "Unavailable",
+    "InternalError",
+)
+
+
+def util_is_transient(error: Exception) -> bool:
+    """True for errors a later poll may not hit (network, throttling, not-yet-known IDs)."""
+    if isinstance(error, OSError):
+        return True
+    if isinstance(error, BaseHTTPError):
+        message = str(error)
+        return error.code in TRANSIENT_HTTP_CODES or any(
+            code in message for code in TRANSIENT_EC2_ERRORS
+        )
+    return False
+
+
+class NodeWaiter:
+    """
+    Wait for any number of EC2 nodes to reach a state.
+
+    Each poll is a single DescribeInstances call filtered to the instance IDs
+    still pending, so waiting for 20 nodes costs the same as waiting for one.
+    Nodes drop out of the poll as soon as they reach the state. A node that
+    terminates while waiting for another state drops out too, because it will
+    never get there. Polls back off from `initial` to `maximum` seconds, with
+    jitter so parallel waits do not hit the API in lockstep. `calls` and
+    `seconds` add up over every wait made with this waiter.
+    """
+
+    def __init__(
+        self,
+        conn: Any,
+        timeout: float = DEFAULT_NODE_TIMEOUT,
+        initial: float = 2.0,
+        maximum: float = 15.0,
+        jitter: float = 0.25,
+    ) -> None:
+        self.conn = conn
+        self.timeout = timeout
+        self.initial = initial
+        self.maximum = maximum
+        self.jitter = jitter
+        self.calls = 0
+        self.seconds = 0.0
+
+    def wait(self, node_ids: List[str], state: NodeState) -> Dict[str, Optional[Node]]:
+        """
+        Poll until every node is in `state` or the deadline passes.
+
+        Returns:
+            The last seen Node for each ID (None if it was never seen). Callers
+            check `node.state` to tell reached nodes from timed-out ones.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        nodes: Dict[str, Optional[Node]] = {i: None for i in node_ids}
+        pending = set(node_ids)
+        delays = backoff_delays(self.initial, maximum=self.maximum, jitter=self.jitter)
+        while pending:
+            self.calls += 1
+            try:
+                polled = self.conn.list_nodes(ex_node_ids=sorted(pending))
+            except (BaseHTTPError, OSError) as e:
+                # Auth, region and other request errors will not go away by polling
+                if not util_is_transient(e):
+                    raise
+                polled = []
+            for node in polled:
+                nodes[node.id] = node
+                if node.state == state or (
+                    node.state == NodeState.TERMINATED and state != NodeState.TERMINATED
+                ):
+                    pending.discard(node.id)
+            remaining = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                break
+            time.sleep(min(next(delays), remaining))
+        self.seconds += time.monotonic() - started
+        return nodes
+
+    def summary(self, count: int, state: NodeState) -> str:
+        return (
+            f"waited {self.seconds:.0f}s for {count} node(s) to reach {state}: "
+            f"{self.calls} describe call(s)"
+        )
@@ -1,9 +1,14 @@
+import io
 import os
 
 from fabric import task
 
+from cloudy.sys.core import sys_notify_service
 from cloudy.sys.etc import sys_etc_git_commit
 from cloudy.util.context import Context
+from cloudy.util.template import ConfigTemplate
+
+PGBOUNCER_TEMPLATE = ConfigTemplate("pgbouncer/pgbouncer.ini", {"dbhost": str, "dbport": int})
 
 
 @task
@@ -16,24 +21,25 @@ def db_pgbouncer_install(c: Context) -> None:
 
 @task
 @Context.wrap_context
-def db_pgbouncer_configure(c: Context, dbhost: str = "", dbport: int = 5432) -> None:
-    """Configure pgbouncer with given dbhost and dbport."""
+def db_pgbouncer_configure(c: Context, dbhost: str = "127.0.0.1", dbport: int = 5432) -> bool:
+    """
+    Configure pgbouncer with given dbhost and dbport.
+
+    Files are only uploaded when they differ, and pgbouncer is reloaded only
+    then, so no-op reruns keep client connections. Returns whether anything changed.
+    """
     cfgdir = os.path.join(os.path.dirname(__file__), "../cfg")
-    localcfg = os.path.expanduser(os.path.join(cfgdir, "pgbouncer/pgbouncer.ini"))
     remotecfg = "/etc/pgbouncer/pgbouncer.ini"
-    c.sudo(f"rm -rf {remotecfg}")
-    c.put(localcfg, "/tmp/pgbouncer.ini")
-    c.sudo(f"mv /tmp/pgbouncer.ini {remotecfg}")
-    c.sudo(f'sed -i "s/dbport/{dbport}/g" {remotecfg}')
-    if dbhost:
-        c.sudo(f'sed -i "s/dbhost/{dbhost}/g" {remotecfg}')
-
     localdefault = os.path.expanduser(os.path.join(cfgdir, "pgbouncer/default-pgbouncer"))
     remotedefault = "/etc/default/pgbouncer"
-    c.sudo(f"rm -rf {remotedefault}")
-    c.put(localdefault, "/tmp/default-pgbouncer")
-    c.sudo(f"mv /tmp/default-pgbouncer {remotedefault}")
-    sys_etc_git_commit(c, "Configured pgbouncer")
+
+    config = PGBOUNCER_TEMPLATE.render({"dbhost": dbhost, "dbport": dbport})
+    changed = c.upload(io.StringIO(config), remotecfg)
+    changed = c.upload(localdefault, remotedefault) or changed
+    if changed:
+        sys_notify_service(c, "pgbouncer", "reload")
+        sys_etc_git_commit(c, "Configured pgbouncer")
+    return changed
 
 
 @task
@@ -41,8 +47,9 @@ def db_pgbouncer_configure(c: Context, dbhost: str = "", dbport: int = 5432) ->
 def db_pgbouncer_set_user_password(c: Context, user: str, password: str) -> None:
     """Add user:pass to auth_user in pgbouncer userlist.txt."""
     userlist = "/etc/pgbouncer/userlist.txt"
-    c.sudo(f"touch {userlist}")
     c.run(f'echo \\"{user}\\" \\"{password}\\" > /tmp/pgb_user')
-    c.sudo(f"cat /tmp/pgb_user >> {userlist} && rm /tmp/pgb_user")
-    c.sudo(f"chown postgres:postgres {userlist}")
-    c.sudo(f"chmod 600 {userlist}")
+    with c.batch():
+        c.sudo(f"touch {userlist}")
+        c.sudo(f"cat /tmp/pgb_user >> {userlist} && rm /tmp/pgb_user")
+        c.sudo(f"chown postgres:postgres {userlist}")
+        c.sudo(f"chmod 600 {userlist}")
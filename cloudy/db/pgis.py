@@ -1,14 +1,39 @@
 import re
 import sys
+from typing import List
 
 from fabric import task
 
 from cloudy.db.psql import db_psql_default_installed_version
+from cloudy.sys.apt import sys_apt_install, util_apt_missing
 from cloudy.sys.core import sys_start_service
 from cloudy.sys.etc import sys_etc_git_commit
 from cloudy.util.context import Context
 
 
+def pgis_packages(psql_version: str, pgis_version: str) -> List[str]:
+    """Return the apt packages for postgis on a given postgres version."""
+    return [
+        f"postgresql-{psql_version}-postgis-{pgis_version}",
+        "postgis",
+        "libproj-dev",
+        "gdal-bin",
+        "binutils",
+        "libgeos-c1v5",
+        "libgeos-dev",
+        "libgdal-dev",
+        "libgeoip-dev",
+        "libpq-dev",
+        "libxml2",
+        "libxml2-dev",
+        "libxml2-utils",
+        "libjson-c-dev",
+        "xsltproc",
+        "docbook-xsl",
+        "docbook-mathml",
+    ]
+
+
 @task
 @Context.wrap_context
 def db_pgis_install(c: Context, psql_version: str = "", pgis_version: str = "") -> None:
@@ -18,29 +43,11 @@ def db_pgis_install(c: Context, psql_version: str = "", pgis_version: str = "")
     if not pgis_version:
         pgis_version = db_pgis_get_latest_version(c, psql_version)
 
-    requirements = " ".join(
-        [
-            f"postgresql-{psql_version}-postgis-{pgis_version}",
-            "postgis",
-            "libproj-dev",
-            "gdal-bin",
-            "binutils",
-            "libgeos-c1v5",
-            "libgeos-dev",
-            "libgdal-dev",
-            "libgeoip-dev",
-            "libpq-dev",
-            "libxml2",
-            "libxml2-dev",
-            "libxml2-utils",
-            "libjson-c-dev",
-            "xsltproc",
-            "docbook-xsl",
-            "docbook-mathml",
-        ]
-    )
-    c.sudo("apt -y purge postgis")
-    c.sudo(f"apt -y install {requirements}")
+    # Purge only to switch versions; if the wanted one is installed, leave it alone
+    packages = pgis_packages(psql_version, pgis_version)
+    if util_apt_missing(c, packages[:1]):
+        c.sudo("apt -y purge postgis", warn=True)
+    sys_apt_install(c, packages)
     sys_start_service(c, "postgresql")
     sys_etc_git_commit(c, f"Installed postgis for psql ({psql_version})")
 
@@ -2,46 +2,76 @@ import datetime
 import os
 import re
 import sys
-from typing import Optional
+from typing import List, Optional
 
 from fabric import task
 
 from cloudy.sys import core
+from cloudy.sys.apt import sys_apt_install
 from cloudy.util.context import Context
 
+PGDG_KEY_URL = "https://www.postgresql.org/media/keys/ACCC4CF8.asc"
+PGDG_KEY_FINGERPRINT = "B97B0AFCAA1A47F044F244A07FCC7D46ACCC4CF8"
+PGDG_KEYRING = "/etc/apt/keyrings/postgresql.gpg"
+PGDG_SOURCES = "/etc/apt/sources.list.d/pgdg.list"
+PGDG_ENTRY = (
+    f"deb [signed-by={PGDG_KEYRING}] "
+    "https://apt.postgresql.org/pub/repos/apt/ $(lsb_release -cs)-pgdg main"
+)
+
+
+def _pgdg_repo_is_current(c: Context) -> bool:
+    """Check keyring fingerprint, sources entry and fetched package lists in one command."""
+    check = (
+        f"gpg --show-keys --with-colons {PGDG_KEYRING} 2>/dev/null "
+        f"| grep -q {PGDG_KEY_FINGERPRINT}"
+        f' && [ "$(cat {PGDG_SOURCES} 2>/dev/null)" = "{PGDG_ENTRY}" ]'
+        " && ls /var/lib/apt/lists/ | grep -q apt.postgresql.org"
+    )
+    return c.run(check, hide=True, warn=True).ok
+
 
 @task
 @Context.wrap_context
-def db_psql_install_postgres_repo(c: Context) -> None:
+def db_psql_install_postgres_repo(c: Context, force: bool = False) -> None:
     """Install the official PostgreSQL repository using modern gpg keyring approach."""
+    if not force and c.facts.get("pgdg_repo", lambda: _pgdg_repo_is_current(c)):
+        print("PostgreSQL repository is already configured, skipping", file=sys.stderr)
+        return
 
     # Create the keyring directory if it doesn't exist
     c.sudo("mkdir -p /etc/apt/keyrings")
 
     # Download and install the PostgreSQL signing key to a dedicated keyring file
     # Force overwrite if file exists
-    c.sudo("wget --quiet -O /tmp/postgresql.asc https://www.postgresql.org/media/keys/ACCC4CF8.asc")
-    c.sudo("gpg --dearmor --yes -o /etc/apt/keyrings/postgresql.gpg /tmp/postgresql.asc")
+    c.sudo(f"wget --quiet -O /tmp/postgresql.asc {PGDG_KEY_URL}")
+    c.sudo(f"gpg --dearmor --yes -o {PGDG_KEYRING} /tmp/postgresql.asc")
     c.sudo("rm -f /tmp/postgresql.asc")
 
     # Set proper permissions for the keyring file
-    c.sudo("chmod 644 /etc/apt/keyrings/postgresql.gpg")
+    c.sudo(f"chmod 644 {PGDG_KEYRING}")
 
     # Add the PostgreSQL repository with the signed-by option pointing to the keyring
-    c.sudo(
-        "sh -c 'echo \"deb [signed-by=/etc/apt/keyrings/postgresql.gpg] "
-        'https://apt.postgresql.org/pub/repos/apt/ $(lsb_release -cs)-pgdg main" '
-        "> /etc/apt/sources.list.d/pgdg.list'"
-    )
+    c.sudo(f"sh -c 'echo \"{PGDG_ENTRY}\" > {PGDG_SOURCES}'")
 
     # Update package lists
     c.sudo("apt update")
 
+    c.facts.set("pgdg_repo", True)
+    c.facts.invalidate("psql_latest_version")
+
 
 @task
 @Context.wrap_context
 def db_psql_latest_version(c: Context) -> str:
     """Get the latest available postgres version."""
+    latest_version = c.facts.get("psql_latest_version", lambda: _probe_psql_latest_version(c))
+    print(f"Latest available postgresql is: [{latest_version}]", file=sys.stderr)
+    return latest_version
+
+
+def _probe_psql_latest_version(c: Context) -> str:
+    """Search the PostgreSQL repository for the highest postgresql-client version."""
     db_psql_install_postgres_repo(c)
     latest_version: str = ""
 
@@ -72,7 +102,6 @@ def db_psql_latest_version(c: Context) -> str:
         versions.sort(key=lambda x: x[0], reverse=True)
         latest_version = versions[0][1]
 
-    print(f"Latest available postgresql is: [{latest_version}]", file=sys.stderr)
     return latest_version
 
 
@@ -80,6 +109,13 @@ def db_psql_latest_version(c: Context) -> str:
 @Context.wrap_context
 def db_psql_default_installed_version(c: Context) -> str:
     """Get the default installed postgres version."""
+    default_version = c.facts.get("psql_version", lambda: _probe_psql_version(c))
+    print(f"Default installed postgresql is: [{default_version}]", file=sys.stderr)
+    return default_version
+
+
+def _probe_psql_version(c: Context) -> str:
+    """Run `psql --version` and return the major version (or major.minor before 10)."""
     default_version: str = ""
 
     try:
@@ -110,10 +146,19 @@ def db_psql_default_installed_version(c: Context) -> str:
     except Exception as e:
         print(f"Error getting PostgreSQL version: {e}", file=sys.stderr)
 
-    print(f"Default installed postgresql is: [{default_version}]", file=sys.stderr)
     return default_version
 
 
+def psql_packages(version: str) -> List[str]:
+    """Return the core apt packages for a PostgreSQL server of the given version."""
+    return [
+        f"postgresql-{version}",
+        f"postgresql-client-{version}",
+        f"postgresql-contrib-{version}",
+        "postgresql-client-common",
+    ]
+
+
 @task
 @Context.wrap_context
 def db_psql_install(c: Context, version: str = "") -> None:
@@ -129,12 +174,7 @@ def db_psql_install(c: Context, version: str = "") -> None:
     print(f"Installing PostgreSQL version: {version}", file=sys.stderr)
 
     # Core PostgreSQL packages - these should always be available
-    core_requirements = [
-        f"postgresql-{version}",
-        f"postgresql-client-{version}",
-        f"postgresql-contrib-{version}",
-        "postgresql-client-common",
-    ]
+    core_requirements = psql_packages(version)
 
     # Optional development package - might not exist for all versions
     dev_package = f"postgresql-server-dev-{version}"
@@ -146,22 +186,13 @@ def db_psql_install(c: Context, version: str = "") -> None:
     else:
         print(f"Warning: {dev_package} not available, skipping", file=sys.stderr)
 
-    requirements = " ".join(core_requirements)
-
     # Install with better error handling
-    result = c.sudo(f"apt -y install {requirements}", warn=True)
+    result = sys_apt_install(c, core_requirements, warn=True)
 
-    if not result.ok:
+    if result is not None and not result.ok:
         print("Installation failed. Trying alternative package names...", file=sys.stderr)
         # Fallback: try with different package naming for older versions
-        fallback_requirements = [
-            f"postgresql-{version}",
-            f"postgresql-client-{version}",
-            f"postgresql-contrib-{version}",
-            "postgresql-client-common",
-        ]
-        fallback_cmd = " ".join(fallback_requirements)
-        c.sudo(f"apt -y install {fallback_cmd}")
+        sys_apt_install(c, psql_packages(version))
 
     # Verify installation
     verify_result = c.run(f'dpkg -l | grep "postgresql-{version}"', hide=True, warn=True)
@@ -186,14 +217,17 @@ def db_psql_client_install(c: Context, version: str = "") -> None:
 
     # Try with dev package first, fallback without it
     try:
-        requirements = (
-            f"postgresql-client-{version} postgresql-server-dev-{version} postgresql-client-common"
+        sys_apt_install(
+            c,
+            [
+                f"postgresql-client-{version}",
+                f"postgresql-server-dev-{version}",
+                "postgresql-client-common",
+            ],
         )
-        c.sudo(f"apt -y install {requirements}")
     except Exception:
         # Fallback without dev package
-        requirements = f"postgresql-client-{version} postgresql-client-common"
-        c.sudo(f"apt -y install {requirements}")
+        sys_apt_install(c, [f"postgresql-client-{version}", "postgresql-client-common"])
 
     core.sys_etc_git_commit(c, f"Installed postgres client ({version})")
 
@@ -283,13 +317,11 @@ def db_psql_set_permission(c: Context, version: str = "", cluster: str = "main")
     cfgdir = os.path.join(os.path.dirname(__file__), "../cfg")
     localcfg = os.path.expanduser(os.path.join(cfgdir, "postgresql/pg_hba.conf"))
     remotecfg = f"/etc/postgresql/{version}/{cluster}/pg_hba.conf"
-    c.sudo(f"rm -rf {remotecfg}")
-    c.put(localcfg, "/tmp/pg_hba.conf")
-    c.sudo(f"mv /tmp/pg_hba.conf {remotecfg}")
-    c.sudo(f"chown postgres:postgres {remotecfg}")
-    c.sudo(f"chmod 644 {remotecfg}")
+    changed = c.upload(localcfg, remotecfg, owner="postgres:postgres", mode="644")
     core.sys_start_service(c, "postgresql")
-    core.sys_etc_git_commit(c, f"Set default postgres access for cluster ({version} {cluster})")
+    if changed:
+        core.sys_notify_service(c, "postgresql", "reload")
+        core.sys_etc_git_commit(c, f"Set default postgres access for cluster ({version} {cluster})")
 
 
 @task
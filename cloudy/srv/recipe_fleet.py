@@ -0,0 +1,98 @@
+"""Run any recipe against a fleet of hosts in parallel."""
+
+import sys
+
+from fabric import Config, task
+
+from cloudy.srv import (
+    recipe_cache_redis,
+    recipe_database_psql_gis,
+    recipe_generic_server,
+    recipe_loadbalancer_nginx,
+    recipe_standalone_server,
+    recipe_vpn_server,
+    recipe_webserver_django,
+)
+from cloudy.util.fleet import FleetRunner, format_summary, resolve_hosts
+
+# Recipe names as exposed under `fab recipe.*`
+RECIPES = {
+    "gen-install": recipe_generic_server.setup_server,
+    "redis-install": recipe_cache_redis.setup_redis,
+    "psql-install": recipe_database_psql_gis.setup_db,
+    "web-install": recipe_webserver_django.setup_web,
+    "lb-install": recipe_loadbalancer_nginx.setup_lb,
+    "vpn-install": recipe_vpn_server.setup_openvpn,
+    "sta-install": recipe_standalone_server.setup_standalone,
+}
+
+
+@task
+def fleet_run(
+    c,
+    recipe: str,
+    hosts: str = "",
+    inventory: str = "",
+    groups: str = "",
+    cfg_paths=None,
+    concurrency: str = "5",
+) -> None:
+    """
+    Run a recipe on many hosts at once.
+
+    Hosts come from a comma-separated --hosts list and/or groups of an
+    inventory file. Up to --concurrency hosts are provisioned in parallel;
+    each host's output is printed as one prefixed block when it finishes,
+    and a status/duration table is printed at the end. Exits non-zero if
+    any host failed. Set INVOKE_SUDO_PASSWORD rather than relying on
+    interactive prompts, since several hosts may ask at the same time.
+
+    Args:
+        recipe: Recipe name, e.g. web-install (see `fab -l recipe`)
+        hosts: Comma-separated hosts (user@host:port)
+        inventory: Path to an inventory file with [group] sections, or
+            ec2:<filters> (e.g. ec2:role=web,state=running) to use the EC2 index
+        groups: Comma-separated inventory groups (default: all)
+        cfg_paths: Comma-separated config file paths passed to the recipe
+        concurrency: Maximum number of hosts to run at once
+
+    Example:
+        fab fleet.run --recipe=web-install --inventory=./hosts.ini --groups=web \\
+            --cfg-paths="./.cloudy.generic,./.cloudy.web" --concurrency=10
+    """
+    if recipe not in RECIPES:
+        print(f"❌ Unknown recipe '{recipe}'. Choose from: {', '.join(sorted(RECIPES))}")
+        sys.exit(1)
+
+    try:
+        targets = resolve_hosts(hosts, inventory, groups)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    config = c.config if isinstance(c.config, Config) else None
+    runner = FleetRunner(concurrency=int(concurrency), config=config)
+    print(f"🚀 Running recipe.{recipe} on {len(targets)} host(s), {runner.concurrency} at a time")
+    results = runner.run(targets, RECIPES[recipe], cfg_paths=cfg_paths)
+
+    print("\n" + format_summary(results, runner.elapsed))
+    if any(not r.ok for r in results):
+        sys.exit(1)
+
+
+@task
+def fleet_hosts(c, hosts: str = "", inventory: str = "", groups: str = "") -> None:
+    """
+    Show the hosts a fleet run would target.
+
+    Example:
+        fab fleet.hosts --inventory=./hosts.ini --groups=web,db
+        fab fleet.hosts --inventory=ec2:role=web,state=running,zone=us-east-1a
+    """
+    try:
+        targets = resolve_hosts(hosts, inventory, groups)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    for host in targets:
+        print(host)
@@ -3,7 +3,7 @@
 from fabric import task
 
 from cloudy.srv import recipe_generic_server
-from cloudy.sys import firewall
+from cloudy.sys import core, firewall
 from cloudy.util.conf import CloudyConfig
 from cloudy.util.context import Context
 from cloudy.web import nginx
@@ -26,30 +26,31 @@ def setup_lb(c: Context, cfg_paths=None, generic=True):
     Example:
         fab recipe.lb-install --cfg-paths="./.cloudy.generic,./.cloudy.lb"
     """
-    cfg = CloudyConfig(cfg_paths)
+    cfg = CloudyConfig.load(cfg_paths)
 
-    if generic:
-        c = recipe_generic_server.setup_server(c, cfg_paths)
+    # Restarts/reloads and /etc commits requested below run once, at the end
+    with core.deferred_changes(c):
+        if generic:
+            c = recipe_generic_server.setup_server(c, cfg_paths)
 
-    firewall.fw_allow_incoming_http(c)
-    firewall.fw_allow_incoming_https(c)
+        firewall.FirewallRules().allow("http").allow("https").apply(c)
 
-    # install nginx
-    nginx.web_nginx_install(c)
-    protocol = "http"
-    domain_name = cfg.get_variable("webserver", "domain-name", "example.com")
-    certificate_path = cfg.get_variable("common", "certificate-path")
-    if certificate_path:
-        nginx.web_nginx_copy_ssl(c, domain_name, certificate_path)
-        protocol = "https"
+        # install nginx
+        nginx.web_nginx_install(c)
+        protocol = "http"
+        domain_name = cfg.get_variable("webserver", "domain-name", "example.com")
+        certificate_path = cfg.get_variable("common", "certificate-path")
+        if certificate_path:
+            nginx.web_nginx_copy_ssl(c, domain_name, certificate_path)
+            protocol = "https"
 
-    binding_address = cfg.get_variable("webserver", "binding-address", "*")
-    upstream_address = cfg.get_variable("webserver", "upstream-address")
-    upstream_port = cfg.get_variable("webserver", "upstream-port", "8181")
-    if upstream_address and upstream_port:
-        nginx.web_nginx_setup_domain(
-            c, domain_name, protocol, binding_address, upstream_address, upstream_port
-        )
+        binding_address = cfg.get_variable("webserver", "binding-address", "*")
+        upstream_address = cfg.get_variable("webserver", "upstream-address")
+        upstream_port = cfg.get_variable("webserver", "upstream-port", "8181")
+        if upstream_address and upstream_port:
+            nginx.web_nginx_setup_domain(
+                c, domain_name, protocol, binding_address, upstream_address, upstream_port
+            )
 
     # Success message
     print("\n🎉 ✅ NGINX LOAD BALANCER SETUP COMPLETED SUCCESSFULLY!")
@@ -4,15 +4,16 @@ from fabric import task
 
 from cloudy.db import pgis, pgpool, psql
 from cloudy.srv import recipe_generic_server
-from cloudy.sys import core, firewall, python, user
+from cloudy.sys import apt, core, firewall, python, user
 from cloudy.util.conf import CloudyConfig
 from cloudy.util.context import Context
+from cloudy.util.steps import StepGraph
 from cloudy.web import apache, geoip, nginx, supervisor, www
 
 
 @task
 @Context.wrap_context
-def setup_standalone(c: Context, cfg_paths=None) -> None:
+def setup_standalone(c: Context, cfg_paths=None, from_step: str = "", force_step: str = "") -> None:
     """
     Setup complete standalone server with all services integrated.
 
@@ -22,107 +23,188 @@ def setup_standalone(c: Context, cfg_paths=None) -> None:
 
     Args:
         cfg_paths: Comma-separated config file paths
+        from_step: Rerun from this step onward, treating earlier steps as done
+        force_step: Comma-separated steps to rerun even if already done
 
     Example:
         fab recipe.sta-install --cfg-paths="./.cloudy.generic,./.cloudy.standalone"
+        fab recipe.sta-install --cfg-paths="..." --from-step=postgres-cluster
     """
-    cfg = CloudyConfig(cfg_paths)
-
-    # ====== Generic Server =========
-    c = recipe_generic_server.setup_server(c, cfg_paths)
-
-    # ====== Database Server =========
-    dbaddress = cfg.get_variable("dbserver", "listen-address")
-    if dbaddress and "*" not in dbaddress:
-        core.sys_add_hosts(c, "db-host", dbaddress)
-
-    pg_version = cfg.get_variable("dbserver", "pg-version")
-    pg_listen_address = cfg.get_variable("dbserver", "listen-address", "*")
-    pg_port = cfg.get_variable("dbserver", "pg-port", "5432")
-    pg_cluster = cfg.get_variable("dbserver", "pg-cluster", "main")
-    pg_encoding = cfg.get_variable("dbserver", "pg-encoding", "UTF-8")
-    pg_data_dir = cfg.get_variable("dbserver", "pg-data-dir", "/var/lib/postgresql")
-
-    psql.db_psql_install(c, pg_version)
-    psql.db_psql_make_data_dir(c, pg_version, pg_data_dir)
-    psql.db_psql_remove_cluster(c, pg_version, pg_cluster)
-    psql.db_psql_create_cluster(c, pg_version, pg_cluster, pg_encoding, pg_data_dir)
-    psql.db_psql_set_permission(c, pg_version, pg_cluster)
-    psql.db_psql_configure(
-        c, version=pg_version, port=pg_port, interface=pg_listen_address, restart=True
-    )
-
-    # change postgres' db user password
-    postgres_user_pass = cfg.get_variable("dbserver", "postgres-pass")
-    if postgres_user_pass:
-        psql.db_psql_user_password(c, "postgres", postgres_user_pass)
-
-    # change postgres' system user password
-    postgres_sys_user_pass = cfg.get_variable("dbserver", "postgres-sys-pass")
-    if postgres_sys_user_pass:
-        user.sys_user_change_password(c, "postgres", postgres_sys_user_pass)
-
-    # pgis version
-    pgis_version = cfg.get_variable("dbserver", "pgis-version")
-    pgis.db_pgis_install(c, pg_version, pgis_version)
-    pgis.db_pgis_configure(c, pg_version, pgis_version)
-    pgis.db_pgis_get_database_gis_info(c, "template_postgis")
-
-    pgpool.db_pgpool2_install(c)
-    db_host = cfg.get_variable("dbserver", "db-host")
-    if db_host:
+    cfg = CloudyConfig.load(cfg_paths)
+
+    # Restarts/reloads and /etc commits requested below run once, at the end
+    with core.deferred_changes(c):
+        # ====== Generic Server =========
+        c = recipe_generic_server.setup_server(c, cfg_paths, from_step, force_step)
+
+        # ====== Database Server =========
+        dbaddress = cfg.get_variable("dbserver", "listen-address")
+        if dbaddress and "*" not in dbaddress:
+            core.sys_add_hosts(c, "db-host", dbaddress)
+
+        pg_version = cfg.get_variable("dbserver", "pg-version")
+        pg_listen_address = cfg.get_variable("dbserver", "listen-address", "*")
+        pg_port = cfg.get_variable("dbserver", "pg-port", "5432")
+        pg_cluster = cfg.get_variable("dbserver", "pg-cluster", "main")
+        pg_encoding = cfg.get_variable("dbserver", "pg-encoding", "UTF-8")
+        pg_data_dir = cfg.get_variable("dbserver", "pg-data-dir", "/var/lib/postgresql")
+        pgis_version = cfg.get_variable("dbserver", "pgis-version")
+        postgres_user_pass = cfg.get_variable("dbserver", "postgres-pass")
+        postgres_sys_user_pass = cfg.get_variable("dbserver", "postgres-sys-pass")
+        db_host = cfg.get_variable("dbserver", "db-host")
         db_port = cfg.get_variable("dbserver", "db-port", "5432")
-        pgpool.db_pgpool2_configure(c, dbhost=db_host, dbport=db_port)
-        db_listen_address = cfg.get_variable("dbserver", "listen-address")
-        if db_listen_address:
-            core.sys_add_hosts(c, db_host, db_listen_address)
-
-    # ====== Web Server =========
-    py_version = cfg.get_variable("common", "python-version")
-    python.sys_python_install_common(c, py_version)
-
-    webserver = cfg.get_variable("webserver", "webserver")
-    if webserver and webserver.lower() == "apache":
-        apache.web_apache2_install(c)
-        apache.web_apache2_install_mods(c)
-    elif webserver and webserver.lower() == "gunicorn":
-        supervisor.web_supervisor_install(c)
-
-    www.web_create_data_directory(c)
-
-    # hostname, cache server
-    cache_host = cfg.get_variable("cacheserver", "cache-host")
-    cache_listen_address = cfg.get_variable("cacheserver", "listen-address")
-    if cache_host and cache_listen_address:
-        core.sys_add_hosts(c, cache_host, cache_listen_address)
-
-    # geoIP
-    geo_ip = cfg.get_variable("webserver", "geo-ip")
-    if geo_ip:
-        geoip.web_geoip_install_requirements(c)
-        geoip.web_geoip_install_maxmind_api(c)
-        geoip.web_geoip_install_maxmind_country(c)
-        geoip.web_geoip_install_maxmind_city(c)
-
-    # ====== Load Balancer Server =========
-    firewall.fw_allow_incoming_http(c)
-    firewall.fw_allow_incoming_https(c)
-
-    nginx.web_nginx_install(c)
-    protocol = "http"
-    domain_name = cfg.get_variable("webserver", "domain-name", "example.com")
-    certificate_path = cfg.get_variable("common", "certificate-path")
-    if certificate_path:
-        nginx.web_nginx_copy_ssl(c, domain_name, certificate_path)
-        protocol = "https"
+        py_version = cfg.get_variable("common", "python-version")
+        webserver = (cfg.get_variable("webserver", "webserver") or "").lower()
+        cache_host = cfg.get_variable("cacheserver", "cache-host")
+        cache_listen_address = cfg.get_variable("cacheserver", "listen-address")
+        geo_ip = cfg.get_variable("webserver", "geo-ip")
+        domain_name = cfg.get_variable("webserver", "domain-name", "example.com")
+        certificate_path = cfg.get_variable("common", "certificate-path")
+        protocol = "https" if certificate_path else "http"
+        binding_address = cfg.get_variable("webserver", "binding-address", "*")
+        upstream_address = cfg.get_variable("webserver", "upstream-address")
+        upstream_port = cfg.get_variable("webserver", "upstream-port", "8181")
+
+        # Resolve versions up front so the whole stack installs in one apt transaction
+        psql.db_psql_install_postgres_repo(c)
+        pg_version = pg_version or psql.db_psql_latest_version(c)
+        pgis_version = pgis_version or pgis.db_pgis_get_latest_version(c, pg_version)
+        plan = apt.AptPlan()
+        plan.add("postgresql", psql.psql_packages(pg_version))
+        plan.add("postgis", pgis.pgis_packages(pg_version, pgis_version))
+        if py_version:
+            plan.add("python", python.python_packages(py_version))
+        plan.add("nginx", nginx.NGINX_PACKAGES)
+        if webserver == "apache":
+            plan.add("apache", apache.APACHE_PACKAGES + apache.apache2_mod_packages())
+        elif webserver == "gunicorn":
+            plan.add("supervisor", supervisor.SUPERVISOR_PACKAGES)
+
+        # Independent steps overlap on separate SSH channels. Locks serialize shared host
+        # resources: apt ("dpkg"), /etc/hosts ("hosts"), ufw and the /tmp/maxmind work dir.
+        # Every step that commits to /etc or starts/restarts a service holds "etc", so two
+        # steps never race on /etc/.git/index.lock or on the same unit.
+        # Step names differ from the generic recipe's, since --from-step/--force-step go to both
+        steps = StepGraph("standalone", journal=True)
+
+        @steps.step("stack-packages", locks=["dpkg"], inputs=plan.packages)
+        def _(c):
+            plan.install(c)
+
+        # ====== Database Server =========
+        @steps.step(
+            "postgres-install",
+            requires=["stack-packages"],
+            locks=["dpkg", "etc"],
+            inputs=pg_version,
+        )
+        def _(c):
+            psql.db_psql_install(c, pg_version)
 
-    binding_address = cfg.get_variable("webserver", "binding-address", "*")
-    upstream_address = cfg.get_variable("webserver", "upstream-address")
-    upstream_port = cfg.get_variable("webserver", "upstream-port", "8181")
-    if upstream_address and upstream_port:
-        nginx.web_nginx_setup_domain(
-            c, domain_name, protocol, binding_address, upstream_address, upstream_port
+        # Passwords stay out of the journaled inputs; use --force-step=postgres-cluster to reset
+        pg_inputs = [pg_listen_address, pg_port, pg_cluster, pg_encoding, pg_data_dir]
+
+        @steps.step(
+            "postgres-cluster", requires=["postgres-install"], locks=["etc"], inputs=pg_inputs
+        )
+        def _(c):
+            psql.db_psql_make_data_dir(c, pg_version, pg_data_dir)
+            psql.db_psql_remove_cluster(c, pg_version, pg_cluster)
+            psql.db_psql_create_cluster(c, pg_version, pg_cluster, pg_encoding, pg_data_dir)
+            psql.db_psql_set_permission(c, pg_version, pg_cluster)
+            psql.db_psql_configure(
+                c, version=pg_version, port=pg_port, interface=pg_listen_address, restart=True
+            )
+            # change postgres' db user password
+            if postgres_user_pass:
+                psql.db_psql_user_password(c, "postgres", postgres_user_pass)
+            # change postgres' system user password
+            if postgres_sys_user_pass:
+                user.sys_user_change_password(c, "postgres", postgres_sys_user_pass)
+
+        @steps.step(
+            "postgis", requires=["postgres-cluster"], locks=["dpkg", "etc"], inputs=pgis_version
+        )
+        def _(c):
+            pgis.db_pgis_install(c, pg_version, pgis_version)
+            pgis.db_pgis_configure(c, pg_version, pgis_version)
+            pgis.db_pgis_get_database_gis_info(c, "template_postgis")
+
+        @steps.step(
+            "pgpool",
+            requires=["postgres-cluster"],
+            locks=["dpkg", "hosts", "etc"],
+            inputs=[db_host, db_port, dbaddress],
+        )
+        def _(c):
+            pgpool.db_pgpool2_install(c)
+            if db_host:
+                pgpool.db_pgpool2_configure(c, dbhost=db_host, dbport=db_port)
+                if dbaddress:
+                    core.sys_add_hosts(c, db_host, dbaddress)
+
+        # ====== Web Server =========
+        @steps.step("python", requires=["stack-packages"], locks=["dpkg", "etc"], inputs=py_version)
+        def _(c):
+            python.sys_python_install_common(c, py_version)
+
+        @steps.step(
+            "webserver", requires=["stack-packages"], locks=["dpkg", "etc"], inputs=webserver
         )
+        def _(c):
+            if webserver == "apache":
+                apache.web_apache2_install(c)
+                apache.web_apache2_install_mods(c)
+            elif webserver == "gunicorn":
+                supervisor.web_supervisor_install(c)
+
+        @steps.step("www")
+        def _(c):
+            www.web_create_data_directory(c)
+
+        @steps.step("cache-host", locks=["hosts", "etc"], inputs=[cache_host, cache_listen_address])
+        def _(c):
+            # hostname, cache server
+            if cache_host and cache_listen_address:
+                core.sys_add_hosts(c, cache_host, cache_listen_address)
+
+        if geo_ip:
+
+            @steps.step("geoip-requirements", requires=["stack-packages"], locks=["dpkg", "etc"])
+            def _(c):
+                geoip.web_geoip_install_requirements(c)
+
+            @steps.step("geoip-api", requires=["geoip-requirements"], locks=["maxmind-tmp", "etc"])
+            def _(c):
+                geoip.web_geoip_install_maxmind_api(c)
+
+            @steps.step("geoip-data", requires=["www"], locks=["maxmind-tmp"])
+            def _(c):
+                geoip.web_geoip_install_maxmind_country(c)
+                geoip.web_geoip_install_maxmind_city(c)
+
+        # ====== Load Balancer Server =========
+        @steps.step("web-firewall", locks=["ufw"])
+        def _(c):
+            firewall.FirewallRules().allow("http").allow("https").apply(c)
+
+        @steps.step("nginx", requires=["stack-packages"], locks=["dpkg", "etc"])
+        def _(c):
+            nginx.web_nginx_install(c)
+
+        nginx_site_inputs = [domain_name, certificate_path, binding_address]
+        nginx_site_inputs += [upstream_address, upstream_port]
+
+        @steps.step("nginx-site", requires=["nginx"], locks=["etc"], inputs=nginx_site_inputs)
+        def _(c):
+            if certificate_path:
+                nginx.web_nginx_copy_ssl(c, domain_name, certificate_path)
+            if upstream_address and upstream_port:
+                nginx.web_nginx_setup_domain(
+                    c, domain_name, protocol, binding_address, upstream_address, upstream_port
+                )
+
+        c = steps.run(c, from_step=from_step, force_steps=force_step.split(","))
 
     # Success message
     print("\n🎉 ✅ STANDALONE SERVER SETUP COMPLETED SUCCESSFULLY!")
@@ -25,58 +25,60 @@ def setup_openvpn(c: Context, cfg_paths=None, generic=True):
     Example:
         fab recipe.vpn-install --cfg-paths="./.cloudy.generic,./.cloudy.vpn"
     """
-    cfg = CloudyConfig(cfg_paths)
+    cfg = CloudyConfig.load(cfg_paths)
 
-    if generic:
-        c = recipe_generic_server.setup_server(c, cfg_paths)
+    # Restarts/reloads and /etc commits requested below run once, at the end
+    with core.deferred_changes(c):
+        if generic:
+            c = recipe_generic_server.setup_server(c, cfg_paths)
 
-    # Install and configure Docker for OpenVPN
-    admin_user = cfg.get_variable("common", "admin-user")
-    docker.sys_docker_install(c)
-    docker.sys_docker_config(c)
-    docker.sys_docker_user_group(c, admin_user)
+        # Install and configure Docker for OpenVPN
+        admin_user = cfg.get_variable("common", "admin-user")
+        docker.sys_docker_install(c)
+        docker.sys_docker_config(c)
+        docker.sys_docker_user_group(c, admin_user)
 
-    domain = cfg.get_variable("VPNSERVER", "vpn-domain")
-    if not domain:
-        print("domain is missing from VPNSERVER section")
-        return
+        domain = cfg.get_variable("VPNSERVER", "vpn-domain")
+        if not domain:
+            print("domain is missing from VPNSERVER section")
+            return
 
-    passphrase = cfg.get_variable("VPNSERVER", "passphrase", "nopass")
-    repository = cfg.get_variable("VPNSERVER", "repo", "kylemanna/openvpn")
-    datadir = cfg.get_variable("VPNSERVER", "data-dir", "/docker/openvpn")
-    core.sys_mkdir(c, datadir)
+        passphrase = cfg.get_variable("VPNSERVER", "passphrase", "nopass")
+        repository = cfg.get_variable("VPNSERVER", "repo", "kylemanna/openvpn")
+        datadir = cfg.get_variable("VPNSERVER", "data-dir", "/docker/openvpn")
+        core.sys_mkdir(c, datadir)
 
-    # Primary OpenVPN instance
-    primary_port = cfg.get_variable("VPNSERVER", "primary-port", "80")
-    primary_proto = cfg.get_variable("VPNSERVER", "primary-proto", "udp")
-    if primary_port and primary_proto:
-        openvpn.sys_openvpn_docker_install(
-            c,
-            domain=domain,
-            port=primary_port,
-            proto=primary_proto,
-            passphrase=passphrase,
-            datadir=datadir,
-            repo=repository,
-        )
-        openvpn.sys_openvpn_docker_conf(c, domain, primary_port, primary_proto)
-        firewall.fw_allow_incoming_port_proto(c, primary_port, primary_proto)
+        # Primary OpenVPN instance
+        primary_port = cfg.get_variable("VPNSERVER", "primary-port", "80")
+        primary_proto = cfg.get_variable("VPNSERVER", "primary-proto", "udp")
+        if primary_port and primary_proto:
+            openvpn.sys_openvpn_docker_install(
+                c,
+                domain=domain,
+                port=primary_port,
+                proto=primary_proto,
+                passphrase=passphrase,
+                datadir=datadir,
+                repo=repository,
+            )
+            openvpn.sys_openvpn_docker_conf(c, domain, primary_port, primary_proto)
+            firewall.fw_allow_incoming_port_proto(c, primary_port, primary_proto)
 
-    # Secondary OpenVPN instance
-    secondary_port = cfg.get_variable("VPNSERVER", "secondary-port", "443")
-    secondary_proto = cfg.get_variable("VPNSERVER", "secondary-proto", "tcp")
-    if secondary_port and secondary_proto:
-        openvpn.sys_openvpn_docker_install(
-            c,
-            domain=domain,
-            port=secondary_port,
-            proto=secondary_proto,
-            passphrase=passphrase,
-            datadir=datadir,
-            repo=repository,
-        )
-        openvpn.sys_openvpn_docker_conf(c, domain, secondary_port, secondary_proto)
-        firewall.fw_allow_incoming_port_proto(c, secondary_port, secondary_proto)
+        # Secondary OpenVPN instance
+        secondary_port = cfg.get_variable("VPNSERVER", "secondary-port", "443")
+        secondary_proto = cfg.get_variable("VPNSERVER", "secondary-proto", "tcp")
+        if secondary_port and secondary_proto:
+            openvpn.sys_openvpn_docker_install(
+                c,
+                domain=domain,
+                port=secondary_port,
+                proto=secondary_proto,
+                passphrase=passphrase,
+                datadir=datadir,
+                repo=repository,
+            )
+            openvpn.sys_openvpn_docker_conf(c, domain, secondary_port, secondary_proto)
+            firewall.fw_allow_incoming_port_proto(c, secondary_port, secondary_proto)
 
     # Success message
     print("\n🎉 ✅ OPENVPN SERVER SETUP COMPLETED SUCCESSFULLY!")
@@ -0,0 +1,179 @@
+"""Coalesced apt operations: freshness-stamped updates and merged install transactions."""
+
+import sys
+import time
+from typing import Dict, Iterable, List
+
+from fabric import task
+
+from cloudy.util.context import Context
+
+APT_UPDATE_STAMP = "/var/lib/cloudy/apt-update.stamp"
+APT_INSTALL = "DEBIAN_FRONTEND=noninteractive apt -y install"
+
+
+class AptStats:
+    """Process-wide counters used to report what coalescing saved."""
+
+    def __init__(self) -> None:
+        self.updates_run = 0
+        self.updates_skipped = 0
+        self.update_seconds = 0.0
+        self.transactions = 0
+        self.transactions_skipped = 0
+        self.install_seconds = 0.0
+
+    @property
+    def saved_seconds(self) -> float:
+        """Estimate of time saved: skipped updates and no-op transactions at measured cost."""
+        avg_update = self.update_seconds / self.updates_run if self.updates_run else 0.0
+        avg_install = self.install_seconds / self.transactions if self.transactions else 0.0
+        return self.updates_skipped * avg_update + self.transactions_skipped * avg_install
+
+    def summary(self) -> str:
+        return (
+            f"apt: {self.updates_run} update(s) run, {self.updates_skipped} skipped; "
+            f"{self.transactions} install transaction(s), {self.transactions_skipped} skipped; "
+            f"~{self.saved_seconds:.0f}s saved against the sequential path"
+        )
+
+
+apt_stats = AptStats()
+
+# Hosts whose package lists are known fresh in this process (host -> time.time() of the check).
+# Kept in memory only: the on-host stamp is the source of truth across runs.
+_apt_fresh: Dict[str, float] = {}
+
+
+def util_apt_dedupe(packages: Iterable[str]) -> List[str]:
+    """Split, strip and dedupe package names while keeping their first-seen order."""
+    seen: Dict[str, None] = {}
+    for entry in packages:
+        for name in entry.split():
+            seen.setdefault(name, None)
+    return list(seen)
+
+
+def util_apt_missing(c: Context, packages: List[str]) -> List[str]:
+    """Return the packages that are not installed yet, using one dpkg-query call."""
+    if not packages:
+        return []
+    result = c.run(
+        f"dpkg-query -W -f='${{Package}} ${{Status}}\\n' {' '.join(packages)} 2>/dev/null",
+        hide=True,
+        warn=True,
+    )
+    installed = {
+        line.split()[0].split(":")[0]
+        for line in result.stdout.splitlines()
+        if line.strip().endswith("install ok installed")
+    }
+    return [p for p in packages if p.split("=")[0] not in installed]
+
+
+@task
+@Context.wrap_context
+def sys_apt_update(c: Context, max_age: str = "3600", force: bool = False) -> bool:
+    """
+    Run `apt update` unless it already ran recently.
+
+    Freshness comes from a stamp file touched after every update, so repeated
+    installs within one recipe (or across back-to-back runs) share one update.
+    Within a run, a host checked fresh is not probed again until max_age passes.
+
+    Returns:
+        True if an update ran, False if it was skipped.
+    """
+    if not force:
+        if time.time() - _apt_fresh.get(c.host, 0.0) < int(max_age):
+            apt_stats.updates_skipped += 1
+            return False
+        minutes = max(int(max_age) // 60, 1)
+        fresh = c.run(
+            f'test -n "$(find {APT_UPDATE_STAMP} -mmin -{minutes} 2>/dev/null)"',
+            hide=True,
+            warn=True,
+        )
+        if fresh.ok:
+            _apt_fresh[c.host] = time.time()
+            apt_stats.updates_skipped += 1
+            return False
+
+    started = time.monotonic()
+    c.sudo("apt -y update")
+    c.sudo(f"mkdir -p {APT_UPDATE_STAMP.rsplit('/', 1)[0]} && touch {APT_UPDATE_STAMP}")
+    apt_stats.updates_run += 1
+    apt_stats.update_seconds += time.monotonic() - started
+    _apt_fresh[c.host] = time.time()
+    return True
+
+
+def sys_apt_install(c: Context, packages: Iterable[str], warn: bool = False):
+    """
+    Install packages in one transaction, skipping those already installed.
+
+    Runs a freshness-stamped `apt update` first when something has to be
+    installed. Returns the apt Result, or None if there was nothing to do.
+    """
+    wanted = util_apt_dedupe(packages)
+    missing = util_apt_missing(c, wanted)
+    if not missing:
+        apt_stats.transactions_skipped += 1
+        print(f"Already installed: {' '.join(wanted)}", file=sys.stderr)
+        return None
+
+    sys_apt_update(c)
+    started = time.monotonic()
+    result = c.sudo(f"{APT_INSTALL} {' '.join(missing)}", warn=warn)
+    apt_stats.transactions += 1
+    apt_stats.install_seconds += time.monotonic() - started
+    c.facts.invalidate("git_installed", "psql_version")
+    return result
+
+
+class AptPlan:
+    """
+    Collects package groups from the steps of a recipe and installs them together.
+
+    Groups are merged and deduped into a single transaction. If that transaction
+    fails (e.g. one optional package is missing from the archive), each group is
+    retried on its own so one bad package does not block the others.
+    """
+
+    def __init__(self) -> None:
+        self.groups: Dict[str, List[str]] = {}
+
+    def add(self, name: str, packages: Iterable[str]) -> "AptPlan":
+        self.groups.setdefault(name, [])
+        self.groups[name] = util_apt_dedupe(self.groups[name] + list(packages))
+        return self
+
+    @property
+    def packages(self) -> List[str]:
+        return util_apt_dedupe(p for group in self.groups.values() for p in group)
+
+    def install(self, c: Context) -> None:
+        """Install every planned package in as few transactions as possible."""
+        if not self.groups:
+            return
+        print(
+            f"Installing {len(self.packages)} packages from {len(self.groups)} group(s): "
+            f"{', '.join(self.groups)}",
+            file=sys.stderr,
+        )
+        result = sys_apt_install(c, self.packages, warn=True)
+        if result is not None and result.failed:
+            print(
+                "Merged install failed, falling back to one transaction per group", file=sys.stderr
+            )
+            for packages in self.groups.values():
+                sys_apt_install(c, packages, warn=True)
+        print(apt_stats.summary(), file=sys.stderr)
+
+
+@task
+@Context.wrap_context
+def sys_apt_install_packages(c: Context, packages: str) -> None:
+    """Install a space or comma separated list of packages in one transaction."""
+    sys_apt_install(c, packages.replace(",", " ").split())
+    print(apt_stats.summary(), file=sys.stderr)
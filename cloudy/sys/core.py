@@ -1,11 +1,61 @@
 import os
+import shlex
 import time
-from typing import Optional
+from contextlib import contextmanager
+from typing import Iterator, Optional
 
 from fabric import task
 
-from cloudy.sys.etc import sys_etc_git_commit
+from cloudy.sys.apt import sys_apt_install, sys_apt_update
+from cloudy.sys.etc import sys_etc_git_commit, sys_etc_git_flush
 from cloudy.util.context import Context
+from cloudy.util.handlers import service_handlers
+from cloudy.util.journal import StepJournal
+from cloudy.util.ready import DEFAULT_READY_TIMEOUT, wait_until
+
+COMMON_PACKAGES = [
+    "build-essential",
+    "gcc",
+    "subversion",
+    "mercurial",
+    "wget",
+    "vim",
+    "less",
+    "sudo",
+    "redis-tools",
+    "curl",
+    "apt-transport-https",
+    "ca-certificates",
+    "software-properties-common",
+    "net-tools",
+    "ntpsec",
+]
+
+# Config checks run before a restart, so a broken config fails fast with the old process still up
+SERVICE_CONFIG_TESTS = {
+    "nginx": "nginx -t -q",
+    "apache2": "apache2ctl -t",
+    "ssh": "sshd -t",
+    "supervisor": "test -f /etc/supervisor/supervisord.conf",
+}
+
+# Shell probes (run with sudo) that succeed once a service accepts work, beyond `is-active`
+SERVICE_READY_PROBES = {
+    "redis-server": (
+        "conf=/etc/redis/redis.conf; "
+        "h=$(awk '/^bind /{print $2; exit}' $conf); p=$(awk '/^port /{print $2}' $conf); "
+        "redis-cli -h ${h:-127.0.0.1} -p ${p:-6379} ping 2>&1 | grep -qE 'PONG|NOAUTH'"
+    ),
+    "postgresql": (
+        "ports=$(pg_lsclusters -h | awk '{print $3}'); "
+        "for p in $ports; do pg_isready -q -p $p || exit 1; done"
+    ),
+    "ssh": (
+        "for p in $(sshd -T 2>/dev/null | awk '/^port /{print $2}'); do "
+        'ss -ltnH "sport = :$p" | grep -q . || exit 1; done'
+    ),
+    "supervisor": "supervisorctl pid >/dev/null",
+}
 
 
 @task
@@ -37,12 +87,122 @@ def sys_reload_service(c: Context, service: str) -> None:
 
 @task
 @Context.wrap_context
-def sys_restart_service(c: Context, service: str) -> None:
-    """Restart a systemd service safely."""
-    c.sudo(f"systemctl stop {service}", warn=True)
-    time.sleep(2)
-    c.sudo(f"systemctl start {service}")
-    time.sleep(2)
+def sys_restart_service(c: Context, service: str, timeout: str = "") -> None:
+    """Restart a systemd service safely, returning as soon as it is ready."""
+    config_test = SERVICE_CONFIG_TESTS.get(service)
+    if config_test:
+        c.sudo(config_test, hide=True)
+    c.sudo(f"systemctl restart {service}")
+    sys_wait_for_service(c, service, timeout)
+
+
+@task
+@Context.wrap_context
+def sys_wait_for_service(c: Context, service: str, timeout: str = "") -> None:
+    """
+    Wait until a service is active and (if it has a probe) accepting work.
+
+    Polls with exponential backoff, so a service that comes straight up costs
+    one or two quick probes instead of a fixed sleep.
+
+    Raises:
+        RuntimeError: If the service is not ready within the timeout.
+    """
+    probe = f"systemctl is-active --quiet {service}"
+    if service in SERVICE_READY_PROBES:
+        probe = f"{probe} && {SERVICE_READY_PROBES[service]}"
+    command = f"sh -c {shlex.quote(probe)}"
+    limit = float(timeout or DEFAULT_READY_TIMEOUT)
+    started = time.monotonic()
+    if not wait_until(lambda: c.sudo(command, hide=True, warn=True).ok, limit):
+        c.sudo(f"systemctl status {service} --no-pager", warn=True)
+        raise RuntimeError(f"Service {service} not ready after {limit:.0f}s")
+    print(f"✅ {service} ready in {time.monotonic() - started:.1f}s")
+
+
+@task
+@Context.wrap_context
+def sys_notify_service(c: Context, service: str, action: str = "restart") -> None:
+    """
+    Request a restart or reload of a service.
+
+    Inside a `deferred_changes` scope the request is queued and merged with
+    others for the same service; otherwise it runs right away.
+    """
+    if service_handlers.deferring(c.host):
+        service_handlers.notify(Context.clone(c), service, action)
+        print(f"🔔 {service} {action} queued")
+    elif action == "reload":
+        sys_reload_service(c, service)
+    else:
+        sys_restart_service(c, service)
+
+
+@task
+@Context.wrap_context
+def sys_flush_services(c: Context) -> None:
+    """Commit queued /etc changes, then run queued service restarts/reloads (a barrier)."""
+    sys_etc_git_flush(c)
+    ctx = service_handlers.context(c.host) or c
+    for service, action in service_handlers.drain(c.host):
+        if action == "reload":
+            sys_reload_service(ctx, service)
+        else:
+            sys_restart_service(ctx, service)
+
+
+@contextmanager
+def deferred_changes(c: Context) -> Iterator[None]:
+    """
+    Queue service restarts/reloads and /etc commits requested in the block;
+    at the end make one /etc commit and run each service action once.
+
+    Scopes nest; the outermost one flushes. The queue is flushed even if the
+    block fails, so services whose config was already updated are not left
+    running the old config (a rerun would see the files unchanged and skip them).
+    """
+    service_handlers.begin(c.host)
+    try:
+        yield
+    except BaseException:
+        if service_handlers.end(c.host):
+            try:
+                sys_flush_services(c)
+            except Exception as e:
+                print(f"⚠️ Failed to run queued service actions: {e}")
+        raise
+    if service_handlers.end(c.host):
+        sys_flush_services(c)
+
+
+@task
+@Context.wrap_context
+def sys_clear_facts(c: Context) -> None:
+    """Forget cached remote facts (versions, installed tools, mounts) for the host."""
+    c.facts.invalidate()
+    print(f"Cleared cached facts for {c.host}")
+
+
+@task
+@Context.wrap_context
+def sys_show_journal(c: Context, recipe: str = "generic") -> None:
+    """Show the recipe steps recorded as completed on the host."""
+    journal = StepJournal(recipe)
+    entries = journal.load(c)
+    if not entries:
+        print(f"No completed steps recorded for '{recipe}' ({journal.path})")
+        return
+    for step, entry in entries.items():
+        done_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.get("at", 0)))
+        print(f"{step:<20} {entry.get('hash', '')}  {done_at}")
+
+
+@task
+@Context.wrap_context
+def sys_reset_journal(c: Context, recipe: str = "generic") -> None:
+    """Forget completed recipe steps so the next run starts from the top."""
+    StepJournal(recipe).reset(c)
+    print(f"Reset step journal for '{recipe}' on {c.host}")
 
 
 @task
@@ -57,7 +217,7 @@ def sys_init(c: Context) -> None:
 @Context.wrap_context
 def sys_update(c: Context) -> None:
     """Update package repositories."""
-    c.sudo("apt -y update")
+    sys_apt_update(c, force=True)
     c.sudo("apt list --upgradable", warn=True)
     sys_etc_git_commit(c, "Updated package repositories")
 
@@ -88,39 +248,21 @@ def sys_safe_upgrade(c: Context) -> None:
 @Context.wrap_context
 def sys_git_install(c: Context) -> None:
     """Install the latest version of git."""
-    c.sudo("apt update")
-    c.sudo("apt -y install git")
+    sys_apt_install(c, ["git"])
 
 
 @task
 @Context.wrap_context
 def sys_install_common(c: Context) -> None:
     """Install a set of common system utilities."""
-    requirements = [
-        "build-essential",
-        "gcc",
-        "subversion",
-        "mercurial",
-        "wget",
-        "vim",
-        "less",
-        "sudo",
-        "redis-tools",
-        "curl",
-        "apt-transport-https",
-        "ca-certificates",
-        "software-properties-common",
-        "net-tools",
-        "ntpsec",
-    ]
-    c.sudo(f'apt -y install {" ".join(requirements)}')
+    sys_apt_install(c, COMMON_PACKAGES)
 
 
 @task
 @Context.wrap_context
 def sys_git_configure(c: Context, user: str, name: str, email: str) -> None:
     """Configure git for a given user."""
-    c.sudo("apt install -y git-core")
+    sys_apt_install(c, ["git-core"])
     c.sudo(f'sudo -u {user} git config --global user.name "{name}"', warn=True)
     c.sudo(f'sudo -u {user} git config --global user.email "{email}"', warn=True)
     sys_etc_git_commit(c, f"Configured git for user: {user}")
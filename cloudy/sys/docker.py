@@ -2,7 +2,7 @@ import os
 
 from fabric import task
 
-from cloudy.sys.core import sys_mkdir, sys_restart_service
+from cloudy.sys.core import sys_mkdir, sys_notify_service
 from cloudy.sys.etc import sys_etc_git_commit
 from cloudy.util.context import Context
 
@@ -32,7 +32,7 @@ def sys_docker_config(c: Context) -> None:
     c.sudo(f"mv /tmp/daemon.json {remotecfg}")
     sys_mkdir(c, "/docker")
     sys_etc_git_commit(c, "Configured docker")
-    sys_restart_service(c, "docker")
+    sys_notify_service(c, "docker")
 
 
 @task
@@ -1,16 +1,54 @@
+import os
+import shlex
 import sys
+from typing import List
 
 from fabric import task
 
 from cloudy.util.context import Context
+from cloudy.util.handlers import service_handlers
+
+# Set to 1 to commit /etc changes to git (otherwise commit messages are only printed)
+ETC_GIT_ENV = "CLOUDY_ETC_GIT"
+
+# Untracked files above this size are excluded (via .git/info/exclude) instead of committed
+ETC_GIT_MAX_FILE_KB = 1024
+
+# Managed /etc/.gitignore: editor/package-manager leftovers and volatile runtime files
+ETC_GITIGNORE = """\
+# Managed by cloudy; local additions go in /etc/.git/info/exclude
+*~
+*.swp
+*.bak
+*.dpkg-new
+*.dpkg-old
+*.dpkg-dist
+*.ucf-new
+*.ucf-old
+*.ucf-dist
+*.lock
+.pwd.lock
+/adjtime
+/ld.so.cache
+/mtab
+"""
+
+
+def etc_git_enabled(print_only: bool = True) -> bool:
+    """Check if /etc changes should be committed (print_only=False or CLOUDY_ETC_GIT=1)."""
+    return not print_only or os.environ.get(ETC_GIT_ENV, "") == "1"
 
 
 @task
 @Context.wrap_context
 def is_git_installed(c: Context) -> bool:
     """Check if git is installed on the host."""
-    result = c.run("which git", hide=True, warn=True)
-    return bool(result.stdout.strip())
+
+    def probe() -> bool:
+        result = c.run("which git", hide=True, warn=True)
+        return bool(result.stdout.strip())
+
+    return c.facts.get("git_installed", probe)
 
 
 @task
@@ -19,12 +57,39 @@ def sys_etc_git_init(c: Context) -> None:
     """Initialize git tracking in /etc if not already present."""
     if not is_git_installed(c):
         return
-    result = c.run("test -d /etc/.git", warn=True)
-    if result.failed:
-        with c.cd("/etc"):
-            c.sudo("git init")
-            c.sudo("git add .")
-            c.sudo('git commit -a -m "Initial Submission"')
+    if c.facts.get("etc_git_tracked", lambda: c.run("test -d /etc/.git", warn=True).ok):
+        return
+    c.upload(ETC_GITIGNORE.encode(), "/etc/.gitignore")
+    with c.cd("/etc"):
+        c.sudo("git init -q && git add -A && git commit -q -m 'Initial Submission'")
+    c.facts.set("etc_git_tracked", True)
+
+
+def util_etc_git_record(c: Context, messages: List[str]) -> None:
+    """
+    Stage and commit everything in /etc once, with the messages combined.
+
+    Large untracked files are excluded first, so the index never picks up
+    database dumps, core files or similar blobs that land in /etc.
+    """
+    sys_etc_git_init(c)
+    c.upload(ETC_GITIGNORE.encode(), "/etc/.gitignore")
+
+    subject = messages[0] if len(messages) == 1 else f"{messages[0]} (+{len(messages) - 1} more)"
+    args = f"-m {shlex.quote(subject)}"
+    if len(messages) > 1:
+        args += " -m " + shlex.quote("\n".join(f"- {m}" for m in messages))
+    limit = ETC_GIT_MAX_FILE_KB * 1024
+    exclude_large = (
+        "git ls-files -z --others --exclude-standard | xargs -0 -r stat -c '%s %n' -- | "
+        f'awk -v l={limit} \'$1 > l {{ sub(/^[0-9]+ /, ""); print "/" $0 }}\' '
+        ">> .git/info/exclude"
+    )
+    script = f"cd /etc || exit 1; {exclude_large}; git add -A && git commit -q {args}"
+    try:
+        c.sudo(f"sh -c {shlex.quote(script)}", warn=True, hide=True)
+    except Exception as e:
+        print(f"Git commit failed: {e}", file=sys.stderr)
 
 
 @task
@@ -32,16 +97,25 @@ def sys_etc_git_init(c: Context) -> None:
 def sys_etc_git_commit(c: Context, msg: str, print_only: bool = True) -> None:
     """
     Add/remove files from git and commit changes in /etc.
-    If print_only is True or git is not installed, just print the message.
+    If print_only is True (and CLOUDY_ETC_GIT is not 1) or git is not installed,
+    just print the message. Inside a recipe the commit is queued and made once,
+    together with the other queued messages, when the recipe finishes.
     """
-    if print_only or not is_git_installed(c):
+    if not etc_git_enabled(print_only) or not is_git_installed(c):
         print(msg)
         return
 
-    sys_etc_git_init(c)
-    with c.cd("/etc"):
-        try:
-            c.sudo("git add .")
-            c.sudo(f'git commit -a -m "{msg}"', warn=True, hide=True)
-        except Exception as e:
-            print(f"Git commit failed: {e}", file=sys.stderr)
+    if service_handlers.deferring(c.host):
+        service_handlers.queue_commit(Context.clone(c), msg)
+        print(f"{msg} (/etc commit queued)")
+        return
+    util_etc_git_record(c, [msg])
+
+
+@task
+@Context.wrap_context
+def sys_etc_git_flush(c: Context) -> None:
+    """Commit the queued /etc changes now, as one commit (a barrier)."""
+    messages = service_handlers.drain_commits(c.host)
+    if messages:
+        util_etc_git_record(service_handlers.context(c.host) or c, messages)
@@ -1,32 +1,148 @@
+import re
+import shlex
+from typing import Dict, List, Tuple
+
 from fabric import task
 
 from cloudy.sys.etc import sys_etc_git_commit
 from cloudy.util.context import Context
 
+# ufw service names used by the fw_* tasks, as the port/proto `ufw show added` reports
+UFW_SERVICES = {"ssh": "22/tcp", "http": "80/tcp", "https": "443/tcp", "postgresql": "5432/tcp"}
+
+
+def util_fw_rule(action: str, port: str, proto: str = "", source: str = "") -> str:
+    """Build a rule in the form `ufw show added` prints it (without the leading `ufw`)."""
+    port = str(port)
+    if port in UFW_SERVICES and not proto:
+        port, proto = UFW_SERVICES[port].split("/")
+    if source:
+        rule = f"{action} from {source} to any port {port}"
+        return f"{rule} proto {proto}" if proto else rule
+    return f"{action} {port}/{proto}" if proto else f"{action} {port}"
+
+
+def util_fw_parse(output: str) -> Tuple[bool, Dict[str, str], List[str]]:
+    """
+    Parse `ufw status verbose` followed by `ufw show added`.
+
+    Returns:
+        (active, defaults by direction, e.g. {"incoming": "deny"}, rules)
+    """
+    active = bool(re.search(r"^Status: active", output, re.M))
+    defaults = {
+        direction: policy
+        for policy, direction in re.findall(r"(\w+) \((incoming|outgoing|routed)\)", output)
+    }
+    rules = [
+        " ".join(line.split()[1:])
+        for line in output.splitlines()
+        if line.startswith("ufw ") and not line.startswith("ufw status")
+    ]
+    return active, defaults, rules
+
+
+class FirewallRules:
+    """
+    Declarative ufw rule set, applied as a diff against the host.
+
+    The current state is read with one command. Only missing rules are added
+    and only unwanted rules deleted, all in one batch, followed by a single
+    `ufw reload` (or `ufw enable` if ufw was inactive). A host that already
+    matches costs one probe and nothing else.
+
+    Example:
+        rules = FirewallRules().default("incoming", "deny").allow("22").allow("http")
+        rules.allow("5432", "tcp", source="10.0.0.5").remove("8080")
+        rules.apply(c)
+    """
+
+    def __init__(self) -> None:
+        self.present: List[str] = []
+        self.absent: List[str] = []
+        self.defaults: Dict[str, str] = {}
+
+    def allow(self, port: str, proto: str = "", source: str = "") -> "FirewallRules":
+        rule = util_fw_rule("allow", port, proto, source)
+        if rule not in self.present:
+            self.present.append(rule)
+        return self
+
+    def remove(self, port: str, proto: str = "", source: str = "") -> "FirewallRules":
+        """Make sure an allow rule is not present."""
+        self.absent.append(util_fw_rule("allow", port, proto, source))
+        return self
+
+    def default(self, direction: str, policy: str) -> "FirewallRules":
+        self.defaults[direction] = policy
+        return self
+
+    def diff(
+        self, current: List[str], defaults: Dict[str, str], prune: bool = False
+    ) -> Tuple[List[str], List[str], Dict[str, str]]:
+        """Return the rules to add, the rules to delete and the defaults to change."""
+        add = [r for r in self.present if r not in current]
+        delete = [r for r in current if r in self.absent or (prune and r not in self.present)]
+        policies = {d: p for d, p in self.defaults.items() if defaults.get(d) != p}
+        return add, delete, policies
+
+    def apply(self, c: Context, prune: bool = False) -> bool:
+        """
+        Bring the host's ufw rules in line with this set.
+
+        Args:
+            prune: Also delete rules on the host that are not in this set
+
+        Returns:
+            True if anything changed.
+        """
+        probe = "ufw status verbose; ufw show added"
+        output = c.sudo(f"sh -c {shlex.quote(probe)}", hide=True, warn=True).stdout or ""
+        active, defaults, current = util_fw_parse(output)
+        add, delete, policies = self.diff(current, defaults, prune)
+        if active and not (add or delete or policies):
+            print("✅ Firewall rules unchanged")
+            return False
+
+        with c.batch():
+            for direction, policy in policies.items():
+                c.sudo(f"ufw default {policy} {direction}")
+            for rule in delete:
+                c.sudo(f"ufw delete {rule}")
+            for rule in add:
+                c.sudo(f"ufw {rule}")
+            c.sudo("ufw reload" if active else "ufw --force enable")
+        print(
+            f"🔥 Firewall: +{len(add)} rule(s), -{len(delete)} rule(s), "
+            f"{len(policies)} default(s) changed"
+        )
+        return True
+
 
 @task
 @Context.wrap_context
 def fw_reload_ufw(c: Context) -> None:
     """Helper to reload and show UFW status."""
-    c.sudo("sh -c 'ufw disable; echo \"y\" | ufw enable; ufw status verbose'")
+    c.sudo("sh -c 'ufw reload; ufw status verbose'")
 
 
 @task
 @Context.wrap_context
 def fw_install(c: Context) -> None:
     """Install UFW firewall."""
-    # Disable UFW first (ignore errors if not installed/enabled)
-    c.sudo("ufw --force disable", warn=True)
+    with c.batch():
+        # Disable UFW first (ignore errors if not installed/enabled)
+        c.sudo("ufw --force disable", warn=True)
 
-    # Remove UFW completely
-    c.sudo("apt remove --purge -y ufw")
+        # Remove UFW completely
+        c.sudo("apt remove --purge -y ufw")
 
-    # Clean up any remaining configuration files
-    c.sudo("apt autoremove -y")
+        # Clean up any remaining configuration files
+        c.sudo("apt autoremove -y")
 
-    # Install UFW fresh
-    c.sudo("apt update")
-    c.sudo("apt -y install ufw")
+        # Install UFW fresh
+        c.sudo("apt update")
+        c.sudo("apt -y install ufw")
 
     sys_etc_git_commit(c, "Installed firewall (ufw)")
 
@@ -35,21 +151,17 @@ def fw_install(c: Context) -> None:
 @Context.wrap_context
 def fw_secure_server(c: Context, ssh_port: str = "22") -> None:
     """Secure the server: deny all incoming, allow outgoing, allow SSH."""
-    c.sudo("ufw logging on")
-    c.sudo("ufw default deny incoming")
-    c.sudo("ufw default allow outgoing")
-    c.sudo(f"ufw allow {ssh_port}")
-    fw_reload_ufw(c)
-    sys_etc_git_commit(c, "Server is secured down")
+    c.sudo("ufw logging on", hide=True)
+    rules = FirewallRules().default("incoming", "deny").default("outgoing", "allow")
+    if rules.allow(ssh_port).apply(c):
+        sys_etc_git_commit(c, "Server is secured down")
 
 
 @task
 @Context.wrap_context
 def fw_wide_open(c: Context) -> None:
     """Open up firewall: allow all incoming and outgoing."""
-    c.sudo("ufw default allow incoming")
-    c.sudo("ufw default allow outgoing")
-    fw_reload_ufw(c)
+    FirewallRules().default("incoming", "allow").default("outgoing", "allow").apply(c)
 
 
 @task
@@ -63,95 +175,81 @@ def fw_disable(c: Context) -> None:
 @Context.wrap_context
 def fw_allow_incoming_http(c: Context) -> None:
     """Allow HTTP (port 80) requests."""
-    c.sudo("ufw allow http")
-    fw_reload_ufw(c)
+    FirewallRules().allow("http").apply(c)
 
 
 @task
 @Context.wrap_context
 def fw_disallow_incoming_http(c: Context) -> None:
     """Disallow HTTP (port 80) requests."""
-    c.sudo("ufw delete allow http")
-    fw_reload_ufw(c)
+    FirewallRules().remove("http").apply(c)
 
 
 @task
 @Context.wrap_context
 def fw_allow_incoming_https(c: Context) -> None:
     """Allow HTTPS (port 443) requests."""
-    c.sudo("ufw allow https")
-    fw_reload_ufw(c)
+    FirewallRules().allow("https").apply(c)
 
 
 @task
 @Context.wrap_context
 def fw_disallow_incoming_https(c: Context) -> None:
     """Disallow HTTPS (port 443) requests."""
-    c.sudo("ufw delete allow https")
-    fw_reload_ufw(c)
+    FirewallRules().remove("https").apply(c)
 
 
 @task
 @Context.wrap_context
 def fw_allow_incoming_postgresql(c: Context) -> None:
     """Allow PostgreSQL (port 5432) requests."""
-    c.sudo("ufw allow postgresql")
-    fw_reload_ufw(c)
+    FirewallRules().allow("postgresql").apply(c)
 
 
 @task
 @Context.wrap_context
 def fw_disallow_incoming_postgresql(c: Context) -> None:
     """Disallow PostgreSQL (port 5432) requests."""
-    c.sudo("ufw delete allow postgresql")
-    fw_reload_ufw(c)
+    FirewallRules().remove("postgresql").apply(c)
 
 
 @task
 @Context.wrap_context
 def fw_allow_incoming_port(c: Context, port: str) -> None:
     """Allow requests on a specific port."""
-    c.sudo(f"ufw allow {port}")
-    fw_reload_ufw(c)
+    FirewallRules().allow(port).apply(c)
 
 
 @task
 @Context.wrap_context
 def fw_disallow_incoming_port(c: Context, port: int) -> None:
     """Disallow requests on a specific port."""
-    c.sudo(f"ufw delete allow {port}")
-    c.sudo(f"ufw delete allow {port}/tcp", warn=True)
-    c.sudo(f"ufw delete allow {port}/udp", warn=True)
-    fw_reload_ufw(c)
+    FirewallRules().remove(port).remove(port, "tcp").remove(port, "udp").apply(c)
 
 
 @task
 @Context.wrap_context
 def fw_allow_incoming_port_proto(c: Context, port: str, proto: str) -> None:
     """Allow requests on a specific port/protocol."""
-    c.sudo(f"ufw allow {port}/{proto}")
-    fw_reload_ufw(c)
+    FirewallRules().allow(port, proto).apply(c)
 
 
 @task
 @Context.wrap_context
 def fw_disallow_incoming_port_proto(c: Context, port: int, proto: str) -> None:
     """Disallow requests on a specific port/protocol."""
-    c.sudo(f"ufw delete allow {port}/{proto}")
-    fw_reload_ufw(c)
+    FirewallRules().remove(port, proto).apply(c)
 
 
 @task
 @Context.wrap_context
 def fw_allow_incoming_host_port(c: Context, host: str, port: int) -> None:
     """Allow requests from a specific host on a specific port."""
-    c.sudo(f"ufw allow from {host} to any port {port}")
-    fw_reload_ufw(c)
+    FirewallRules().allow(port, source=host).apply(c)
 
 
 @task
 @Context.wrap_context
 def fw_disallow_incoming_host_port(c: Context, host: str, port: int) -> None:
     """Disallow requests from a specific host on a specific port."""
-    c.sudo(f"ufw delete allow from {host} to any port {port}")
-    fw_reload_ufw(c)
+    FirewallRules().remove(port, source=host).apply(c)
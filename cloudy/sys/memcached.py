@@ -2,7 +2,7 @@ import os
 
 from fabric import task
 
-from cloudy.sys.core import sys_restart_service
+from cloudy.sys.core import sys_notify_service
 from cloudy.sys.etc import sys_etc_git_commit
 from cloudy.util.context import Context
 
@@ -13,7 +13,7 @@ def sys_memcached_install(c: Context) -> None:
     """Install memcached and restart the service."""
     c.sudo("apt -y install memcached")
     sys_etc_git_commit(c, "Installed memcached")
-    sys_restart_service(c, "memcached")
+    sys_notify_service(c, "memcached")
 
 
 @task
@@ -34,7 +34,7 @@ def sys_memcached_configure_memory(c: Context, memory: int = 0, divider: int = 8
         memory = total_mem // divider
     c.sudo(f'sed -i "s/-m\\s\\+[0-9]\\+/-m {memory}/g" {memcached_conf}')
     sys_etc_git_commit(c, f"Configured memcached (memory={memory})")
-    sys_restart_service(c, "memcached")
+    sys_notify_service(c, "memcached")
 
 
 @task
@@ -44,7 +44,7 @@ def sys_memcached_configure_port(c: Context, port: int = 11211) -> None:
     memcached_conf = "/etc/memcached.conf"
     c.sudo(f'sed -i "s/-p\\s\\+[0-9]\\+/-p {port}/g" {memcached_conf}')
     sys_etc_git_commit(c, f"Configured memcached (port={port})")
-    sys_restart_service(c, "memcached")
+    sys_notify_service(c, "memcached")
 
 
 @task
@@ -54,7 +54,7 @@ def sys_memcached_configure_interface(c: Context, interface: str = "0.0.0.0") ->
     memcached_conf = "/etc/memcached.conf"
     c.sudo(f'sed -i "s/-l\\s\\+[0-9.]\\+/-l {interface}/g" {memcached_conf}')
     sys_etc_git_commit(c, f"Configured memcached (interface={interface})")
-    sys_restart_service(c, "memcached")
+    sys_notify_service(c, "memcached")
 
 
 @task
@@ -69,4 +69,4 @@ def sys_memcached_config(c: Context) -> None:
     c.sudo(f"mv /tmp/memcached.conf {remotecfg}")
     sys_memcached_configure_memory(c)
     sys_etc_git_commit(c, "Configured memcached")
-    sys_restart_service(c, "memcached")
+    sys_notify_service(c, "memcached")
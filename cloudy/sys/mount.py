@@ -29,6 +29,7 @@ def sys_mount_device(c: Context, device: str, mount_point: str, filesystem: str
         raise RuntimeError(f"Device ({device}) is already mounted")
     util_mount_validate_vars(c, device, mount_point, filesystem)
     c.sudo(f"mount -t {filesystem} {device} {mount_point}")
+    c.facts.invalidate("mounts")
 
 
 @task
@@ -68,5 +69,5 @@ def util_mount_validate_vars(
 def util_mount_is_mounted(c: Context, device: str) -> bool:
     """Check if a device is already mounted."""
 
-    result = c.run("df", hide=True, warn=True)
-    return device in result.stdout
+    mounts = c.facts.get("mounts", lambda: c.run("df", hide=True, warn=True).stdout)
+    return device in mounts
@@ -1,10 +1,16 @@
-import os
+import io
 
 from fabric import task
 
 from cloudy.sys.core import sys_mkdir
 from cloudy.sys.etc import sys_etc_git_commit
 from cloudy.util.context import Context
+from cloudy.util.template import ConfigTemplate
+
+DOCKER_UNIT_TEMPLATE = ConfigTemplate(
+    "openvpn/docker-systemd.cfg",
+    {"docker_port": int, "docker_proto": str, "docker_domain": str, "docker_image_name": str},
+)
 
 
 @task
@@ -53,19 +59,18 @@ def sys_openvpn_docker_conf(
 ) -> None:
     """Configure OpenVPN Docker systemd service."""
     docker_name = f"{proto}-{port}.{domain}"
-    cfgdir = os.path.join(os.path.dirname(__file__), "../cfg")
-    localcfg = os.path.expanduser(os.path.join(cfgdir, "openvpn/docker-systemd.cfg"))
+    unit = DOCKER_UNIT_TEMPLATE.render(
+        {
+            "docker_port": port,
+            "docker_proto": proto,
+            "docker_domain": domain,
+            "docker_image_name": docker_name,
+        }
+    )
     remotecfg = f"/etc/systemd/system/docker-{docker_name}.service"
-    c.sudo(f"rm -rf {remotecfg}")
-    c.put(localcfg, "/tmp/docker-openvpn.service")
-    c.sudo(f"mv /tmp/docker-openvpn.service {remotecfg}")
-    # Replace placeholders in the config file
-    c.sudo(f"sed -i 's/docker_port/{port}/g' {remotecfg}")
-    c.sudo(f"sed -i 's/docker_proto/{proto}/g' {remotecfg}")
-    c.sudo(f"sed -i 's/docker_domain/{domain}/g' {remotecfg}")
-    c.sudo(f"sed -i 's/docker_image_name/{docker_name}/g' {remotecfg}")
-    sys_etc_git_commit(c, f"Configured {docker_name} docker")
-    c.sudo("systemctl daemon-reload")
+    if c.upload(io.StringIO(unit), remotecfg):
+        sys_etc_git_commit(c, f"Configured {docker_name} docker")
+        c.sudo("systemctl daemon-reload")
     c.sudo(f"systemctl enable docker-{docker_name}.service")
     c.sudo(f"systemctl start docker-{docker_name}.service")
 
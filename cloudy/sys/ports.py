@@ -1,23 +1,135 @@
+import shlex
 import sys
+from typing import Dict, Iterable, List, Set, Tuple
 
 from fabric import task
 
 from cloudy.util.context import Context
 
+# Host file of reserved ports ("<port> <owner>" per line), shared by every fab run
+PORT_RESERVATIONS = "/var/lib/cloudy/ports"
+
+# Exit code of the reservation command when another run took one of the ports first
+RESERVATION_CONFLICT = 3
+
+
+def util_ports_parse(output: str) -> Tuple[Set[int], Dict[int, str]]:
+    """Parse `ss -ltnH`, a `---` line and the reservation file into (listening, reserved)."""
+    listening: Set[int] = set()
+    reserved: Dict[int, str] = {}
+    sockets, _, reservations = output.partition("---")
+    for line in sockets.splitlines():
+        fields = line.split()
+        if len(fields) >= 4 and fields[3].rpartition(":")[2].isdigit():
+            listening.add(int(fields[3].rpartition(":")[2]))
+    for line in reservations.splitlines():
+        port, _, owner = line.strip().partition(" ")
+        if port.isdigit():
+            reserved[int(port)] = owner
+    return listening, reserved
+
+
+def util_ports_free(
+    used: Iterable[int], start: int, count: int = 1, max_tries: int = 50
+) -> List[int]:
+    """Return up to `count` ports from [start, start + max_tries) that are not in `used`."""
+    taken = set(used)
+    free = [p for p in range(start, start + max_tries) if p not in taken]
+    return free[:count]
+
+
+def util_ports_snapshot(c: Context) -> Tuple[Set[int], Dict[int, str]]:
+    """Read listening TCP ports and reservations from the host with one command."""
+    probe = f"ss -ltnH; echo ---; cat {PORT_RESERVATIONS} 2>/dev/null"
+    result = c.sudo(f"sh -c {shlex.quote(probe)}", hide=True, warn=True)
+    return util_ports_parse(result.stdout or "")
+
+
+def util_ports_reserve(c: Context, ports: List[int], owner: str) -> bool:
+    """
+    Record the ports for owner unless another run reserved any of them meanwhile.
+
+    The check and the append run under flock on the host, so two concurrent
+    setups (threads or separate fab runs) cannot reserve the same port.
+    """
+    taken = "|".join(str(p) for p in ports)
+    lines = "".join(f"{p} {owner}\n" for p in ports)
+    script = (
+        f'grep -qE "^({taken}) " {PORT_RESERVATIONS} && exit {RESERVATION_CONFLICT}; '
+        f"printf %s {shlex.quote(lines)} >> {PORT_RESERVATIONS}"
+    )
+    command = (
+        f"mkdir -p {PORT_RESERVATIONS.rsplit('/', 1)[0]} && touch {PORT_RESERVATIONS} && "
+        f"flock {PORT_RESERVATIONS} sh -c {shlex.quote(script)}"
+    )
+    result = c.sudo(command, hide=True, warn=True)
+    if result.return_code == RESERVATION_CONFLICT:
+        return False
+    if result.failed:
+        raise RuntimeError(f"Failed to reserve ports {ports} on {c.host}: {result.stderr}")
+    return True
+
+
+@task
+@Context.wrap_context
+def sys_allocate_ports(
+    c: Context, count: str = "1", start: str = "8181", max_tries: str = "50", owner: str = ""
+) -> List[str]:
+    """
+    Allocate free TCP ports from one snapshot of the host's listening sockets.
+
+    With an owner (e.g. a domain), the ports are recorded in the host's
+    reservation file: other setups skip them, and a rerun for the same owner
+    gets the same ports back instead of new ones.
+
+    Raises:
+        RuntimeError: If not enough free ports exist in the range.
+    """
+    wanted = int(count)
+    for _ in range(5):
+        listening, reserved = util_ports_snapshot(c)
+        if owner:
+            held = sorted(p for p, o in reserved.items() if o == owner)
+            if len(held) >= wanted:
+                return [str(p) for p in held[:wanted]]
+        ports = util_ports_free(set(listening) | set(reserved), int(start), wanted, int(max_tries))
+        if len(ports) < wanted:
+            raise RuntimeError(
+                f"Only {len(ports)} of {wanted} free ports found in {start}-"
+                f"{int(start) + int(max_tries) - 1}"
+            )
+        if not owner or util_ports_reserve(c, ports, owner):
+            return [str(p) for p in ports]
+    raise RuntimeError(f"Could not reserve {wanted} port(s) for {owner}: too much contention")
+
+
+@task
+@Context.wrap_context
+def sys_release_ports(c: Context, owner: str) -> None:
+    """Drop the port reservations of an owner."""
+    # Rewrite in place (not mv) so runs waiting on the lock keep locking the same file
+    tmp = f"{PORT_RESERVATIONS}.tmp"
+    script = (
+        f"awk -v o={shlex.quote(owner)} '$2 != o' {PORT_RESERVATIONS} > {tmp} && "
+        f"cat {tmp} > {PORT_RESERVATIONS} && rm -f {tmp}"
+    )
+    c.sudo(f"flock {PORT_RESERVATIONS} sh -c {shlex.quote(script)}", warn=True)
+
 
 @task
 @Context.wrap_context
-def sys_show_next_available_port(c: Context, start: str = "8181", max_tries: str = "50") -> str:
+def sys_show_next_available_port(
+    c: Context, start: str = "8181", max_tries: str = "50", owner: str = ""
+) -> str:
     """
     Show the next available TCP port starting from 'start'.
     Returns the first available port found, or -1 if none found in range.
+    Reserved ports are skipped; with an owner the port is reserved for it.
     """
-    port = start
-    for _ in range(int(max_tries)):
-        result = c.run(f"netstat -lt | grep :{port}", hide=True, warn=True)
-        if not result.stdout.strip():
-            print(port)
-            return port
-        port = str(int(port) + 1)
-    print(f"No available port found starting from {start}", file=sys.stderr)
-    return "-1"
+    try:
+        port = sys_allocate_ports(c, "1", start, max_tries, owner)[0]
+    except RuntimeError:
+        print(f"No available port found starting from {start}", file=sys.stderr)
+        return "-1"
+    print(port)
+    return port
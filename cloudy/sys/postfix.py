@@ -1,6 +1,7 @@
 from fabric import task
 
-from cloudy.sys.core import sys_restart_service
+from cloudy.sys.apt import sys_apt_install
+from cloudy.sys.core import sys_notify_service
 from cloudy.sys.etc import sys_etc_git_commit
 from cloudy.util.context import Context
 
@@ -17,7 +18,7 @@ def sys_install_postfix(c: Context) -> None:
         c.sudo("chown root:root /var/cache/debconf/*.dat || true")
 
         # Ensure debconf-utils is installed
-        c.sudo("apt update && apt -y install debconf-utils")
+        sys_apt_install(c, ["debconf-utils"])
 
         # Set debconf selections
         c.sudo(
@@ -33,7 +34,7 @@ def sys_install_postfix(c: Context) -> None:
         )
 
         # Install postfix
-        c.sudo("apt -y install postfix")
+        sys_apt_install(c, ["postfix"])
 
     except Exception:
         # Method 2: Fallback to non-interactive installation
@@ -46,4 +47,4 @@ def sys_install_postfix(c: Context) -> None:
     c.sudo('/usr/sbin/postconf -e "myhostname = localhost"')
 
     sys_etc_git_commit(c, "Installed postfix on loopback for outgoing mail")
-    sys_restart_service(c, "postfix")
+    sys_notify_service(c, "postfix")
@@ -1,14 +1,61 @@
 import logging
 import subprocess
+from typing import List
 
 from fabric import task
 
+from cloudy.sys.apt import sys_apt_install
 from cloudy.sys.etc import sys_etc_git_commit
 from cloudy.util.context import Context
 
 logger = logging.getLogger(__name__)
 
 
+def python_packages(py_version: str = "3.11") -> List[str]:
+    """Return the apt packages needed for a Python application host."""
+    major_version = py_version.split(".")[0]
+
+    # Modern package list - removed deprecated packages
+    base_packages = [
+        f"python{major_version}-dev",
+        f"python{major_version}-setuptools",
+        f"python{major_version}-pip",
+        f"python{major_version}-venv",  # Modern replacement for virtualenv
+        "python3-dev",  # Keep generic python3-dev
+        "build-essential",  # Essential build tools
+        "pkg-config",
+    ]
+
+    # Image processing libraries (updated versions)
+    image_packages = [
+        "libfreetype6-dev",
+        "libjpeg-dev",  # Updated from libjpeg62-dev
+        "libpng-dev",  # Updated from libpng12-dev
+        "zlib1g-dev",
+        "liblcms2-dev",
+        "libwebp-dev",
+        "libtiff5-dev",  # Added TIFF support
+        "libopenjp2-7-dev",  # Added JPEG2000 support
+    ]
+
+    # System utilities
+    utility_packages = [
+        "gettext",
+        "curl",
+        "wget",
+        "git",  # Often needed for pip installs from git
+    ]
+
+    # System Python packages via apt (preferred over pip)
+    system_python_packages = [
+        "python3-wheel",
+        "python3-setuptools",
+        "python3-pil",  # Pillow via system package
+    ]
+
+    return base_packages + image_packages + utility_packages + system_python_packages
+
+
 @task
 @Context.wrap_context
 def sys_python_install_common(c: Context, py_version: str = "3.11") -> None:
@@ -25,61 +72,11 @@ def sys_python_install_common(c: Context, py_version: str = "3.11") -> None:
         # Parse Python version
         major_version = py_version.split(".")[0]
 
-        # Modern package list - removed deprecated packages
-        base_packages = [
-            f"python{major_version}-dev",
-            f"python{major_version}-setuptools",
-            f"python{major_version}-pip",
-            f"python{major_version}-venv",  # Modern replacement for virtualenv
-            "python3-dev",  # Keep generic python3-dev
-            "build-essential",  # Essential build tools
-            "pkg-config",
-        ]
-
-        # Image processing libraries (updated versions)
-        image_packages = [
-            "libfreetype6-dev",
-            "libjpeg-dev",  # Updated from libjpeg62-dev
-            "libpng-dev",  # Updated from libpng12-dev
-            "zlib1g-dev",
-            "liblcms2-dev",
-            "libwebp-dev",
-            "libtiff5-dev",  # Added TIFF support
-            "libopenjp2-7-dev",  # Added JPEG2000 support
-        ]
-
-        # System utilities
-        utility_packages = [
-            "gettext",
-            "curl",
-            "wget",
-            "git",  # Often needed for pip installs from git
-        ]
-
-        all_packages = base_packages + image_packages + utility_packages
-        package_list = " ".join(all_packages)
-
         logger.info(f"Installing Python {py_version} and common packages...")
 
-        # Update package list first
-        c.sudo("apt update")
-
-        # Install packages
-        c.sudo(f"apt -y install {package_list}")
-
         # Handle PEP 668 externally-managed-environment
         # Use system packages where possible, pip with --break-system-packages for others
-
-        # Install system Python packages via apt (preferred method)
-        system_python_packages = [
-            "python3-wheel",
-            "python3-setuptools",
-            "python3-pil",  # Pillow via system package
-        ]
-
-        system_package_list = " ".join(system_python_packages)
-        logger.info("Installing Python packages via system package manager...")
-        c.sudo(f"apt -y install {system_package_list}")
+        sys_apt_install(c, python_packages(py_version))
 
         # For packages not available as system packages, use pip with --break-system-packages
         # Only do this for essential packages that aren't available via apt
@@ -87,7 +84,7 @@ def sys_python_install_common(c: Context, py_version: str = "3.11") -> None:
 
         # Check if psycopg2 is available as system package first
         try:
-            c.sudo("apt -y install python3-psycopg2")
+            sys_apt_install(c, ["python3-psycopg2"])
             logger.info("Installed psycopg2 via system package")
         except Exception:
             logger.info("Installing psycopg2-binary via pip (system package not available)")
@@ -1,8 +1,10 @@
+import io
 import os
+import re
 
 from fabric import task
 
-from cloudy.sys.core import sys_restart_service
+from cloudy.sys.core import sys_notify_service
 from cloudy.sys.etc import sys_etc_git_commit
 from cloudy.util.context import Context
 
@@ -13,7 +15,7 @@ def sys_redis_install(c: Context) -> None:
     """Install redis-server and restart the service."""
     c.sudo("apt -y install redis-server")
     sys_etc_git_commit(c, "Installed redis-server")
-    sys_restart_service(c, "redis-server")
+    sys_notify_service(c, "redis-server")
 
 
 @task
@@ -31,7 +33,7 @@ def sys_redis_configure_memory(c: Context, memory: int = 0, divider: int = 8) ->
     memory_bytes = memory * 1024 * 1024
     c.sudo(f'sed -i "s/^maxmemory .*/maxmemory {memory_bytes}/" {redis_conf}')
     sys_etc_git_commit(c, f"Configured redis-server (memory={memory_bytes})")
-    sys_restart_service(c, "redis-server")
+    sys_notify_service(c, "redis-server")
 
 
 @task
@@ -41,7 +43,7 @@ def sys_redis_configure_port(c: Context, port: str = "6379") -> None:
     redis_conf = "/etc/redis/redis.conf"
     c.sudo(f'sed -i "s/^port .*/port {port}/" {redis_conf}')
     sys_etc_git_commit(c, f"Configured redis-server (port={port})")
-    sys_restart_service(c, "redis-server")
+    sys_notify_service(c, "redis-server")
 
 
 @task
@@ -51,7 +53,7 @@ def sys_redis_configure_interface(c: Context, interface: str = "0.0.0.0") -> Non
     redis_conf = "/etc/redis/redis.conf"
     c.sudo(f'sed -i "s/^bind .*/bind {interface}/" {redis_conf}')
     sys_etc_git_commit(c, f"Configured redis-server (interface={interface})")
-    sys_restart_service(c, "redis-server")
+    sys_notify_service(c, "redis-server")
 
 
 @task
@@ -66,7 +68,7 @@ def sys_redis_configure_db_file(
     c.sudo(f"sed -i '/^dbfilename /d' {redis_conf}")
     c.sudo(f"sh -c 'echo \"dbfilename {dump}\" >> {redis_conf}'")
     sys_etc_git_commit(c, f"Configured redis-server (dir={path}, dumpfile={dump})")
-    sys_restart_service(c, "redis-server")
+    sys_notify_service(c, "redis-server")
 
 
 @task
@@ -85,21 +87,48 @@ def sys_redis_configure_pass(c: Context, password: str = "") -> None:
             else "Configured redis-server (password removed)"
         ),
     )
-    sys_restart_service(c, "redis-server")
+    sys_notify_service(c, "redis-server")
 
 
 @task
 @Context.wrap_context
-def sys_redis_config(c: Context) -> None:
-    """Replace redis.conf with local config and reconfigure memory."""
+def sys_redis_config(
+    c: Context, memory: str = "0", divider: str = "8", interface: str = "", port: str = ""
+) -> bool:
+    """
+    Replace redis.conf with the local config, with memory, interface and port set.
+
+    The settings are applied locally before upload, so the remote file matches
+    exactly and reruns with the same values skip both the transfer and the
+    restart (which would flush the cache). Returns whether the config changed.
+    """
     cfgdir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../cfg/redis/redis.conf"))
     remotecfg = "/etc/redis/redis.conf"
-    if os.path.exists(cfgdir):
-        c.sudo(f"rm -f {remotecfg}")
-        c.put(cfgdir, "/tmp/redis.conf")
-        c.sudo(f"mv /tmp/redis.conf {remotecfg}")
-        sys_redis_configure_memory(c)
-        sys_etc_git_commit(c, "Configured redis-server")
-        sys_restart_service(c, "redis-server")
-    else:
+    if not os.path.exists(cfgdir):
         print(f"Local redis config not found: {cfgdir}")
+        return False
+
+    memory_mb = int(memory)
+    if not memory_mb:
+        total_mem = c.facts.get(
+            "mem_total_mb",
+            lambda: int(c.run("free -m | awk '/^Mem:/{print $2}'", hide=True).stdout.strip()),
+        )
+        memory_mb = total_mem // int(divider)
+
+    settings = {"maxmemory": str(memory_mb * 1024 * 1024)}
+    if interface:
+        settings["bind"] = interface
+    if port:
+        settings["port"] = str(port)
+
+    with open(cfgdir) as f:
+        config = f.read()
+    for key, value in settings.items():
+        config = re.sub(rf"^{key} .*$", f"{key} {value}", config, flags=re.MULTILINE)
+
+    changed = c.upload(io.StringIO(config), remotecfg, owner="redis:redis", mode="640")
+    if changed:
+        sys_etc_git_commit(c, "Configured redis-server")
+        sys_notify_service(c, "redis-server")
+    return changed
@@ -14,10 +14,8 @@ def sys_ssh_set_port(c: Context, port: str = "22") -> None:
     sshd_config = "/etc/ssh/sshd_config"
     c.sudo(f"sed -i 's/^#*Port .*/Port {port}/' {sshd_config}")
     sys_etc_git_commit(c, f"Configured ssh (Port={port})")
-    # SSH port changes require restart, not just reload
+    # SSH port changes require restart, not just reload; returns once the new port listens
     sys_restart_service(c, "ssh")
-    # Give SSH a moment to fully restart
-    c.run("sleep 2")
 
 
 @task
@@ -3,16 +3,18 @@ import sys
 
 from fabric import task
 
+from cloudy.sys.apt import sys_apt_install
 from cloudy.sys.etc import sys_etc_git_commit
 from cloudy.util.context import Context
 
+TIME_PACKAGES = ["ntpsec", "ntpdate"]
+
 
 @task
 @Context.wrap_context
 def sys_time_install_common(c: Context) -> None:
     """Install common time/zone related packages."""
-    requirements = ["ntpsec", "ntpdate"]
-    c.sudo(f'apt -y install {" ".join(requirements)}')
+    sys_apt_install(c, TIME_PACKAGES)
     sys_configure_ntp(c)
     sys_etc_git_commit(c, "Installed time/zone related system packages")
 
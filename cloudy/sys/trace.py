@@ -0,0 +1,32 @@
+"""Tasks for inspecting command trace files written with CLOUDY_TRACE."""
+
+import glob
+import sys
+
+from fabric import task
+
+from cloudy.util.trace import format_report, load_trace
+
+
+@task
+def sys_trace_report(c, files: str, top: str = "15") -> None:
+    """
+    Rank the slowest commands and tasks across one or more trace files.
+
+    Args:
+        files: Comma-separated trace files (globs allowed)
+        top: Number of rows per table
+
+    Example:
+        CLOUDY_TRACE=./trace.jsonl fab -H root@web.com recipe.web-install --cfg-paths="..."
+        fab trace.report --files="./trace.jsonl,./traces/*.jsonl" --top=20
+    """
+    paths = []
+    for pattern in [f.strip() for f in files.split(",") if f.strip()]:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    try:
+        records = load_trace(paths)
+    except OSError as e:
+        print(f"❌ Cannot read trace file: {e}")
+        sys.exit(1)
+    print(format_report(records, int(top)))
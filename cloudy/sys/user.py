@@ -144,12 +144,14 @@ def sys_user_create_with_setup(
     if not user_name or not password:
         return
 
-    sys_user_add(c, user_name)
-    sys_user_change_password(c, user_name, password)
-    sys_user_add_sudoer(c, user_name)
-    sys_user_set_group_umask(c, user_name)
-    sys_user_create_groups(c, groups)
-    sys_user_add_to_groups(c, user_name, groups)
+    # Ship the whole chain of small sudo commands as one remote script
+    with c.batch():
+        sys_user_add(c, user_name)
+        sys_user_change_password(c, user_name, password)
+        sys_user_add_sudoer(c, user_name)
+        sys_user_set_group_umask(c, user_name)
+        sys_user_create_groups(c, groups)
+        sys_user_add_to_groups(c, user_name, groups)
 
     # Set up SSH keys if configured
     if shared_key_dir:
@@ -0,0 +1,153 @@
+"""Batched remote execution: many short sudo commands shipped as one shell script."""
+
+import re
+from typing import List, Optional
+
+BEGIN_MARKER = "@@CLOUDY-BATCH-BEGIN {index}@@"
+END_MARKER = "@@CLOUDY-BATCH-END {index} {rc}@@"
+MARKER_RE = re.compile(r"@@CLOUDY-BATCH-(BEGIN|END) (\d+)(?: (\d+))?@@")
+
+
+class BatchResult:
+    """
+    Deferred result of a command queued inside `Context.batch()`.
+
+    Mirrors the parts of invoke's Result used by cloudy tasks (ok, failed,
+    stdout, stderr, return_code). Values are only available once the batch
+    has been flushed to the remote host.
+    """
+
+    def __init__(self, index: int, command: str, warn: bool, show_output: bool) -> None:
+        self.index = index
+        self.command = command
+        self.warn = warn
+        self.show_output = show_output
+        self.executed = False
+        self._resolved = False
+        self._stdout = ""
+        self._return_code: Optional[int] = None
+
+    def resolve(self, stdout: str, return_code: Optional[int], executed: bool) -> None:
+        """Fill in the outcome after the batch has run."""
+        self._stdout = stdout
+        self._return_code = return_code
+        self.executed = executed
+        self._resolved = True
+
+    def _check(self) -> None:
+        if not self._resolved:
+            raise RuntimeError(f"Result of '{self.command}' is not available until the batch runs")
+
+    @property
+    def stdout(self) -> str:
+        self._check()
+        return self._stdout
+
+    @property
+    def stderr(self) -> str:
+        # Batches run under a PTY, so stderr is merged into stdout.
+        self._check()
+        return ""
+
+    @property
+    def return_code(self) -> Optional[int]:
+        self._check()
+        return self._return_code
+
+    @property
+    def ok(self) -> bool:
+        return self.executed and self.return_code == 0
+
+    @property
+    def failed(self) -> bool:
+        return not self.ok
+
+
+class BatchCommandFailed(RuntimeError):
+    """Raised when a command inside a batch fails and was not run with warn=True."""
+
+    def __init__(self, result: BatchResult) -> None:
+        self.result = result
+        super().__init__(
+            f"Batched command #{result.index + 1} failed "
+            f"(exit {result.return_code}): {result.command}"
+        )
+
+
+class CommandBatch:
+    """Collects commands and renders them as a single `set -e` shell script."""
+
+    def __init__(self) -> None:
+        self.results: List[BatchResult] = []
+        self.pending: List[BatchResult] = []
+
+    def add(self, command: str, warn: bool = False, show_output: bool = True) -> BatchResult:
+        """Queue a command and return its deferred result."""
+        result = BatchResult(len(self.results), command, warn, show_output)
+        self.results.append(result)
+        self.pending.append(result)
+        return result
+
+    def discard(self) -> List[BatchResult]:
+        """Drop the pending commands without running them; they resolve as not executed."""
+        for result in self.pending:
+            result.resolve("", None, executed=False)
+        dropped = self.pending
+        self.pending = []
+        return dropped
+
+    def render(self) -> str:
+        """
+        Render pending commands as one script.
+
+        Each command runs in its own subshell, the same isolation it would get as a
+        separate SSH call. Markers around every command let us split the combined
+        output back into per-command results.
+        """
+        lines = ["set -e", 'rm -f "$0"']
+        for result in self.pending:
+            begin = BEGIN_MARKER.format(index=result.index)
+            lines.append(f"printf '\\n{begin}\\n'")
+            if result.warn:
+                lines.append(f"__rc=0; ( {result.command} ) || __rc=$?")
+                end = END_MARKER.format(index=result.index, rc="%s")
+                lines.append(f"printf '\\n{end}\\n' \"$__rc\"")
+            else:
+                lines.append(f"( {result.command} )")
+                end = END_MARKER.format(index=result.index, rc=0)
+                lines.append(f"printf '\\n{end}\\n'")
+        return "\n".join(lines) + "\n"
+
+    def apply(self, output: str, exit_code: int) -> List[BatchResult]:
+        """Split script output into per-command results and return the flushed results."""
+        pending = {r.index: r for r in self.pending}
+        chunks: dict = {}
+        codes: dict = {}
+        current: Optional[int] = None
+        position = 0
+        for match in MARKER_RE.finditer(output):
+            if current is not None:
+                chunks[current] = chunks.get(current, "") + output[position : match.start()]
+            kind, index = match.group(1), int(match.group(2))
+            if kind == "BEGIN":
+                current = index
+            else:
+                codes[index] = int(match.group(3) or 0)
+                current = None
+            position = match.end()
+        if current is not None:
+            chunks[current] = chunks.get(current, "") + output[position:]
+
+        for index, result in pending.items():
+            stdout = chunks.get(index, "").strip()
+            if index in codes:
+                result.resolve(stdout, codes[index], executed=True)
+            elif index in chunks:
+                # Started but never finished: this is the command `set -e` stopped on.
+                result.resolve(stdout, exit_code or 1, executed=True)
+            else:
+                result.resolve("", None, executed=False)
+
+        flushed = self.pending
+        self.pending = []
+        return flushed
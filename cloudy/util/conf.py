@@ -1,27 +1,51 @@
 import configparser
 import logging
 import os
-from typing import Any, Dict, Optional
+import threading
+from types import MappingProxyType
+from typing import Any, Dict, List, Optional, Tuple
 
 LOG_LEVEL = logging.INFO
 FORMAT = "%(levelname)-10s %(name)s %(message)s"
 logging.basicConfig(format=FORMAT, level=LOG_LEVEL)
 
 
+ConfigKey = Tuple[Tuple[str, int, int], ...]
+
+
 class CloudyConfig:
     """
     CloudyConfig loads and manages configuration from multiple files.
     The last file in the list has the highest precedence.
+
+    Use CloudyConfig.load() to get a shared, read-only instance: it is parsed
+    once per process for a given set of files (and reparsed only when one of
+    them changes), so nested recipes and every AWS call reuse the same one.
     """
 
+    _cache: Dict[ConfigKey, "CloudyConfig"] = {}
+    _cache_lock = threading.Lock()
+
     def __init__(self, filenames: Any = None, log_level: int = logging.WARNING) -> None:
         self.log = logging.getLogger(os.path.basename(__file__))
         self.log.setLevel(log_level)
         self.cfg = configparser.ConfigParser()
         self.cfg_grid: Dict[str, Dict[str, Optional[str]]] = {}
+        self.paths = self.resolve_paths(filenames)
 
-        # Prepare config file paths
-        paths: list[str] = []
+        # Read all valid config files
+        try:
+            self.cfg.read(self.paths)
+        except Exception as e:
+            self.log.error(f"Unable to open config file(s): {e}")
+        else:
+            for section in self.cfg.sections():
+                self.cfg_grid[section.upper()] = self._section_map(section)
+
+    @staticmethod
+    def resolve_paths(filenames: Any = None) -> List[str]:
+        """Return the existing config files to read, lowest precedence first."""
+        paths: List[str] = []
 
         # 1. Config file in current directory
         cwd_path = os.path.abspath("./.cloudy")
@@ -52,15 +76,39 @@ class CloudyConfig:
         )
         if os.path.exists(defaults_path):
             paths.insert(0, defaults_path)
+        return paths
 
-        # Read all valid config files
-        try:
-            self.cfg.read(paths)
-        except Exception as e:
-            self.log.error(f"Unable to open config file(s): {e}")
-        else:
-            for section in self.cfg.sections():
-                self.cfg_grid[section.upper()] = self._section_map(section)
+    @classmethod
+    def load(cls, filenames: Any = None) -> "CloudyConfig":
+        """
+        Return the shared read-only config for these files.
+
+        The cache key is the resolved path list with each file's mtime and
+        size, so editing a file between tasks is picked up.
+        """
+        paths = cls.resolve_paths(filenames)
+        key: ConfigKey = tuple(
+            (p, os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in paths if os.path.exists(p)
+        )
+        with cls._cache_lock:
+            config = cls._cache.get(key)
+            if config is None:
+                config = cls(filenames)
+                config._freeze()
+                cls._cache[key] = config
+        return config
+
+    def _freeze(self) -> None:
+        """Make the values read-only; shared instances must not be changed by one task."""
+        self.cfg_grid = MappingProxyType(  # type: ignore[assignment]
+            {section: MappingProxyType(dict(options)) for section, options in self.cfg_grid.items()}
+        )
+        self._frozen = True
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"CloudyConfig is read-only (tried to set '{name}')")
+        super().__setattr__(name, value)
 
     def _section_map(self, section: str) -> Dict[str, Optional[str]]:
         """Create a dict of options for a section."""
@@ -103,6 +151,13 @@ class CloudyConfig:
                 f"Failed to set environment variable ({variable}) from section [{section}]: {e}"
             )
 
+    def get_list(self, section: str, key: str, default: Optional[List[str]] = None) -> List[str]:
+        """Get a comma-separated value as a list of stripped, non-empty items."""
+        value = self.get_variable(section, key, "")
+        if not value:
+            return list(default or [])
+        return [item.strip() for item in value.split(",") if item.strip()]
+
     def get_boolean_config(self, section: str, key: str, default: bool = False) -> bool:
         """
         Get a boolean configuration value from a section.
@@ -118,4 +173,6 @@ class CloudyConfig:
             Boolean value
         """
         value = self.get_variable(section, key, "").upper()
+        if not value:
+            return default
         return value in ("YES", "TRUE", "1", "ON")
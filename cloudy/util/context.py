@@ -1,14 +1,34 @@
 """Enhanced Fabric Context with smart output control and SSH reconnection."""
 
+import atexit
+import hashlib
+import json
 import logging
 import os
 import re
+import shlex
 import sys
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
 from functools import wraps
-from typing import Callable, List
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 from colorama import Fore, Style
 from fabric import Connection
+from invoke.exceptions import UnexpectedExit
+from paramiko import AutoAddPolicy, SSHClient
+
+from cloudy.util.batch import MARKER_RE, BatchCommandFailed, CommandBatch
+from cloudy.util.facts import HostFacts
+from cloudy.util.handlers import service_handlers
+from cloudy.util.ready import wait_until
+from cloudy.util.trace import trace_sink
+
+# Seconds Context.reconnect keeps retrying (with backoff) before giving up
+RECONNECT_TIMEOUT = 30.0
 
 logger = logging.getLogger("fab-commands")
 logger.setLevel(logging.INFO)
@@ -139,6 +159,119 @@ HIDE_BY_DEFAULT_PATTERNS: List[str] = [
 ]
 
 
+ConnectionKey = Tuple[str, str, int, Optional[str], str]
+
+
+class ConnectionRegistry:
+    """
+    Per-process registry of open SSH clients keyed by (host, user, port, gateway,
+    connect_kwargs digest).
+
+    Every task wrapped by `Context.wrap_context` gets a fresh Context object, but
+    they all hand their transport back here, so nested tasks reuse one SSH session
+    per host instead of paying for a new handshake on every call.
+
+    Each shared client tracks the Contexts using it (weakly, so a Context that is
+    simply dropped stops counting). Closing a Context releases its hold; the
+    transport is closed only when the last Context using it is closed.
+    """
+
+    def __init__(self) -> None:
+        self._clients: Dict[ConnectionKey, Any] = {}
+        # Holders by id(): Contexts compare equal per endpoint, so a WeakSet would merge them
+        self._holders: Dict[ConnectionKey, "weakref.WeakValueDictionary[int, Any]"] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, key: ConnectionKey, holder: Any = None) -> Optional[Any]:
+        """Return an open client for key, or None (and count a miss) if there is none."""
+        with self._lock:
+            client = self._clients.get(key)
+            transport = client.get_transport() if client is not None else None
+            if transport is not None and transport.active:
+                self.hits += 1
+                self._hold(key, holder)
+                return client
+            self._clients.pop(key, None)
+            self._holders.pop(key, None)
+            self.misses += 1
+            return None
+
+    def register(self, key: ConnectionKey, client: Any, holder: Any = None) -> None:
+        """Remember a freshly opened client so later Contexts can share it."""
+        with self._lock:
+            self._clients[key] = client
+            self._holders[key] = weakref.WeakValueDictionary()
+            self._hold(key, holder)
+
+    def _hold(self, key: ConnectionKey, holder: Any) -> None:
+        if holder is not None:
+            self._holders.setdefault(key, weakref.WeakValueDictionary())[id(holder)] = holder
+
+    def release(self, key: ConnectionKey, client: Any, holder: Any) -> bool:
+        """
+        Drop holder's hold on the shared client for key.
+
+        Returns:
+            True if the caller may close the client: it is not the shared one,
+            or holder was its last user (it is then forgotten). False if other
+            Contexts still use it.
+        """
+        with self._lock:
+            if self._clients.get(key) is not client:
+                return True
+            holders = self._holders.get(key)
+            if holders is not None:
+                holders.pop(id(holder), None)
+                if len(holders):
+                    return False
+            self._clients.pop(key, None)
+            self._holders.pop(key, None)
+            return True
+
+    def invalidate(self, key: ConnectionKey) -> None:
+        """Forget and close the shared client for key, if any, whoever still uses it."""
+        with self._lock:
+            client = self._clients.pop(key, None)
+            self._holders.pop(key, None)
+        if client is not None:
+            client.close()
+
+    def owns(self, key: ConnectionKey, client: Any) -> bool:
+        """Check if client is the shared client registered for key."""
+        with self._lock:
+            return self._clients.get(key) is client
+
+    def users(self, key: ConnectionKey) -> int:
+        """Number of live Contexts holding the shared client for key."""
+        with self._lock:
+            return len(self._holders.get(key, ()))
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters; each hit is one SSH handshake saved."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "open": len(self._clients)}
+
+
+connection_registry = ConnectionRegistry()
+
+
+def _report_connection_stats() -> None:
+    """Print connection reuse counters at exit when verbose output is enabled."""
+    if os.environ.get("CLOUDY_VERBOSE", "").lower() not in ("1", "true", "yes"):
+        return
+    stats = connection_registry.stats()
+    if stats["hits"] or stats["misses"]:
+        print(
+            f"\n{Fore.CYAN}SSH connections: {stats['misses']} opened, "
+            f"{stats['hits']} reused (handshakes saved){Style.RESET_ALL}"
+        )
+
+
+atexit.register(_report_connection_stats)
+
+
 class Context(Connection):
     """
     Enhanced Fabric Connection with smart output control and SSH reconnection.
@@ -147,6 +280,9 @@ class Context(Connection):
     and robust SSH port reconnection for server automation tasks.
     """
 
+    # Active command batch, shared with nested tasks by wrap_context
+    _batch: Optional[CommandBatch] = None
+
     @property
     def verbose(self) -> bool:
         """Check if verbose output is enabled via environment variable or config."""
@@ -171,6 +307,65 @@ class Context(Connection):
 
         return getattr(self.config, "cloudy_debug", False)
 
+    @property
+    def facts(self) -> HostFacts:
+        """Per-host cache of remote probe results, shared by all tasks in this process."""
+        return HostFacts(self.host)
+
+    @property
+    def registry_key(self) -> ConnectionKey:
+        """Key used to share this connection's transport through the registry."""
+        gateway = getattr(self, "gateway", None)
+        if isinstance(gateway, Connection):
+            gateway_key: Optional[str] = f"{gateway.user}@{gateway.host}:{gateway.port}"
+        else:
+            gateway_key = str(gateway) if gateway else None
+        # Contexts with different keys or auth options must not share a client. Fabric
+        # re-appends config key files on every clone, so key_filename is deduped first.
+        options = dict(self.connect_kwargs or {})
+        if "key_filename" in options:
+            keys = options["key_filename"]
+            keys = [keys] if isinstance(keys, str) else list(keys or [])
+            options["key_filename"] = list(dict.fromkeys(keys))
+        digest = hashlib.sha256(
+            json.dumps(options, sort_keys=True, default=repr).encode()
+        ).hexdigest()[:16]
+        return (self.host, self.user, int(self.port), gateway_key, digest)
+
+    def open(self):
+        """Open the SSH connection, reusing an already-open transport to the same endpoint."""
+        if self.is_connected:
+            return None
+
+        key = self.registry_key
+        client = connection_registry.acquire(key, self)
+        if client is not None:
+            self.client = client
+            self.transport = client.get_transport()
+            return None
+
+        result = super().open()
+        connection_registry.register(key, self.client, self)
+        return result
+
+    def close(self):
+        """
+        Release this Context's hold on its connection. A shared transport is
+        closed only when no other Context is still using it; until then this
+        Context just detaches from it (and reconnects through the registry if
+        used again).
+        """
+        if connection_registry.release(self.registry_key, self.client, self):
+            super().close()
+            return
+        if self._sftp is not None:
+            self._sftp.close()
+            self._sftp = None
+        client = SSHClient()
+        client.set_missing_host_key_policy(AutoAddPolicy())
+        self.client = client
+        self.transport = None
+
     def _should_show_output(self, command: str) -> bool:
         """Determine if command output should be shown based on command type."""
         # Debug mode: show everything
@@ -196,55 +391,259 @@ class Context(Connection):
         # For other commands, show output (conservative approach)
         return True
 
+    def _traced(self, kind: str, command: str, hidden: bool, call: Callable[[], Any]) -> Any:
+        """Run call() inside a command span, recording it to the trace when enabled."""
+        if not (trace_sink.enabled or trace_sink.spans_enabled):
+            return call()
+        with trace_sink.span(command, "command", self.host, kind=kind) as span:
+            start = time.time()
+            try:
+                result = call()
+            except UnexpectedExit as e:
+                span.args["exit_code"] = e.result.return_code
+                trace_sink.record(self.host, kind, command, start, time.time(), e.result, hidden)
+                raise
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                span.args["error"] = error
+                trace_sink.record(self.host, kind, command, start, time.time(), None, hidden, error)
+                raise
+            span.args["exit_code"] = getattr(result, "return_code", None)
+            trace_sink.record(self.host, kind, command, start, time.time(), result, hidden)
+            return result
+
+    def _print_indicator(self, result) -> None:
+        """Print a success/failure indicator for a command whose output was hidden."""
+        if result.failed:
+            print(f"{Fore.RED}❌ FAILED{Style.RESET_ALL}")
+            if result.stderr:
+                print(f"Error: {result.stderr.strip()}")
+            elif result.stdout:
+                print(f"Output: {result.stdout.strip()}")
+        else:
+            print(f"{Fore.GREEN}✅ SUCCESS{Style.RESET_ALL}")
+
+    @contextmanager
+    def batch(self) -> Iterator[CommandBatch]:
+        """
+        Collect sudo commands and run them as one remote `set -e` script.
+
+        Inside the block, `c.sudo()` queues the command and returns a deferred
+        result; `c.run()`, `c.put()` and `c.get()` flush the queue first so the
+        original ordering is kept. Nested tasks join the enclosing batch. The
+        queue is flushed only when the block exits normally; if it raises,
+        the queued commands are dropped and never reach the host.
+
+        Raises:
+            BatchCommandFailed: If a command not run with warn=True fails.
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        batch = CommandBatch()
+        self._batch = batch
+        try:
+            yield batch
+        except BaseException:
+            batch.discard()
+            raise
+        finally:
+            self._batch = None
+        self._flush_batch(batch)
+
+    def _flush_batch(self, batch: Optional[CommandBatch] = None) -> None:
+        """Ship the pending commands of a batch to the host in a single sudo call."""
+        batch = batch or self._batch
+        if batch is None or not batch.pending:
+            return
+
+        # The script can hold secrets (e.g. chpasswd input): make it 0600 before filling it
+        script = batch.render()
+        remote_script = f"/tmp/cloudy-batch-{uuid.uuid4().hex}.sh"
+        sftp = self.sftp()
+        with sftp.open(remote_script, "w") as f:
+            f.chmod(0o600)
+            f.write(script)
+        self._apply_sudo_password()
+        result = None
+        try:
+            result = self._traced(
+                "batch",
+                "; ".join(item.command for item in batch.pending),
+                True,
+                lambda: super(Context, self).sudo(
+                    f"bash {remote_script}", hide=True, pty=True, warn=True
+                ),
+            )
+        finally:
+            # The script deletes itself once it starts; clean up if it never got that far
+            if result is None or not MARKER_RE.search(result.stdout or ""):
+                try:
+                    sftp.remove(remote_script)
+                except OSError:
+                    pass
+
+        failure = None
+        for item in batch.apply(result.stdout, result.return_code):
+            if not item.executed:
+                print(f"\n{Fore.YELLOW}### {item.command}\n-----------{Style.RESET_ALL}")
+                print(f"{Fore.YELLOW}⏭  SKIPPED{Style.RESET_ALL}")
+                continue
+            print(f"\n{Fore.YELLOW}### {item.command}\n-----------{Style.RESET_ALL}")
+            if item.show_output:
+                if item.stdout:
+                    print(item.stdout)
+            else:
+                self._print_indicator(item)
+            if item.failed and not item.warn and failure is None:
+                failure = item
+
+        if failure is not None:
+            raise BatchCommandFailed(failure)
+
     def run(self, command, *args, **kwargs):
+        self._flush_batch()
         print(f"\n{Fore.CYAN}### {command}\n-----------{Style.RESET_ALL}", flush=True)
 
         show_output = self._should_show_output(command)
         kwargs.setdefault("hide", not show_output)
         kwargs.setdefault("pty", True)
 
-        result = super().run(command, *args, **kwargs)
+        result = self._traced(
+            "run",
+            command,
+            bool(kwargs["hide"]),
+            lambda: super(Context, self).run(command, *args, **kwargs),
+        )
 
         # Only show success/failure indicators for commands where we hid the output
         if not show_output:
-            if result.failed:
-                print(f"{Fore.RED}❌ FAILED{Style.RESET_ALL}")
-                if result.stderr:
-                    print(f"Error: {result.stderr.strip()}")
-                elif result.stdout:
-                    print(f"Output: {result.stdout.strip()}")
-            else:
-                print(f"{Fore.GREEN}✅ SUCCESS{Style.RESET_ALL}")
+            self._print_indicator(result)
 
         return result
 
-    def sudo(self, command, *args, **kwargs):
-        print(f"\n{Fore.YELLOW}### {command}\n-----------{Style.RESET_ALL}", flush=True)
-
+    def _apply_sudo_password(self) -> None:
         # Check for environment variable and set it if config is None
         env_password = os.environ.get("INVOKE_SUDO_PASSWORD")
         if hasattr(self.config, "sudo") and not self.config.sudo.password and env_password:
             self.config.sudo.password = env_password
 
+    def sudo(self, command, *args, **kwargs):
+        self._apply_sudo_password()
+
         show_output = self._should_show_output(command)
+
+        # Queue plain commands while batching; anything needing extra options runs now
+        if self._batch is not None:
+            if not args and set(kwargs) <= {"warn", "hide", "pty"}:
+                hide = kwargs.get("hide", not show_output)
+                return self._batch.add(
+                    self._prefix_commands(command),
+                    warn=kwargs.get("warn", False),
+                    show_output=not hide,
+                )
+            self._flush_batch()
+
+        print(f"\n{Fore.YELLOW}### {command}\n-----------{Style.RESET_ALL}", flush=True)
         kwargs.setdefault("hide", not show_output)
         kwargs.setdefault("pty", True)
 
-        result = super().sudo(command, *args, **kwargs)
+        result = self._traced(
+            "sudo",
+            command,
+            bool(kwargs["hide"]),
+            lambda: super(Context, self).sudo(command, *args, **kwargs),
+        )
 
         # Only show success/failure indicators for commands where we hid the output
         if not show_output:
-            if result.failed:
-                print(f"{Fore.RED}❌ FAILED{Style.RESET_ALL}")
-                if result.stderr:
-                    print(f"Error: {result.stderr.strip()}")
-                elif result.stdout:
-                    print(f"Output: {result.stdout.strip()}")
-            else:
-                print(f"{Fore.GREEN}✅ SUCCESS{Style.RESET_ALL}")
+            self._print_indicator(result)
 
         return result
 
+    def put(self, *args, **kwargs):
+        self._flush_batch()
+        return super().put(*args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        self._flush_batch()
+        return super().get(*args, **kwargs)
+
+    def upload(
+        self,
+        source: Union[str, bytes, IO],
+        remote: str,
+        owner: str = "root:root",
+        mode: str = "644",
+    ) -> bool:
+        """
+        Install a file on the host only if its content, owner or mode differ.
+
+        The remote sha256 and ownership are read in one command. Unchanged files
+        are not transferred; a changed owner/mode alone is fixed in place.
+
+        Args:
+            source: Local file path, or the content itself (bytes or a file-like object)
+            remote: Destination path (written with sudo)
+            owner: user:group for the remote file
+            mode: Octal permission string
+
+        Returns:
+            True if the remote file was created or changed, False if it already matched.
+        """
+        if isinstance(source, str):
+            with open(os.path.expanduser(source), "rb") as f:
+                content = f.read()
+        elif isinstance(source, bytes):
+            content = source
+        else:
+            data = source.read()
+            content = data.encode() if isinstance(data, str) else data
+        digest = hashlib.sha256(content).hexdigest()
+
+        self._flush_batch()
+        target = shlex.quote(remote)
+        probe = f'if [ -f {target} ]; then sha256sum {target}; stat -c "%a %U:%G" {target}; fi'
+        command = f"sh -c {shlex.quote(probe)}"
+        self._apply_sudo_password()
+        current = self._traced(
+            "sudo",
+            command,
+            True,
+            lambda: super(Context, self).sudo(command, hide=True, warn=True),
+        )
+        # "<sha256>  <path>" then "<mode> <user:group>"; the path may contain whitespace
+        lines = (current.stdout or "").strip().splitlines()
+        remote_digest = lines[0].split(None, 1)[0] if lines and lines[0].strip() else ""
+        stat = lines[-1].split() if len(lines) >= 2 else []
+        remote_mode, remote_owner = (stat[0], stat[1]) if len(stat) == 2 else ("", "")
+
+        fix_perms = f"chown {owner} {target} && chmod {mode} {target}"
+        if remote_digest == digest:
+            if remote_owner == owner and remote_mode and int(remote_mode, 8) == int(mode, 8):
+                print(f"{Fore.GREEN}✅ {remote} unchanged{Style.RESET_ALL}")
+                return False
+            self.sudo(fix_perms)
+            return True
+
+        # The content can be secret (e.g. credentials): make the staged file 0600 before filling it
+        staged = f"/tmp/cloudy-upload-{uuid.uuid4().hex}"
+        sftp = self.sftp()
+        with sftp.open(staged, "wb") as f:
+            f.chmod(0o600)
+            f.write(content)
+        directory = shlex.quote(os.path.dirname(remote) or "/")
+        try:
+            self.sudo(f"mkdir -p {directory} && mv {staged} {target} && {fix_perms}")
+        except BaseException:
+            try:
+                sftp.remove(staged)
+            except OSError:
+                pass
+            raise
+        return True
+
     def reconnect(self, new_port: str = "", new_user: str = "") -> "Context":
         """
         Creates and returns a new Context (Connection) object to the same host
@@ -288,6 +687,9 @@ class Context(Connection):
         if self.is_connected:
             self.close()
 
+        # Drop the shared transport for the old endpoint so no task keeps using it
+        connection_registry.invalidate(self.registry_key)
+
         # Create a new Context instance with the updated port,
         # while passing all other parameters from the original context.
         new_ctx = Context(
@@ -299,61 +701,75 @@ class Context(Connection):
             inline_ssh_env=inline_ssh_env_to_use,  # Use the Boolean value
         )
 
-        # Try to connect with retries for SSH port changes
-        import time
+        # Poll with backoff: sshd usually accepts on the new port within a fraction of a second
+        attempts = []
 
-        max_retries = 3
-        retry_delay = 2
-
-        for attempt in range(max_retries):
+        def connected() -> bool:
+            attempts.append(time.monotonic())
             try:
-                new_ctx.open()  # Explicitly open to test the connection
-                new_ctx.run("echo 'Successfully reconnected on new port.'", hide=True)
-                print(f"Successfully re-established connection on {new_ctx.host}:{new_ctx.port}")
-                break
+                new_ctx.open()
+                new_ctx.run("true", hide=True)
+                return True
             except Exception as e:
-                if attempt < max_retries - 1:
-                    print(f"Connection attempt {attempt + 1} failed, retrying in {retry_delay}s...")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    print(
-                        f"CRITICAL ERROR: Failed to reconnect to {self.host} as user {user_to_use} "
-                        f"on new port {port_to_use} after {max_retries} attempts."
-                    )
-                    print("Manual intervention may be required!")
-                    print(f"Error details: {e}")
-                    if new_ctx and new_ctx.is_connected:
-                        new_ctx.close()
+                print(f"Connection attempt {len(attempts)} failed: {e}")
+                if new_ctx.is_connected:
+                    new_ctx.close()
+                return False
+
+        if wait_until(connected, timeout=RECONNECT_TIMEOUT, initial=0.25, maximum=4.0):
+            print(f"Successfully re-established connection on {new_ctx.host}:{new_ctx.port}")
+            # Queued restarts and /etc commits must flush over the new connection
+            service_handlers.rebind(Context.clone(new_ctx))
+        else:
+            print(
+                f"CRITICAL ERROR: Failed to reconnect to {self.host} as user {user_to_use} "
+                f"on new port {port_to_use} after {len(attempts)} attempts "
+                f"({RECONNECT_TIMEOUT:.0f}s)."
+            )
+            print("Manual intervention may be required!")
 
         return new_ctx
 
+    @staticmethod
+    def clone(c: Connection) -> "Context":
+        """
+        Create a fresh Context for the same endpoint as c.
+
+        The clone has its own cwd/prefix state but shares the SSH transport
+        through the connection registry, so concurrent clones each get their
+        own channel on one session.
+        """
+        # Also apply the same robustness for inline_ssh_env and connect_kwargs
+        # when the initial Context is created by wrap_context.
+        clone_connect_kwargs = {}
+        if isinstance(c.connect_kwargs, dict):
+            clone_connect_kwargs = c.connect_kwargs.copy()
+
+        # inline_ssh_env should be a Boolean, not a dictionary
+        clone_inline_ssh_env = getattr(c, "inline_ssh_env", False)
+        if not isinstance(clone_inline_ssh_env, bool):
+            clone_inline_ssh_env = False
+
+        # Fixed: Remove c.config and use getattr to safely access gateway
+        return Context(
+            host=c.host,
+            user=c.user,
+            port=c.port,
+            gateway=getattr(c, "gateway", None),  # Safely get gateway attribute
+            connect_kwargs=clone_connect_kwargs,
+            inline_ssh_env=clone_inline_ssh_env,  # Boolean value
+        )
+
     @staticmethod
     def wrap_context(func: Callable):
         """Decorator to wrap Fabric tasks with enhanced Context functionality."""
 
         @wraps(func)
         def wrapper(c: Context, *args, **kwargs):
-            # Also apply the same robustness for inline_ssh_env and connect_kwargs
-            # when the initial Context is created by wrap_context.
-            wrapper_connect_kwargs = {}
-            if isinstance(c.connect_kwargs, dict):
-                wrapper_connect_kwargs = c.connect_kwargs.copy()
-
-            # inline_ssh_env should be a Boolean, not a dictionary
-            wrapper_inline_ssh_env = getattr(c, "inline_ssh_env", False)
-            if not isinstance(wrapper_inline_ssh_env, bool):
-                wrapper_inline_ssh_env = False
-
-            # Fixed: Remove c.config and use getattr to safely access gateway
-            ctx = Context(
-                host=c.host,
-                user=c.user,
-                port=c.port,
-                gateway=getattr(c, "gateway", None),  # Safely get gateway attribute
-                connect_kwargs=wrapper_connect_kwargs,
-                inline_ssh_env=wrapper_inline_ssh_env,  # Boolean value
-            )
-            return func(ctx, *args, **kwargs)
+            ctx = Context.clone(c)
+            # Nested tasks join any batch opened by their caller
+            ctx._batch = getattr(c, "_batch", None)
+            with trace_sink.task(func.__name__, ctx.host):
+                return func(ctx, *args, **kwargs)
 
         return wrapper
@@ -0,0 +1,124 @@
+"""Per-host cache of remote probe results (versions, `which`, `test -d`, ...)."""
+
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Seconds a fact stays valid on disk between `fab` invocations (0 disables the disk cache)
+FACTS_TTL_ENV = "CLOUDY_FACTS_TTL"
+FACTS_DIR = os.path.expanduser("~/.cache/cloudy/facts")
+
+
+class FactStore:
+    """
+    Process-wide memo of probe results, keyed by host then fact name.
+
+    Facts live in memory for the whole run. When CLOUDY_FACTS_TTL is set, they
+    are also written to a small JSON file per host so repeated `fab` runs against
+    the same host can skip the probes until the TTL expires.
+    """
+
+    def __init__(self, cache_dir: str = FACTS_DIR) -> None:
+        self.cache_dir = cache_dir
+        self._memory: Dict[str, Dict[str, Tuple[Any, float]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self) -> int:
+        try:
+            return max(int(os.environ.get(FACTS_TTL_ENV, "0")), 0)
+        except ValueError:
+            return 0
+
+    def _disk_path(self, host: str) -> str:
+        safe_host = re.sub(r"[^A-Za-z0-9_.-]", "_", host)
+        return os.path.join(self.cache_dir, f"{safe_host}.json")
+
+    def _load_disk(self, host: str) -> Dict[str, Tuple[Any, float]]:
+        try:
+            with open(self._disk_path(host)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return {
+            name: (entry["value"], entry["at"])
+            for name, entry in data.items()
+            if now - entry.get("at", 0) < self.ttl
+        }
+
+    def _save_disk(self, host: str) -> None:
+        facts = self._memory.get(host, {})
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._disk_path(host), "w") as f:
+                json.dump({k: {"value": v, "at": at} for k, (v, at) in facts.items()}, f)
+        except OSError:
+            pass
+
+    def get(self, host: str, name: str) -> Tuple[bool, Any]:
+        """Return (found, value) for a fact."""
+        with self._lock:
+            if host not in self._memory and self.ttl:
+                self._memory[host] = self._load_disk(host)
+            facts = self._memory.get(host, {})
+            if name in facts:
+                return True, facts[name][0]
+            return False, None
+
+    def set(self, host: str, name: str, value: Any) -> None:
+        """Remember a fact for a host."""
+        with self._lock:
+            self._memory.setdefault(host, {})[name] = (value, time.time())
+            if self.ttl:
+                self._save_disk(host)
+
+    def invalidate(self, host: str, *names: str) -> None:
+        """Forget the given facts for a host, or all of them if no names are given."""
+        with self._lock:
+            facts = self._memory.setdefault(host, {})
+            if names:
+                for name in names:
+                    facts.pop(name, None)
+            else:
+                facts.clear()
+            if self.ttl or os.path.exists(self._disk_path(host)):
+                self._save_disk(host)
+
+
+fact_store = FactStore()
+
+
+class HostFacts:
+    """View of the fact store bound to one host; available as `c.facts`."""
+
+    def __init__(self, host: str, store: Optional[FactStore] = None) -> None:
+        self.host = host
+        self.store = store or fact_store
+
+    def get(self, name: str, probe: Callable[[], T]) -> T:
+        """Return the cached fact, running probe() only the first time."""
+        found, value = self.store.get(self.host, name)
+        if found:
+            return value
+        value = probe()
+        self.store.set(self.host, name, value)
+        return value
+
+    def peek(self, name: str, default: Any = None) -> Any:
+        """Return a cached fact without probing, or default if it is unknown."""
+        found, value = self.store.get(self.host, name)
+        return value if found else default
+
+    def set(self, name: str, value: Any) -> None:
+        """Record a fact already known to the caller (e.g. right after an install)."""
+        self.store.set(self.host, name, value)
+
+    def invalidate(self, *names: str) -> None:
+        """Forget facts after a change on the host (e.g. a package install)."""
+        self.store.invalidate(self.host, *names)
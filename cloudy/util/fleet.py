@@ -0,0 +1,184 @@
+"""Run a recipe against many hosts at once with per-host output and a summary."""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, TextIO
+
+from colorama import Fore, Style
+
+from cloudy.util.context import Context
+from cloudy.util.output import output_router
+from cloudy.util.trace import Span, trace_sink
+
+
+def load_inventory(path: str) -> Dict[str, List[str]]:
+    """
+    Parse an inventory file into {group: [host, ...]}.
+
+    The format is INI-like: a `[group]` header followed by one host per line
+    (`user@host:port`, any part optional). Blank lines and lines starting with
+    `#` or `;` are ignored. Hosts listed before any header belong to `ungrouped`.
+    Every host is also part of the implicit `all` group.
+    """
+    groups: Dict[str, List[str]] = {}
+    group = "ungrouped"
+    with open(os.path.expanduser(path)) as f:
+        for raw in f:
+            line = raw.strip()
+            if not line or line[0] in "#;":
+                continue
+            if line.startswith("[") and line.endswith("]"):
+                group = line[1:-1].strip()
+                groups.setdefault(group, [])
+                continue
+            for host in line.replace(",", " ").split():
+                groups.setdefault(group, [])
+                if host not in groups[group]:
+                    groups[group].append(host)
+
+    everyone: List[str] = []
+    for hosts in groups.values():
+        everyone.extend(h for h in hosts if h not in everyone)
+    groups["all"] = everyone
+    return groups
+
+
+def resolve_hosts(hosts: str = "", inventory: str = "", groups: str = "") -> List[str]:
+    """
+    Combine a comma-separated host list with groups from an inventory file.
+
+    An inventory of the form `ec2:<filters>` (e.g. `ec2:role=web,state=running`)
+    selects nodes from the local EC2 index written by aws.sync-inventory
+    instead; groups do not apply to it.
+
+    Raises:
+        ValueError: If a requested group is not in the inventory, or no host is selected.
+    """
+    selected = [h.strip() for h in hosts.split(",") if h.strip()]
+    if inventory.startswith("ec2:"):
+        from cloudy.aws.index import InventoryIndex, util_parse_filters
+
+        index = InventoryIndex()
+        try:
+            selected.extend(index.hosts(**util_parse_filters(inventory[4:])))
+        finally:
+            index.close()
+    elif inventory:
+        known = load_inventory(inventory)
+        for group in [g.strip() for g in (groups or "all").split(",") if g.strip()]:
+            if group not in known:
+                raise ValueError(f"Group '{group}' not found in {inventory}")
+            selected.extend(known[group])
+
+    unique = list(dict.fromkeys(selected))
+    if not unique:
+        raise ValueError("No hosts selected; pass --hosts and/or --inventory")
+    return unique
+
+
+class HostResult:
+    """Outcome of running the recipe on one host."""
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.ok = False
+        self.error = ""
+        self.duration = 0.0
+        self.output = ""
+
+    @property
+    def status(self) -> str:
+        return "OK" if self.ok else "FAILED"
+
+
+class FleetRunner:
+    """
+    Run one callable against many hosts using a bounded thread pool.
+
+    Each host gets its own Context, so connection reuse, fact caching and
+    batching stay per host. Output is captured per host and printed as one
+    prefixed block when the host finishes, so parallel runs stay readable.
+    A failure on one host (including SystemExit from auth errors) is recorded
+    and does not stop the others.
+    """
+
+    def __init__(self, concurrency: int = 5, config=None, out: Optional[TextIO] = None) -> None:
+        self.concurrency = max(int(concurrency), 1)
+        self.config = config
+        self.out = out or sys.stdout
+        self.elapsed = 0.0
+        self._print_lock = threading.Lock()
+
+    def _make_context(self, host: str) -> Context:
+        if self.config is not None:
+            return Context(host, config=self.config)
+        return Context(host)
+
+    def _emit(self, result: HostResult) -> None:
+        color = Fore.GREEN if result.ok else Fore.RED
+        prefix = f"{color}[{result.host}]{Style.RESET_ALL} "
+        with self._print_lock:
+            for line in result.output.splitlines():
+                self.out.write(f"{prefix}{line}\n")
+            self.out.write(
+                f"{prefix}{result.status} in {result.duration:.1f}s"
+                f"{': ' + result.error if result.error else ''}\n"
+            )
+            self.out.flush()
+
+    def _run_host(
+        self, host: str, func: Callable[..., object], kwargs: dict, parent: Optional[Span]
+    ) -> HostResult:
+        result = HostResult(host)
+        started = time.monotonic()
+        with output_router.capture() as buffer, trace_sink.inherit(parent), trace_sink.span(
+            host, "host", host
+        ):
+            try:
+                func(self._make_context(host), **kwargs)
+                result.ok = True
+            except (Exception, SystemExit) as e:
+                result.error = f"{type(e).__name__}: {e}"
+        result.duration = time.monotonic() - started
+        result.output = buffer.getvalue()
+        self._emit(result)
+        return result
+
+    def run(self, hosts: List[str], func: Callable[..., object], **kwargs) -> List[HostResult]:
+        """Run func(ctx, **kwargs) on every host; results are returned in host order."""
+        results: Dict[str, HostResult] = {}
+        parent = trace_sink.current_span
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(hosts))) as pool:
+                futures = {pool.submit(self._run_host, h, func, kwargs, parent): h for h in hosts}
+                try:
+                    for future in as_completed(futures):
+                        results[futures[future]] = future.result()
+                except KeyboardInterrupt:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            self.elapsed = time.monotonic() - started
+        return [results[h] for h in hosts]
+
+
+def format_summary(results: List[HostResult], elapsed: float) -> str:
+    """Render a per-host status/duration table."""
+    width = max([len("HOST")] + [len(r.host) for r in results])
+    lines = [f"{'HOST':<{width}}  {'STATUS':<6}  {'TIME':>8}  ERROR"]
+    lines.append("-" * len(lines[0]))
+    for r in results:
+        lines.append(f"{r.host:<{width}}  {r.status:<6}  {r.duration:>7.1f}s  {r.error}")
+    failed = sum(1 for r in results if not r.ok)
+    serial = sum(r.duration for r in results)
+    lines.append("-" * len(lines[0]))
+    lines.append(
+        f"{len(results) - failed} ok, {failed} failed; {elapsed:.1f}s wall "
+        f"vs {serial:.1f}s if run one host at a time"
+    )
+    return "\n".join(lines)
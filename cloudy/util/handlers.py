@@ -0,0 +1,86 @@
+"""Deferred service restart/reload requests and /etc commit messages, coalesced per host."""
+
+import threading
+from typing import Any, Dict, List, Tuple
+
+# Strength of each action; when a service is notified more than once the strongest wins
+ACTIONS = {"reload": 1, "restart": 2}
+
+
+class ServiceHandlers:
+    """
+    Process-wide queue of pending service actions and /etc commits, keyed by host.
+
+    While a deferral scope is open for a host, tasks queue "restart" or
+    "reload" requests instead of acting on them. Requests for the same service
+    are merged: a restart subsumes a reload (a reload cannot apply changes that
+    need a restart, e.g. a new port), so each service gets at most one action.
+    Actions are flushed in the order the services were first notified. The
+    Context that queued work last is kept, and `Context.reconnect` rebinds it
+    to the new connection, so a flush after a reconnect (new SSH port or user)
+    runs on the live connection. /etc commit messages are queued in order, to
+    be recorded by a single commit.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._depth: Dict[str, int] = {}
+        self._pending: Dict[str, Dict[str, str]] = {}
+        self._contexts: Dict[str, Any] = {}
+        self._commits: Dict[str, List[str]] = {}
+
+    def deferring(self, host: str) -> bool:
+        with self._lock:
+            return self._depth.get(host, 0) > 0
+
+    def begin(self, host: str) -> None:
+        with self._lock:
+            self._depth[host] = self._depth.get(host, 0) + 1
+
+    def end(self, host: str) -> bool:
+        """Close one scope; returns True if it was the outermost one for the host."""
+        with self._lock:
+            self._depth[host] = max(self._depth.get(host, 0) - 1, 0)
+            return self._depth[host] == 0
+
+    def notify(self, c: Any, service: str, action: str = "restart") -> None:
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown service action '{action}' (use one of {list(ACTIONS)})")
+        with self._lock:
+            pending = self._pending.setdefault(c.host, {})
+            if ACTIONS[action] > ACTIONS.get(pending.get(service, ""), 0):
+                pending[service] = action
+            self._contexts[c.host] = c
+
+    def queue_commit(self, c: Any, msg: str) -> None:
+        with self._lock:
+            self._commits.setdefault(c.host, []).append(msg)
+            self._contexts[c.host] = c
+
+    def rebind(self, c: Any) -> None:
+        """Make c the Context a later flush uses for its host (after a reconnect)."""
+        with self._lock:
+            if self._depth.get(c.host, 0) > 0:
+                self._contexts[c.host] = c
+
+    def drain_commits(self, host: str) -> List[str]:
+        """Remove and return the queued /etc commit messages."""
+        with self._lock:
+            return self._commits.pop(host, [])
+
+    def pending(self, host: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            return list(self._pending.get(host, {}).items())
+
+    def context(self, host: str) -> Any:
+        """The Context that queued work last (None if nothing was queued)."""
+        with self._lock:
+            return self._contexts.get(host)
+
+    def drain(self, host: str) -> List[Tuple[str, str]]:
+        """Remove and return the queued (service, action) pairs."""
+        with self._lock:
+            return list(self._pending.pop(host, {}).items())
+
+
+service_handlers = ServiceHandlers()
@@ -0,0 +1,82 @@
+"""Collect SSH host keys of new machines and pre-seed them into known_hosts."""
+
+import base64
+import os
+import re
+import tempfile
+import threading
+from typing import List, Tuple
+
+import paramiko
+
+KNOWN_HOSTS = os.path.expanduser("~/.ssh/known_hosts")
+
+# cloud-init prints the host keys between these markers on the serial console
+CONSOLE_KEYS_RE = re.compile(
+    r"-----BEGIN SSH HOST KEY KEYS-----(.*?)-----END SSH HOST KEY KEYS-----", re.S
+)
+
+HostKey = Tuple[str, str]
+
+# Serializes the read-modify-replace of known_hosts across parallel node setups
+_known_hosts_lock = threading.Lock()
+
+
+def parse_console_host_keys(output: str) -> List[HostKey]:
+    """Return (key type, base64 key) pairs from a console log printed by cloud-init."""
+    match = CONSOLE_KEYS_RE.search(output or "")
+    keys: List[HostKey] = []
+    for line in (match.group(1) if match else "").splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[0].startswith(("ssh-", "ecdsa-")):
+            keys.append((fields[0], fields[1]))
+    return keys
+
+
+def scan_host_key(host: str, port: int = 22, timeout: float = 10.0) -> HostKey:
+    """Fetch the host key the server presents on a first connection (no login)."""
+    transport = paramiko.Transport((host, int(port)))
+    transport.banner_timeout = timeout
+    try:
+        transport.start_client(timeout=timeout)
+        key = transport.get_remote_server_key()
+        return key.get_name(), base64.b64encode(key.asbytes()).decode()
+    finally:
+        transport.close()
+
+
+def known_hosts_entry(host: str, port: int = 22) -> str:
+    return host if int(port) == 22 else f"[{host}]:{port}"
+
+
+def seed_known_hosts(host: str, port: int, keys: List[HostKey], path: str = KNOWN_HOSTS) -> None:
+    """
+    Record the keys for host:port, replacing any previous entry.
+
+    Cloud IPs get reused, so a stale key for the same address would otherwise
+    make the first connection fail with a host key mismatch. Safe to call
+    from parallel workers: updates are serialized within the process and
+    each one writes its own temporary file (mode 0600) before replacing.
+    """
+    entry = known_hosts_entry(host, port)
+    directory = os.path.dirname(path) or "."
+    with _known_hosts_lock:
+        lines: List[str] = []
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = [
+                    line
+                    for line in f.read().splitlines()
+                    if entry not in (line.split()[0].split(",") if line.split() else [])
+                ]
+        lines += [f"{entry} {key_type} {key}" for key_type, key in keys]
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".known_hosts.", suffix=".cloudy", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
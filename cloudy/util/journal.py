@@ -0,0 +1,68 @@
+"""Remote journal of completed recipe steps, used to resume a failed recipe."""
+
+import hashlib
+import json
+import shlex
+import time
+from typing import Any, Dict, Iterable
+
+JOURNAL_DIR = "/var/lib/cloudy/journal"
+
+
+def inputs_hash(inputs: Any, upstream: Iterable[str] = ()) -> str:
+    """
+    Hash a step's inputs together with the hashes of the steps it depends on,
+    so a changed input also invalidates everything downstream of it.
+    """
+    payload = json.dumps(
+        {"inputs": inputs, "upstream": list(upstream)}, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+class StepJournal:
+    """
+    Append-only JSON-lines file on the host recording `{step, hash, at}` for
+    every completed step. The last entry for a step wins. The journal
+    directory is 0700 and the file 0600; even so, steps should not pass
+    secrets as inputs, since a short unsalted hash of a weak password is
+    easy to brute-force.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.path = f"{JOURNAL_DIR}/{name}.jsonl"
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+    def load(self, c) -> Dict[str, Dict[str, Any]]:
+        """Read the journal from the host (one command); a missing file is an empty journal."""
+        result = c.sudo(f"cat {self.path} 2>/dev/null || true", hide=True, warn=True)
+        self.entries = {}
+        for line in (result.stdout or "").splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, dict) and "step" in entry:
+                self.entries[entry["step"]] = entry
+        return self.entries
+
+    def is_done(self, step: str, digest: str) -> bool:
+        """Check if the step completed with exactly these inputs."""
+        return self.entries.get(step, {}).get("hash") == digest
+
+    def record(self, c, step: str, digest: str) -> None:
+        """Append a completion record for the step."""
+        entry = {"step": step, "hash": digest, "at": int(time.time())}
+        self.entries[step] = entry
+        line = shlex.quote(json.dumps(entry, sort_keys=True))
+        script = (
+            f"umask 077; mkdir -p {JOURNAL_DIR} && chmod 700 {JOURNAL_DIR}"
+            f" && echo {line} >> {self.path}"
+        )
+        c.sudo(f"sh -c {shlex.quote(script)}", hide=True, warn=True)
+
+    def reset(self, c) -> None:
+        """Forget every recorded step so the next run starts from the top."""
+        self.entries = {}
+        c.sudo(f"rm -f {self.path}", hide=True, warn=True)
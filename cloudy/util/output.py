@@ -0,0 +1,83 @@
+"""Per-thread capture of stdout/stderr for tasks that run concurrently."""
+
+import io
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional, TextIO, Tuple
+
+
+class _RoutedStream(io.TextIOBase):
+    """sys.stdout/sys.stderr stand-in that writes to the current thread's capture buffer."""
+
+    def __init__(self, router: "OutputRouter", index: int) -> None:
+        super().__init__()
+        self.router = router
+        self.index = index
+
+    def _target(self) -> TextIO:
+        buffer = getattr(self.router._local, "buffer", None)
+        if buffer is not None:
+            return buffer
+        return self.router.saved[self.index]
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+    def isatty(self) -> bool:
+        return False
+
+    @property
+    def encoding(self):  # type: ignore[override]
+        return getattr(self.router.saved[self.index], "encoding", "utf-8")
+
+
+class OutputRouter:
+    """
+    Routes prints from worker threads into per-thread buffers.
+
+    While at least one capture is active, sys.stdout and sys.stderr are replaced
+    by routed streams; threads without a capture keep writing to the real
+    streams. Captures nest across threads: a fleet worker can capture a host's
+    output while step workers under it capture each step's output, and the step
+    output printed by the host's thread lands in the host's buffer.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._depth = 0
+        self.saved: Tuple[TextIO, TextIO] = (sys.stdout, sys.stderr)
+
+    def _install(self) -> None:
+        with self._lock:
+            if self._depth == 0:
+                self.saved = (sys.stdout, sys.stderr)
+                sys.stdout = _RoutedStream(self, 0)  # type: ignore[assignment]
+                sys.stderr = _RoutedStream(self, 1)  # type: ignore[assignment]
+            self._depth += 1
+
+    def _uninstall(self) -> None:
+        with self._lock:
+            self._depth -= 1
+            if self._depth == 0:
+                sys.stdout, sys.stderr = self.saved
+
+    @contextmanager
+    def capture(self) -> Iterator[io.StringIO]:
+        """Capture everything the current thread prints until the block exits."""
+        buffer = io.StringIO()
+        self._install()
+        previous: Optional[io.StringIO] = getattr(self._local, "buffer", None)
+        self._local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = previous
+            self._uninstall()
+
+
+output_router = OutputRouter()
@@ -0,0 +1,75 @@
+"""Polling with exponential backoff and a deadline, used instead of fixed sleeps."""
+
+import random
+import socket
+import time
+from typing import Callable, Iterator
+
+# Default upper bound for a readiness wait, in seconds
+DEFAULT_READY_TIMEOUT = 30.0
+
+# Default wait for sshd on a freshly booted machine, in seconds
+DEFAULT_SSH_TIMEOUT = 180.0
+
+
+def backoff_delays(
+    initial: float = 0.1, factor: float = 2.0, maximum: float = 2.0, jitter: float = 0.0
+) -> Iterator[float]:
+    """
+    Yield delays growing from initial by factor, capped at maximum.
+
+    With jitter (0-1), each delay is shortened by a random fraction of up to
+    `jitter`, so many waiters started together do not poll in lockstep.
+    """
+    delay = initial
+    while True:
+        yield delay * (1 - random.uniform(0, jitter)) if jitter else delay
+        delay = min(delay * factor, maximum)
+
+
+def wait_until(
+    check: Callable[[], bool],
+    timeout: float = DEFAULT_READY_TIMEOUT,
+    initial: float = 0.1,
+    maximum: float = 2.0,
+) -> bool:
+    """
+    Call check until it returns True or the deadline passes.
+
+    The first check runs immediately, so a service that is already up costs a
+    single probe; after that the wait doubles up to `maximum`. Exceptions from
+    check count as "not ready yet". The last sleep is cut short at the deadline.
+
+    Returns:
+        True if check succeeded, False on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    for delay in backoff_delays(initial, maximum=maximum):
+        try:
+            if check():
+                return True
+        except Exception:
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+    return False  # pragma: no cover
+
+
+def ssh_banner(host: str, port: int = 22, timeout: float = 5.0) -> str:
+    """Return the identification line an SSH server sends on connect ("SSH-2.0-...")."""
+    with socket.create_connection((host, int(port)), timeout=timeout) as sock:
+        return sock.recv(256).decode(errors="replace").strip()
+
+
+def wait_for_ssh(host: str, port: int = 22, timeout: float = DEFAULT_SSH_TIMEOUT) -> bool:
+    """
+    Wait until sshd on host:port answers with its banner.
+
+    An accepted TCP connection alone is not enough: during boot the port can
+    be open before sshd is serving, so the banner is what marks it ready.
+    """
+    return wait_until(
+        lambda: ssh_banner(host, port).startswith("SSH-"), timeout, initial=1.0, maximum=10.0
+    )
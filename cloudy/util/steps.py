@@ -0,0 +1,348 @@
+"""Dependency-aware step scheduler: run independent recipe steps concurrently on one host."""
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from colorama import Fore, Style
+
+from cloudy.util.context import Context
+from cloudy.util.journal import StepJournal, inputs_hash
+from cloudy.util.output import output_router
+from cloudy.util.trace import Span, trace_sink
+
+# Maximum number of steps running at once on a host (1 runs steps in order with live output)
+STEP_CONCURRENCY_ENV = "CLOUDY_STEP_CONCURRENCY"
+DEFAULT_STEP_CONCURRENCY = 4
+
+StepFunc = Callable[[Context], Optional[Context]]
+
+# Statuses that satisfy a dependency: run now, or completed earlier per the journal
+DONE_STATUSES = ("done", "journaled")
+
+
+class Step:
+    """One unit of a recipe, with the steps it depends on and the host resources it holds."""
+
+    def __init__(
+        self,
+        name: str,
+        func: StepFunc,
+        requires: Iterable[str] = (),
+        locks: Iterable[str] = (),
+        inputs: Any = None,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+        self.locks = list(locks)
+        self.inputs = inputs
+        self.digest = ""
+        self.status = "pending"
+        self.error = ""
+        self.started = 0.0
+        self.finished = 0.0
+
+    @property
+    def duration(self) -> float:
+        return max(self.finished - self.started, 0.0)
+
+
+class StepFailed(RuntimeError):
+    """Raised after a recipe run in which at least one step failed."""
+
+    def __init__(self, graph: str, failed: List[Step]) -> None:
+        self.failed = failed
+        details = "; ".join(f"{s.name}: {s.error}" for s in failed)
+        super().__init__(f"{graph}: {len(failed)} step(s) failed ({details})")
+
+
+def step_concurrency() -> int:
+    """Return the configured number of concurrent steps per host."""
+    try:
+        return max(int(os.environ.get(STEP_CONCURRENCY_ENV, DEFAULT_STEP_CONCURRENCY)), 1)
+    except ValueError:
+        return DEFAULT_STEP_CONCURRENCY
+
+
+class StepGraph:
+    """
+    A recipe expressed as steps with dependencies and host-level resource locks.
+
+    Ready steps (all dependencies done, no lock held by a running step) run in
+    parallel, each on its own Context, so they use separate SSH channels on the
+    shared transport. Locks are plain names, e.g. "dpkg" for anything that runs
+    apt, or "ufw" for firewall changes. A step that returns a Context (e.g.
+    after `c.reconnect()`) hands that connection to every step started later.
+
+    After a failure no new steps are started; running ones are allowed to
+    finish and StepFailed is raised. A timing report with the critical path
+    (the dependency chain that bounds the total time) is printed at the end.
+
+    With journal=True, every completed step is recorded on the host together
+    with a hash of its inputs (and of its dependencies' hashes). A rerun skips
+    steps whose hash is unchanged, so a failed recipe resumes where it stopped.
+
+    Example:
+        steps = StepGraph("standalone")
+
+        @steps.step("packages", locks=["dpkg"])
+        def _(c):
+            plan.install(c)
+
+        @steps.step("geoip-data")
+        def _(c):
+            geoip.web_geoip_install_maxmind_city(c)
+
+        c = steps.run(c)
+    """
+
+    def __init__(self, name: str, concurrency: Optional[int] = None, journal: bool = False) -> None:
+        self.name = name
+        self.concurrency = concurrency or step_concurrency()
+        self.journal = StepJournal(name) if journal else None
+        self.steps: Dict[str, Step] = {}
+        self.context: Optional[Context] = None
+        self.elapsed = 0.0
+        self._origin = 0.0
+
+    def add(
+        self,
+        name: str,
+        func: StepFunc,
+        requires: Iterable[str] = (),
+        locks: Iterable[str] = (),
+        inputs: Any = None,
+    ) -> Step:
+        """
+        Add a step; dependencies may be declared before or after this call.
+
+        inputs is any JSON-serializable value (typically the config values the
+        step uses); changing it makes the journal rerun the step.
+        """
+        if name in self.steps:
+            raise ValueError(f"Duplicate step '{name}' in {self.name}")
+        step = Step(name, func, requires, locks, inputs)
+        self.steps[name] = step
+        return step
+
+    def step(
+        self, name: str, requires: Iterable[str] = (), locks: Iterable[str] = (), inputs: Any = None
+    ) -> Callable[[StepFunc], StepFunc]:
+        """Decorator form of add()."""
+
+        def decorator(func: StepFunc) -> StepFunc:
+            self.add(name, func, requires, locks, inputs)
+            return func
+
+        return decorator
+
+    def order(self) -> List[Step]:
+        """
+        Return the steps in dependency order, otherwise keeping declaration order.
+
+        Raises:
+            ValueError: On unknown dependencies or cycles.
+        """
+        for step in self.steps.values():
+            for dep in step.requires:
+                if dep not in self.steps:
+                    raise ValueError(f"Step '{step.name}' requires unknown step '{dep}'")
+
+        ordered: List[Step] = []
+        placed: Set[str] = set()
+        while len(ordered) < len(self.steps):
+            ready = next(
+                (
+                    s
+                    for s in self.steps.values()
+                    if s.name not in placed and all(d in placed for d in s.requires)
+                ),
+                None,
+            )
+            if ready is None:
+                stuck = ", ".join(s.name for s in self.steps.values() if s.name not in placed)
+                raise ValueError(f"Dependency cycle in {self.name} between: {stuck}")
+            ordered.append(ready)
+            placed.add(ready.name)
+        return ordered
+
+    def _plan_resume(self, c: Context, order: List[Step], from_step: str, force: Set[str]) -> None:
+        """Mark steps completed earlier (per the journal or --from-step) as journaled."""
+        for step in order:
+            upstream = [self.steps[d].digest for d in step.requires]
+            step.digest = inputs_hash(step.inputs, upstream)
+
+        names = [s.name for s in order]
+        for name in [from_step, *force]:
+            if name and name not in names:
+                print(f"ℹ️  Step '{name}' is not part of {self.name}; ignoring it here")
+
+        if self.journal is not None:
+            self.journal.load(c)
+        start = names.index(from_step) if from_step in names else None
+        for index, step in enumerate(order):
+            if start is not None:
+                if index < start:
+                    step.status = "journaled"
+                continue
+            if step.name in force:
+                continue
+            if self.journal is not None and self.journal.is_done(step.name, step.digest):
+                step.status = "journaled"
+
+    def run(self, c: Context, from_step: str = "", force_steps: Iterable[str] = ()) -> Context:
+        """
+        Run every step and return the Context later code should use.
+
+        Args:
+            from_step: Treat steps before this one as done and rerun it and all later steps
+            force_steps: Steps to rerun even if the journal says they are done
+        """
+        order = self.order()
+        for step in order:
+            step.status, step.error = "pending", ""
+            step.started = step.finished = 0.0
+        self._plan_resume(c, order, from_step, {f for f in force_steps if f})
+        resumed = [s.name for s in order if s.status == "journaled"]
+        if resumed:
+            print(f"\n⏩ [{self.name}] already done, skipping: {', '.join(resumed)}")
+        self.context = c
+        started = time.monotonic()
+        self._origin = started
+        try:
+            if self.concurrency == 1:
+                self._run_sequential(order)
+            else:
+                self._run_parallel(order)
+        finally:
+            self.elapsed = time.monotonic() - started
+            print(self.report())
+
+        failed = [s for s in order if s.status == "failed"]
+        if failed:
+            raise StepFailed(self.name, failed)
+        return self.context
+
+    def _execute(self, step: Step) -> None:
+        host = self.context.host if self.context is not None else ""
+        with trace_sink.span(step.name, "step", host, graph=self.name):
+            self._execute_step(step)
+
+    def _execute_step(self, step: Step) -> None:
+        step.started = time.monotonic()
+        try:
+            result = step.func(Context.clone(self.context))  # type: ignore[arg-type]
+            if isinstance(result, Context):
+                self.context = result
+            if self.journal is not None:
+                self.journal.record(self.context, step.name, step.digest)
+            step.status = "done"
+        except (Exception, SystemExit) as e:
+            step.status = "failed"
+            step.error = f"{type(e).__name__}: {e}"
+        finally:
+            step.finished = time.monotonic()
+
+    def _run_sequential(self, order: List[Step]) -> None:
+        for step in order:
+            if step.status != "pending":
+                continue
+            if any(s.status == "failed" for s in order):
+                step.status = "skipped"
+                continue
+            print(f"\n{Fore.MAGENTA}▶ [{self.name}] {step.name}{Style.RESET_ALL}")
+            self._execute(step)
+
+    def _run_captured(self, step: Step, parent: Optional[Span]) -> str:
+        with output_router.capture() as buffer, trace_sink.inherit(parent):
+            self._execute(step)
+        return buffer.getvalue()
+
+    def _run_parallel(self, order: List[Step]) -> None:
+        held: Set[str] = set()
+        running: Dict[Future, Step] = {}
+        failed = False
+        parent = trace_sink.current_span
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while True:
+                if not failed:
+                    for step in order:
+                        if len(running) >= self.concurrency:
+                            break
+                        if step.status != "pending":
+                            continue
+                        if not all(self.steps[d].status in DONE_STATUSES for d in step.requires):
+                            continue
+                        if held.intersection(step.locks):
+                            continue
+                        step.status = "running"
+                        held.update(step.locks)
+                        running[pool.submit(self._run_captured, step, parent)] = step
+
+                if not running:
+                    break
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    held.difference_update(step.locks)
+                    # Print each step's output as one block, from this thread, so an
+                    # enclosing capture (e.g. a fleet run) collects it for the host
+                    self._print_step_output(step, future.result())
+                    failed = failed or step.status == "failed"
+
+        for step in order:
+            if step.status == "pending":
+                step.status = "skipped"
+
+    def _print_step_output(self, step: Step, output: str) -> None:
+        color = Fore.GREEN if step.status == "done" else Fore.RED
+        prefix = f"{color}[{step.name}]{Style.RESET_ALL} "
+        for line in output.splitlines():
+            print(f"{prefix}{line}")
+        suffix = f": {step.error}" if step.error else ""
+        print(f"{prefix}{step.status.upper()} in {step.duration:.1f}s{suffix}")
+
+    def critical_path(self) -> List[Step]:
+        """Return the chain of dependencies with the largest total step time."""
+        best: Dict[str, float] = {}
+        via: Dict[str, Optional[str]] = {}
+        for step in self.order():
+            parent = max(step.requires, key=lambda d: best[d], default=None)
+            best[step.name] = step.duration + (best[parent] if parent else 0.0)
+            via[step.name] = parent
+
+        if not best:
+            return []
+        name: Optional[str] = max(best, key=lambda n: best[n])
+        path: List[Step] = []
+        while name:
+            path.append(self.steps[name])
+            name = via[name]
+        return list(reversed(path))
+
+    def report(self) -> str:
+        """Render per-step timings, marking the critical path with '*'."""
+        critical = self.critical_path()
+        on_path = {s.name for s in critical}
+        width = max([len("STEP")] + [len(n) for n in self.steps])
+        lines = [
+            f"\n{Fore.CYAN}⏱  {self.name}: step timings (* = critical path){Style.RESET_ALL}",
+            f"  {'STEP':<{width}}  {'START':>8}  {'TIME':>8}  STATUS",
+        ]
+        for step in sorted(self.steps.values(), key=lambda s: (s.started or float("inf"))):
+            mark = "*" if step.name in on_path else " "
+            start = f"{step.started - self._origin:.1f}s" if step.started else "-"
+            lines.append(
+                f"{mark} {step.name:<{width}}  {start:>8}  {step.duration:>7.1f}s  {step.status}"
+            )
+        total = sum(s.duration for s in self.steps.values())
+        path_time = sum(s.duration for s in critical)
+        lines.append(
+            f"  critical path: {' → '.join(s.name for s in critical)} ({path_time:.1f}s); "
+            f"wall {self.elapsed:.1f}s vs {total:.1f}s of step time"
+        )
+        return "\n".join(lines)
@@ -0,0 +1,306 @@
+"""
+Opt-in tracing of remote work.
+
+- CLOUDY_TRACE: one JSON line per remote command, plus a report over trace files.
+- CLOUDY_SPANS: nested task/step/command spans exported in Chrome trace_event
+  format at exit, for flame-chart viewers (chrome://tracing, ui.perfetto.dev).
+"""
+
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+# Path of the JSON-lines file to append command records to (unset disables tracing)
+TRACE_ENV = "CLOUDY_TRACE"
+
+# Path of the Chrome trace_event JSON file written at exit (unset disables spans)
+SPANS_ENV = "CLOUDY_SPANS"
+
+_span_ids = itertools.count(1)
+
+
+class Span:
+    """A timed unit of work (host, task, step or command) nested under its parent."""
+
+    def __init__(
+        self, name: str, cat: str, host: str = "", parent: Optional["Span"] = None, **args: Any
+    ) -> None:
+        self.id = next(_span_ids)
+        self.name = name
+        self.cat = cat
+        self.host = host
+        self.parent = parent
+        self.args = args
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.end = 0.0
+
+
+class TraceSink:
+    """
+    Thread-safe writer for command records.
+
+    The destination is read from CLOUDY_TRACE on every record, so tracing can be
+    switched on per invocation without touching any task code.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._path: Optional[str] = None
+        self._file: Optional[TextIO] = None
+        self._local = threading.local()
+        self.spans: List[Span] = []
+
+    @property
+    def path(self) -> str:
+        return os.path.expanduser(os.environ.get(TRACE_ENV, ""))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @property
+    def spans_path(self) -> str:
+        return os.path.expanduser(os.environ.get(SPANS_ENV, ""))
+
+    @property
+    def spans_enabled(self) -> bool:
+        return bool(self.spans_path)
+
+    @property
+    def _stack(self) -> List[Span]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @property
+    def current_span(self) -> Optional[Span]:
+        """Innermost open span of this thread, or the parent it inherited from another thread."""
+        if self._stack:
+            return self._stack[-1]
+        return getattr(self._local, "base", None)
+
+    @property
+    def current_task(self) -> str:
+        span = self.current_span
+        while span is not None and span.cat != "task":
+            span = span.parent
+        return span.name if span is not None else ""
+
+    @contextmanager
+    def span(self, name: str, cat: str, host: str = "", **args: Any) -> Iterator[Span]:
+        """Open a span nested under the current one; kept for export when CLOUDY_SPANS is set."""
+        span = Span(name, cat, host, self.current_span, **args)
+        self._stack.append(span)
+        try:
+            yield span
+        finally:
+            span.end = time.time()
+            self._stack.pop()
+            if self.spans_enabled:
+                with self._lock:
+                    self.spans.append(span)
+
+    def task(self, name: str, host: str = "") -> Any:
+        """Attribute commands run inside the block to the named task."""
+        return self.span(name, "task", host)
+
+    @contextmanager
+    def inherit(self, parent: Optional[Span]) -> Iterator[None]:
+        """Nest spans opened by this (worker) thread under a span of the thread that spawned it."""
+        previous = getattr(self._local, "base", None)
+        self._local.base = parent
+        try:
+            yield
+        finally:
+            self._local.base = previous
+
+    def export_chrome(self, path: Optional[str] = None) -> str:
+        """
+        Write finished spans as Chrome trace_event JSON and return the path.
+
+        Each host becomes a process and each thread a track, so nested tasks
+        and commands stack into a flame chart and parallel steps or hosts show
+        up side by side.
+        """
+        path = path or self.spans_path
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        origin = spans[0].start if spans else 0.0
+        pids: Dict[str, int] = {}
+        tids: Dict[Tuple[str, str], int] = {}
+        events: List[Dict[str, Any]] = []
+        for span in spans:
+            host = span.host or "local"
+            if host not in pids:
+                pids[host] = len(pids) + 1
+                events.append(
+                    {"ph": "M", "name": "process_name", "pid": pids[host], "args": {"name": host}}
+                )
+            if (host, span.thread) not in tids:
+                tids[(host, span.thread)] = len(tids) + 1
+                events.append(
+                    {
+                        "ph": "M",
+                        "name": "thread_name",
+                        "pid": pids[host],
+                        "tid": tids[(host, span.thread)],
+                        "args": {"name": span.thread},
+                    }
+                )
+            args = {"id": span.id, "parent": span.parent.id if span.parent else None}
+            args.update(span.args)
+            events.append(
+                {
+                    "ph": "X",
+                    "name": span.name,
+                    "cat": span.cat,
+                    "ts": round((span.start - origin) * 1e6),
+                    "dur": round((span.end - span.start) * 1e6),
+                    "pid": pids[host],
+                    "tid": tids[(host, span.thread)],
+                    "args": args,
+                }
+            )
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+        return path
+
+    def write(self, record: Dict[str, Any]) -> None:
+        path = self.path
+        if not path:
+            return
+        line = json.dumps(record, sort_keys=True, default=str)
+        with self._lock:
+            if self._file is None or self._path != path:
+                if self._file is not None:
+                    self._file.close()
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._file = open(path, "a", buffering=1)
+                self._path = path
+            self._file.write(line + "\n")
+
+    def record(
+        self,
+        host: str,
+        kind: str,
+        command: str,
+        start: float,
+        end: float,
+        result: Any = None,
+        hidden: bool = False,
+        error: str = "",
+    ) -> None:
+        """Write one command record; result is an invoke Result (or None if it raised)."""
+        if not self.enabled:
+            return
+        stdout = getattr(result, "stdout", "") or ""
+        stderr = getattr(result, "stderr", "") or ""
+        self.write(
+            {
+                "host": host,
+                "task": self.current_task,
+                "kind": kind,
+                "command": command,
+                "start": round(start, 6),
+                "end": round(end, 6),
+                "duration": round(end - start, 6),
+                "exit_code": getattr(result, "return_code", None),
+                "stdout_bytes": len(stdout.encode()),
+                "stderr_bytes": len(stderr.encode()),
+                "hidden": bool(hidden),
+                "error": error,
+                "pid": os.getpid(),
+            }
+        )
+
+
+trace_sink = TraceSink()
+
+
+def _export_spans_at_exit() -> None:
+    """Write the span trace when the process exits, if CLOUDY_SPANS is set."""
+    if trace_sink.spans_enabled and trace_sink.spans:
+        path = trace_sink.export_chrome()
+        print(f"Span trace written to {path} (open in ui.perfetto.dev or chrome://tracing)")
+
+
+atexit.register(_export_spans_at_exit)
+
+
+def load_trace(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    """Read command records from one or more trace files, skipping malformed lines."""
+    records = []
+    for path in paths:
+        with open(os.path.expanduser(path)) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and "duration" in record:
+                    records.append(record)
+    return records
+
+
+def _table(title: str, header: List[str], rows: List[List[str]]) -> List[str]:
+    widths = [max([len(h)] + [len(r[i]) for r in rows]) for i, h in enumerate(header)]
+    lines = [f"\n{title}", "  ".join(h.ljust(w) for h, w in zip(header, widths))]
+    lines.append("-" * len(lines[-1]))
+    lines.extend("  ".join(c.ljust(w) for c, w in zip(row, widths)) for row in rows)
+    return lines
+
+
+def format_report(records: List[Dict[str, Any]], top: int = 15) -> str:
+    """Rank the slowest single commands, repeated commands and tasks across the records."""
+    if not records:
+        return "No trace records found."
+
+    def short(text: str, width: int = 70) -> str:
+        text = " ".join(str(text).split())
+        return text if len(text) <= width else text[: width - 1] + "…"
+
+    total = sum(r["duration"] for r in records)
+    hosts = {r.get("host", "") for r in records}
+    lines = [f"{len(records)} commands on {len(hosts)} host(s), {total:.1f}s of remote time"]
+
+    slowest = sorted(records, key=lambda r: r["duration"], reverse=True)[:top]
+    lines += _table(
+        f"Slowest commands (top {len(slowest)})",
+        ["TIME", "EXIT", "HOST", "TASK", "COMMAND"],
+        [
+            [
+                f"{r['duration']:.2f}s",
+                str(r.get("exit_code")),
+                r.get("host", ""),
+                r.get("task", ""),
+                short(r.get("command", "")),
+            ]
+            for r in slowest
+        ],
+    )
+
+    by_command: Dict[str, List[float]] = defaultdict(list)
+    by_task: Dict[str, List[float]] = defaultdict(list)
+    for r in records:
+        by_command[short(r.get("command", ""))].append(r["duration"])
+        by_task[r.get("task") or "(no task)"].append(r["duration"])
+
+    for title, groups, label in (
+        ("Commands by total time", by_command, "COMMAND"),
+        ("Tasks by total command time", by_task, "TASK"),
+    ):
+        ranked = sorted(groups.items(), key=lambda kv: sum(kv[1]), reverse=True)[:top]
+        lines += _table(
+            title,
+            ["TOTAL", "COUNT", "MAX", label],
+            [[f"{sum(d):.2f}s", str(len(d)), f"{max(d):.2f}s", name] for name, d in ranked],
+        )
+    return "\n".join(lines)
@@ -1,28 +1,47 @@
+import io
 import os
+import shlex
 
 from fabric import task
 
-from cloudy.sys.core import sys_reload_service
+from cloudy.sys.apt import sys_apt_install
+from cloudy.sys.core import sys_notify_service
 from cloudy.sys.etc import sys_etc_git_commit
-from cloudy.sys.ports import sys_show_next_available_port
+from cloudy.sys.ports import sys_allocate_ports
 from cloudy.util.context import Context
+from cloudy.util.template import ConfigTemplate
+
+APACHE_PACKAGES = ["apache2"]
+
+SITE_TEMPLATE = ConfigTemplate("apache2/site.conf", {"example.com": str, "port_num": int})
+
+
+def apache2_mod_packages(py_version: str = "3") -> list:
+    """Return the apache2 module packages for a python version."""
+    mod_wsgi = "libapache2-mod-wsgi-py3" if "3" in py_version else "libapache2-mod-wsgi"
+    return [mod_wsgi, "libapache2-mod-rpaf"]
 
 
 @task
 @Context.wrap_context
 def web_apache2_install(c: Context):
     """Install apache2 and related modules."""
-    c.sudo("apt -y install apache2")
+    sys_apt_install(c, APACHE_PACKAGES)
     web_apache2_install_mods(c)
-    util_apache2_bootstrap(c)
-    sys_etc_git_commit(c, "Installed apache2")
+    if util_apache2_bootstrap(c):
+        sys_notify_service(c, "apache2", "reload")
+        sys_etc_git_commit(c, "Installed apache2")
 
 
 @task
 @Context.wrap_context
-def util_apache2_bootstrap(c: Context):
-    """Bootstrap Apache2 configuration from local templates."""
-    c.sudo("rm -rf /etc/apache2/*")
+def util_apache2_bootstrap(c: Context) -> bool:
+    """
+    Bootstrap Apache2 configuration from local templates.
+
+    Returns:
+        True if any config file changed (the caller should reload apache2).
+    """
     cfgdir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../cfg"))
 
     configs = {
@@ -31,56 +50,56 @@ def util_apache2_bootstrap(c: Context):
         "apache2/ports.conf": "/etc/apache2/ports.conf",
     }
 
+    changed = False
     for local, remote in configs.items():
         localcfg = os.path.expanduser(os.path.join(cfgdir, local))
-        c.put(localcfg, remote, use_sudo=True)
+        changed = c.upload(localcfg, remote) or changed
 
-    c.sudo("mkdir -p /etc/apache2/sites-available /etc/apache2/sites-enabled")
+    # Drop the distro's default site; only our sites are enabled
+    c.sudo(
+        "mkdir -p /etc/apache2/sites-available /etc/apache2/sites-enabled && "
+        "rm -f /etc/apache2/sites-enabled/000-default.conf"
+    )
+    return changed
 
 
 @task
 @Context.wrap_context
 def web_apache2_install_mods(c: Context, py_version="3"):
     """Install apache2 related packages."""
-    mod_wsgi = "libapache2-mod-wsgi-py3" if "3" in py_version else "libapache2-mod-wsgi"
-    requirements = [mod_wsgi, "libapache2-mod-rpaf"]
-    c.sudo(f'apt -y install {" ".join(requirements)}')
+    sys_apt_install(c, apache2_mod_packages(py_version))
     sys_etc_git_commit(c, "Installed apache2 and related packages")
 
 
 @task
 @Context.wrap_context
 def web_apache2_set_port(c: Context, port=""):
-    """Setup Apache2 to listen to a new port."""
+    """Setup Apache2 to listen on a port (the next free one if not given)."""
     remotecfg = "/etc/apache2/ports.conf"
-    port = sys_show_next_available_port(c, port)
-    c.sudo(f"sh -c 'echo \"Listen 127.0.0.1:{port}\" >> {remotecfg}'")
-    sys_reload_service(c, "apache2")
-    sys_etc_git_commit(c, f"Apache now listens on port {port}")
+    if not port:
+        port = sys_allocate_ports(c)[0]
+    listen = f"Listen 127.0.0.1:{port}"
+    script = (
+        f'grep -qx "{listen}" {remotecfg} || {{ echo "{listen}" >> {remotecfg} && echo added; }}'
+    )
+    result = c.sudo(f"sh -c {shlex.quote(script)}", hide=True)
+    if "added" in result.stdout:
+        sys_notify_service(c, "apache2", "reload")
+        sys_etc_git_commit(c, f"Apache now listens on port {port}")
 
 
 @task
 @Context.wrap_context
 def web_apache2_setup_domain(c: Context, port: str, domain: str = ""):
-    """Setup Apache2 config file for a domain."""
-    apache_avail_dir = "/etc/apache2/sites-available"
-    cfgdir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../cfg"))
-    localcfg = os.path.expanduser(os.path.join(cfgdir, "apache2/site.conf"))
-    remotecfg = f"{apache_avail_dir}/{domain}"
-
-    c.sudo(f"rm -rf {remotecfg}")
-    c.put(localcfg, remotecfg, use_sudo=True)
-
-    # Escape domain for sed replacement
-    escaped_domain = domain.replace(".", r"\.")
-
-    c.sudo(f'sed -i "s/port_num/{port}/g" {remotecfg}')
-    c.sudo(f'sed -i "s/example\\.com/{escaped_domain}/g" {remotecfg}')
-
-    c.sudo(f"chown -R root:root {apache_avail_dir}")
-    c.sudo(f"chmod -R 755 {apache_avail_dir}")
-    c.sudo(f"a2ensite {domain}")
-
+    """Setup Apache2 config file for a domain (rendered locally, uploaded if changed)."""
+    config = SITE_TEMPLATE.render({"example.com": domain, "port_num": port})
+    # a2ensite only picks up site files ending in .conf
+    remotecfg = f"/etc/apache2/sites-available/{domain}.conf"
+    changed = c.upload(io.StringIO(config), remotecfg)
+
+    # Both steps are idempotent, so a rerun repairs a disabled site or missing Listen line
+    enabled = c.sudo(f"a2ensite {domain}", hide=True)
     web_apache2_set_port(c, port)
-    sys_reload_service(c, "apache2")
-    sys_etc_git_commit(c, f"Setup Apache Config for Domain {domain}")
+    if changed or "already enabled" not in enabled.stdout:
+        sys_notify_service(c, "apache2", "reload")
+        sys_etc_git_commit(c, f"Setup Apache Config for Domain {domain}")
@@ -1,44 +1,64 @@
+import io
 import os
 
 from fabric import task
 
-from cloudy.sys.core import sys_restart_service
+from cloudy.sys.apt import sys_apt_install
+from cloudy.sys.core import sys_notify_service
 from cloudy.sys.etc import sys_etc_git_commit
 from cloudy.util.context import Context
+from cloudy.util.template import ConfigTemplate
+
+NGINX_PACKAGES = ["nginx"]
+
+SITE_PLACEHOLDERS = {
+    "example.com": str,
+    "public_interface": str,
+    "upstream_address": str,
+    "upstream_port": int,
+}
+SITE_TEMPLATES = {
+    "http": ConfigTemplate("nginx/http.conf", SITE_PLACEHOLDERS),
+    "https": ConfigTemplate("nginx/https.conf", SITE_PLACEHOLDERS),
+}
 
 
 @task
 @Context.wrap_context
 def web_nginx_install(c: Context):
     """Install Nginx and bootstrap configuration."""
-    c.sudo("apt -y install nginx")
-    web_nginx_bootstrap(c)
-    sys_restart_service(c, "nginx")
-    sys_etc_git_commit(c, "Installed Nginx")
+    sys_apt_install(c, NGINX_PACKAGES)
+    if web_nginx_bootstrap(c):
+        sys_notify_service(c, "nginx")
+        sys_etc_git_commit(c, "Installed Nginx")
 
 
 @task
 @Context.wrap_context
-def web_nginx_bootstrap(c: Context):
-    """Bootstrap Nginx configuration from local templates."""
-    c.sudo("rm -rf /etc/nginx/*")
+def web_nginx_bootstrap(c: Context) -> bool:
+    """
+    Bootstrap Nginx configuration from local templates.
+
+    Returns:
+        True if any config file changed (the caller should restart nginx).
+    """
     cfgdir = os.path.join(os.path.dirname(__file__), "../cfg")
 
     configs = {
         "nginx/nginx.conf": "/etc/nginx/nginx.conf",
         "nginx/mime.types.conf": "/etc/nginx/mime.types",
     }
+    changed = False
     for local, remote in configs.items():
         localcfg = os.path.expanduser(os.path.join(cfgdir, local))
-        # Put to temp location, then move with sudo
-        temp_path = f"/tmp/{os.path.basename(remote)}"
-        c.put(localcfg, temp_path)
-        c.sudo(f"mv {temp_path} {remote}")
-        c.sudo(f"chown root:root {remote}")
-        c.sudo(f"chmod 644 {remote}")
+        changed = c.upload(localcfg, remote) or changed
 
-    c.sudo("mkdir -p /etc/nginx/sites-available")
-    c.sudo("mkdir -p /etc/nginx/sites-enabled")
+    # Drop the distro's default site; our nginx.conf only includes sites-enabled/*
+    c.sudo(
+        "mkdir -p /etc/nginx/sites-available /etc/nginx/sites-enabled && "
+        "rm -f /etc/nginx/sites-enabled/default"
+    )
+    return changed
 
 
 @task
@@ -73,7 +93,7 @@ def web_nginx_setup_domain(
     upstream_address: str = "",
     upstream_port: str = "",
 ):
-    """Setup Nginx config file for a domain."""
+    """Setup Nginx config file for a domain (rendered locally, uploaded if changed)."""
     if "https" in proto or "ssl" in proto:
         proto = "https"
         ssl_crt = f"/etc/ssl/nginx/crt/{domain}.combo.crt"
@@ -83,3 +103,23 @@ def web_nginx_setup_domain(
             or not c.sudo(f"test -f {ssl_key}", warn=True).ok
         ):
             print(f"⚠️ SSL certificate and key not found.\n{ssl_crt}\n{ssl_key}")
+            return
+    else:
+        proto = "http"
+
+    config = SITE_TEMPLATES[proto].render(
+        {
+            "example.com": domain,
+            "public_interface": interface,
+            "upstream_address": upstream_address or "127.0.0.1",
+            "upstream_port": upstream_port,
+        }
+    )
+    remotecfg = f"/etc/nginx/sites-available/{domain}"
+    enabled = f"/etc/nginx/sites-enabled/{domain}"
+    changed = c.upload(io.StringIO(config), remotecfg)
+    linked = c.sudo(f"test -L {enabled} || {{ ln -sf {remotecfg} {enabled} && echo linked; }}")
+    if changed or "linked" in linked.stdout:
+        c.sudo("nginx -t", hide=True)
+        sys_notify_service(c, "nginx", "reload")
+        sys_etc_git_commit(c, f"Setup Nginx Config for Domain {domain}")
@@ -6,6 +6,7 @@ from invoke import Context as InvokeContext
 from paramiko.ssh_exception import AuthenticationException, SSHException
 
 from cloudy.sys import (
+    apt,
     core,
     docker,
     etc,
@@ -21,6 +22,7 @@ from cloudy.sys import (
     ssh,
     swap,
     timezone,
+    trace,
     user,
     vim,
 )
@@ -30,6 +32,7 @@ from cloudy.aws import ec2
 from cloudy.srv import (
     recipe_cache_redis,
     recipe_database_psql_gis,
+    recipe_fleet,
     recipe_generic_server,
     recipe_loadbalancer_nginx,
     recipe_standalone_server,
@@ -61,11 +64,17 @@ def help(c):
     ├── recipe.lb-install     - Nginx load balancer setup
     ├── recipe.vpn-install    - VPN server setup
     └── recipe.sta-install    - Standalone server setup
+
+    🛰️  FLEET COMMANDS (Many hosts in parallel)
+    ├── fleet.run             - Run a recipe on hosts/inventory groups concurrently
+    └── fleet.hosts           - Show the hosts a fleet run would target
     
     🎛️  GLOBAL FLAGS (for any command)
     ├── --debug, -d           - Enable Fabric debug mode + all output  
     ├── --echo, -e            - Echo commands before running
-    └── CLOUDY_VERBOSE=1      - Environment variable for verbose output
+    ├── CLOUDY_VERBOSE=1      - Environment variable for verbose output
+    ├── CLOUDY_TRACE=file     - Append a JSON line per remote command (see trace.report)
+    └── CLOUDY_SPANS=file     - Write nested task/command spans as a Chrome trace
 
     🔧 SYSTEM COMMANDS
     ├── sys.init              - Initialize and update system
@@ -121,6 +130,17 @@ recipe.add_task(recipe_vpn_server.setup_openvpn, name="vpn-install")
 recipe.add_task(recipe_standalone_server.setup_standalone, name="sta-install")
 ns.add_collection(recipe)
 
+# FLEET COMMANDS - Run recipes on many hosts in parallel
+fleet = Collection("fleet")
+fleet.add_task(recipe_fleet.fleet_run, name="run")
+fleet.add_task(recipe_fleet.fleet_hosts, name="hosts")
+ns.add_collection(fleet)
+
+# TRACE COMMANDS - Inspect CLOUDY_TRACE command traces
+trace_collection = Collection("trace")
+trace_collection.add_task(trace.sys_trace_report, name="report")
+ns.add_collection(trace_collection)
+
 # SYSTEM COMMANDS - All core system functionality
 sys = Collection("sys")
 
@@ -136,6 +156,7 @@ sys.add_task(core.sys_start_service, name="start-service")
 sys.add_task(core.sys_stop_service, name="stop-service")
 sys.add_task(core.sys_restart_service, name="restart-service")
 sys.add_task(core.sys_reload_service, name="reload-service")
+sys.add_task(core.sys_wait_for_service, name="wait-service")
 sys.add_task(core.sys_git_install, name="install-git")
 sys.add_task(core.sys_install_common, name="install-common")
 sys.add_task(core.sys_git_configure, name="configure-git")
@@ -143,6 +164,11 @@ sys.add_task(core.sys_add_hosts, name="add-hosts")
 sys.add_task(core.sys_locale_configure, name="configure-locale")
 sys.add_task(core.sys_mkdir, name="mkdir")
 sys.add_task(core.sys_shutdown, name="shutdown")
+sys.add_task(core.sys_clear_facts, name="clear-facts")
+sys.add_task(core.sys_show_journal, name="journal")
+sys.add_task(core.sys_reset_journal, name="reset-journal")
+sys.add_task(apt.sys_apt_update, name="apt-update")
+sys.add_task(apt.sys_apt_install_packages, name="apt-install")
 
 # User management
 sys.add_task(user.sys_user_add, name="add-user")
@@ -167,6 +193,8 @@ sys.add_task(python.sys_python_install_common, name="install-python")
 sys.add_task(vim.sys_set_default_editor, name="set-editor")
 sys.add_task(postfix.sys_install_postfix, name="install-postfix")
 sys.add_task(ports.sys_show_next_available_port, name="next-port")
+sys.add_task(ports.sys_allocate_ports, name="allocate-ports")
+sys.add_task(ports.sys_release_ports, name="release-ports")
 
 # Git and etc management
 sys.add_task(etc.sys_etc_git_init, name="git-init-etc")
@@ -345,6 +373,8 @@ aws = Collection("aws")
 aws.add_task(ec2.aws_list_nodes, name="list-nodes")
 aws.add_task(ec2.aws_get_node, name="get-node")
 aws.add_task(ec2.aws_create_node, name="create-node")
+aws.add_task(ec2.aws_create_nodes, name="create-nodes")
+aws.add_task(ec2.aws_wait_for_ssh, name="wait-ssh")
 aws.add_task(ec2.aws_destroy_node, name="destroy-node")
 aws.add_task(ec2.aws_list_sizes, name="list-sizes")
 aws.add_task(ec2.aws_get_size, name="get-size")
@@ -358,6 +388,9 @@ aws.add_task(ec2.aws_list_keypairs, name="list-keypairs")
 aws.add_task(ec2.aws_keypair_found, name="find-keypair")
 aws.add_task(ec2.aws_create_volume, name="create-volume")
 aws.add_task(ec2.aws_list_volumes, name="list-volumes")
+aws.add_task(ec2.aws_api_stats, name="api-stats")
+aws.add_task(ec2.aws_sync_inventory, name="sync-inventory")
+aws.add_task(ec2.aws_query_inventory, name="query-inventory")
 ns.add_collection(aws)
 
 
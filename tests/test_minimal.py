@@ -9,9 +9,10 @@ This test suite focuses on:
 4. Configuration system - basic config loading works
 """
 
+import os
 import sys
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import MagicMock, Mock, patch
 import importlib
 
 
@@ -22,6 +23,7 @@ class TestImports(unittest.TestCase):
         """Test that all sys modules can be imported."""
         sys_modules = [
             "cloudy.sys.core",
+            "cloudy.sys.apt",
             "cloudy.sys.user",
             "cloudy.sys.ssh",
             "cloudy.sys.firewall",
@@ -87,6 +89,7 @@ class TestImports(unittest.TestCase):
             "cloudy.srv.recipe_loadbalancer_nginx",
             "cloudy.srv.recipe_vpn_server",
             "cloudy.srv.recipe_standalone_server",
+            "cloudy.srv.recipe_fleet",
         ]
 
         for module_name in recipe_modules:
@@ -115,6 +118,7 @@ class TestFabfileStructure(unittest.TestCase):
 
         expected_collections = [
             "recipe",
+            "fleet",
             "sys",
             "db",
             "web",
@@ -204,6 +208,1365 @@ class TestConfigurationSystem(unittest.TestCase):
         except Exception as e:
             self.fail(f"Failed to instantiate CloudyConfig: {e}")
 
+    def test_config_load_is_cached_and_read_only(self):
+        """Test the shared config: cached by paths/mtimes, read-only, typed."""
+        import tempfile
+
+        from cloudy.util.conf import CloudyConfig
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "web.cfg")
+            with open(path, "w") as f:
+                f.write("[webserver]\nworkers = 3\ndomains = a.com, b.com\nssl = yes\n")
+
+            first = CloudyConfig.load(path)
+            self.assertIs(CloudyConfig.load(path), first)
+            self.assertEqual(first.get_variable("webserver", "workers"), "3")
+            self.assertEqual(first.get_list("webserver", "domains"), ["a.com", "b.com"])
+            self.assertTrue(first.get_boolean_config("webserver", "ssl"))
+            self.assertTrue(first.get_boolean_config("webserver", "missing", True))
+            with self.assertRaises(TypeError):
+                first.cfg_grid["WEBSERVER"]["workers"] = "9"
+            with self.assertRaises(AttributeError):
+                first.paths = []
+
+            with open(path, "a") as f:
+                f.write("timeout = 30\n")
+            os.utime(path, ns=(0, 10**18))
+            second = CloudyConfig.load(path)
+            self.assertIsNot(second, first)
+            self.assertEqual(second.get_variable("webserver", "timeout"), "30")
+            CloudyConfig._cache.clear()
+
+
+class TestConnectionRegistry(unittest.TestCase):
+    """Test that SSH transports are shared and invalidated correctly."""
+
+    def _client(self, active=True):
+        client = Mock()
+        client.get_transport.return_value = Mock(active=active)
+        return client
+
+    def test_registry_hit_and_miss(self):
+        """Test that an open client is handed back and counted as a hit."""
+        from cloudy.util.context import ConnectionRegistry
+
+        registry = ConnectionRegistry()
+        key = ("10.0.0.1", "root", 22, None)
+        self.assertIsNone(registry.acquire(key))
+
+        client = self._client()
+        registry.register(key, client)
+        self.assertIs(registry.acquire(key), client)
+        self.assertEqual(registry.stats(), {"hits": 1, "misses": 1, "open": 1})
+
+    def test_registry_drops_dead_and_invalidated_clients(self):
+        """Test that inactive transports and invalidated keys are not reused."""
+        from cloudy.util.context import ConnectionRegistry
+
+        registry = ConnectionRegistry()
+        key = ("10.0.0.1", "root", 22, None)
+        registry.register(key, self._client(active=False))
+        self.assertIsNone(registry.acquire(key))
+
+        client = self._client()
+        registry.register(key, client)
+        registry.invalidate(key)
+        client.close.assert_called_once()
+        self.assertIsNone(registry.acquire(key))
+
+    def test_context_registry_key(self):
+        """Test that the registry key covers host, user, port, gateway and connect kwargs."""
+        from cloudy.util.context import Context
+
+        ctx = Context(host="10.0.0.1", user="admin", port=22022)
+        self.assertEqual(ctx.registry_key[:4], ("10.0.0.1", "admin", 22022, None))
+        self.assertEqual(Context.clone(Context.clone(ctx)).registry_key, ctx.registry_key)
+
+        keyed = Context(host="10.0.0.1", user="admin", port=22022, connect_kwargs={})
+        keyed.connect_kwargs["key_filename"] = ["/keys/a.pem"]
+        other = Context(host="10.0.0.1", user="admin", port=22022, connect_kwargs={})
+        other.connect_kwargs["key_filename"] = ["/keys/b.pem"]
+        self.assertNotEqual(keyed.registry_key, other.registry_key)
+        self.assertNotEqual(keyed.registry_key, ctx.registry_key)
+
+    def test_shared_client_closes_with_last_user(self):
+        """Test that closing one Context keeps the transport open for the others."""
+        from cloudy.util.context import ConnectionRegistry
+
+        registry = ConnectionRegistry()
+        key = ("10.0.0.1", "root", 22, None, "")
+        first, second = Mock(), Mock()
+        client = self._client()
+        registry.register(key, client, first)
+        self.assertIs(registry.acquire(key, second), client)
+        self.assertEqual(registry.users(key), 2)
+
+        self.assertFalse(registry.release(key, client, first))
+        self.assertIs(registry.acquire(key), client)
+        self.assertTrue(registry.release(key, client, second))
+        self.assertIsNone(registry.acquire(key))
+        self.assertTrue(registry.release(key, self._client(), first))
+
+    def test_context_close_detaches_from_shared_client(self):
+        """Test that the first Context closing does not close a transport a clone still uses."""
+        from cloudy.util import context
+        from cloudy.util.context import ConnectionRegistry, Context
+
+        registry = ConnectionRegistry()
+        opener = Context(host="10.0.0.2", user="root")
+        shared = self._client()
+        with patch.object(context, "connection_registry", registry):
+            registry.register(opener.registry_key, shared, opener)
+            opener.client, opener.transport = shared, shared.get_transport()
+            clone = Context.clone(opener)
+            clone.open()
+            self.assertIs(clone.client, shared)
+
+            opener.close()
+            shared.close.assert_not_called()
+            self.assertIsNot(opener.client, shared)
+            self.assertIs(registry.acquire(clone.registry_key), shared)
+
+            clone.close()
+            shared.close.assert_called_once()
+
+
+class TestCommandBatch(unittest.TestCase):
+    """Test that batched commands render to one script and split back per command."""
+
+    def _run_script(self, batch):
+        import subprocess
+        import tempfile
+
+        with tempfile.NamedTemporaryFile("w", suffix=".sh", delete=False) as script:
+            script.write(batch.render())
+        proc = subprocess.run(["bash", script.name], capture_output=True, text=True)
+        return batch.apply(proc.stdout, proc.returncode)
+
+    def test_batch_results_per_command(self):
+        """Test that each command gets its own output and exit code."""
+        from cloudy.util.batch import CommandBatch
+
+        batch = CommandBatch()
+        first = batch.add("echo one")
+        soft = batch.add("exit 3", warn=True)
+        last = batch.add("echo two")
+        self._run_script(batch)
+
+        self.assertEqual((first.stdout, first.return_code), ("one", 0))
+        self.assertTrue(soft.failed)
+        self.assertEqual(soft.return_code, 3)
+        self.assertEqual((last.stdout, last.ok), ("two", True))
+
+    def test_batch_stops_on_failure(self):
+        """Test that set -e stops the script and later commands are skipped."""
+        from cloudy.util.batch import CommandBatch
+
+        batch = CommandBatch()
+        batch.add("true")
+        failed = batch.add("echo boom; exit 5")
+        skipped = batch.add("echo never")
+        self._run_script(batch)
+
+        self.assertEqual((failed.stdout, failed.return_code), ("boom", 5))
+        self.assertFalse(skipped.executed)
+        self.assertTrue(skipped.failed)
+
+    def test_batch_dropped_when_block_raises(self):
+        """Test that queued commands never run if the with-block raises."""
+        from fabric import Connection
+
+        from cloudy.util.context import Context
+
+        c = Context("batch1")
+        with patch.object(Context, "sftp") as sftp, patch.object(Connection, "sudo") as sudo:
+            with self.assertRaises(ValueError):
+                with c.batch():
+                    queued = c.sudo("chpasswd < /tmp/x")
+                    raise ValueError("task failed")
+        sftp.assert_not_called()
+        sudo.assert_not_called()
+        self.assertFalse(queued.executed)
+        self.assertIsNone(c._batch)
+
+    def test_batch_script_is_private_and_removed(self):
+        """Test that the script is made 0600 before it is written, and removed if it never ran."""
+        from fabric import Connection
+
+        from cloudy.util.context import Context
+
+        c = Context("batch2")
+        calls = []
+        remote = Mock()
+        remote.chmod.side_effect = lambda mode: calls.append(("chmod", mode))
+        remote.write.side_effect = lambda data: calls.append(("write", data))
+        sftp = Mock()
+        sftp.open.return_value.__enter__ = Mock(return_value=remote)
+        sftp.open.return_value.__exit__ = Mock(return_value=False)
+        result = Mock(stdout="sudo: a password is required", return_code=1)
+        with patch.object(Context, "sftp", return_value=sftp), patch.object(
+            Connection, "sudo", return_value=result
+        ), patch("builtins.print"):
+            with c.batch():
+                c.sudo("echo 'admin:secret' | chpasswd")
+        self.assertEqual(calls[0], ("chmod", 0o600))
+        self.assertEqual(calls[1][0], "write")
+        sftp.remove.assert_called_once_with(sftp.open.call_args[0][0])
+
+
+class TestFactStore(unittest.TestCase):
+    """Test that remote probe results are memoized per host and invalidated."""
+
+    def test_probe_runs_once_until_invalidated(self):
+        """Test that a fact is probed once and re-probed after invalidation."""
+        from cloudy.util.facts import FactStore, HostFacts
+
+        facts = HostFacts("10.0.0.1", FactStore(cache_dir="/nonexistent"))
+        probe = Mock(return_value="17")
+        self.assertEqual(facts.get("psql_version", probe), "17")
+        self.assertEqual(facts.get("psql_version", probe), "17")
+        probe.assert_called_once()
+
+        facts.invalidate("psql_version")
+        facts.get("psql_version", probe)
+        self.assertEqual(probe.call_count, 2)
+
+    def test_disk_cache_honors_ttl(self):
+        """Test that facts persist across stores only while the TTL is set."""
+        import tempfile
+
+        from cloudy.util.facts import FactStore, HostFacts
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with patch.dict("os.environ", {"CLOUDY_FACTS_TTL": "60"}):
+                HostFacts("db1", FactStore(cache_dir)).set("git_installed", True)
+                probe = Mock(return_value=False)
+                self.assertTrue(HostFacts("db1", FactStore(cache_dir)).get("git_installed", probe))
+                probe.assert_not_called()
+
+            with patch.dict("os.environ", {"CLOUDY_FACTS_TTL": "0"}):
+                self.assertFalse(HostFacts("db1", FactStore(cache_dir)).get("git_installed", probe))
+
+
+class TestAptPlan(unittest.TestCase):
+    """Test that package groups are merged into one deduped transaction."""
+
+    def test_groups_merge_in_order(self):
+        """Test that duplicates across groups are dropped and first-seen order kept."""
+        from cloudy.sys.apt import AptPlan
+
+        plan = AptPlan().add("common", ["git", "curl"]).add("web", ["nginx git", "curl"])
+        self.assertEqual(plan.packages, ["git", "curl", "nginx"])
+        self.assertEqual(plan.groups["web"], ["nginx", "git", "curl"])
+
+    def test_missing_filters_dpkg_status(self):
+        """Test that only 'install ok installed' packages count, with arch suffixes stripped."""
+        from cloudy.sys.apt import util_apt_missing
+
+        c = Mock()
+        c.run.return_value = Mock(
+            stdout=(
+                "git install ok installed\n"
+                "libxml2:amd64 install ok installed\n"
+                "postgis deinstall ok config-files\n"
+            )
+        )
+        missing = util_apt_missing(c, ["git", "libxml2", "postgis", "nginx=1.24*"])
+        self.assertEqual(missing, ["postgis", "nginx=1.24*"])
+        self.assertEqual(c.run.call_count, 1)
+        self.assertEqual(util_apt_missing(c, []), [])
+        self.assertEqual(c.run.call_count, 1)
+
+    def test_update_stamp_check(self):
+        """Test that a fresh on-host stamp skips apt update, and is remembered in memory only."""
+        from cloudy.sys import apt
+        from cloudy.util.context import Context
+
+        fresh, stale = Mock(ok=True), Mock(ok=False)
+        with patch.dict(apt._apt_fresh, clear=True), patch.object(
+            Context, "run", return_value=fresh
+        ) as run, patch.object(Context, "sudo") as sudo, patch(
+            "cloudy.util.facts.fact_store.set"
+        ) as remember:
+            self.assertFalse(apt.sys_apt_update(Context("apt1")))
+            self.assertIn("-mmin -60", run.call_args[0][0])
+            self.assertFalse(apt.sys_apt_update(Context("apt1")))
+            self.assertEqual(run.call_count, 1)
+            sudo.assert_not_called()
+            remember.assert_not_called()
+
+            run.return_value = stale
+            self.assertTrue(apt.sys_apt_update(Context("apt2")))
+            self.assertEqual(sudo.call_args_list[0][0][0], "apt -y update")
+            self.assertTrue(apt.sys_apt_update(Context("apt1"), force=True))
+
+    def test_pgis_purges_only_to_switch_versions(self):
+        """Test that an installed postgis of the wanted version is not purged."""
+        from cloudy.db import pgis
+        from cloudy.util.context import Context
+
+        with patch.object(pgis, "util_apt_missing", return_value=[]), patch.object(
+            pgis, "sys_apt_install"
+        ) as install, patch.object(pgis, "sys_start_service"), patch.object(
+            pgis, "sys_etc_git_commit"
+        ), patch.object(
+            Context, "sudo"
+        ) as sudo:
+            pgis.db_pgis_install(Context("gis1"), "17", "3")
+        sudo.assert_not_called()
+        install.assert_called_once()
+
+
+class TestPostgresRepo(unittest.TestCase):
+    """Test that the PGDG repository is only rewritten when it is out of date."""
+
+    def _install(self, host, current, force=False, known=None):
+        from cloudy.db.psql import db_psql_install_postgres_repo
+        from cloudy.util.context import Context
+
+        c = Context(host)
+        c.facts.invalidate()
+        if known is not None:
+            c.facts.set("pgdg_repo", known)
+        with patch.object(Context, "run", return_value=Mock(ok=current)) as run, patch.object(
+            Context, "sudo"
+        ) as sudo, patch("builtins.print"):
+            db_psql_install_postgres_repo(c, force=force)
+        c.facts.invalidate()
+        return run, [call[0][0] for call in sudo.call_args_list]
+
+    def test_matching_fingerprint_skips_repo_write(self):
+        """Test that a current keyring and sources entry skip the key fetch and apt update."""
+        run, commands = self._install("pgdg1", current=True)
+        self.assertIn("B97B0AFCAA1A47F044F244A07FCC7D46ACCC4CF8", run.call_args[0][0])
+        self.assertEqual(commands, [])
+
+    def test_mismatch_rewrites_repo(self):
+        """Test that a stale or missing repo gets a new key, sources entry and apt update."""
+        _, commands = self._install("pgdg2", current=False)
+        self.assertTrue(any("wget" in cmd and "ACCC4CF8.asc" in cmd for cmd in commands))
+        self.assertTrue(any("pgdg.list" in cmd for cmd in commands))
+        self.assertEqual(commands[-1], "apt update")
+
+    def test_force_bypasses_fact(self):
+        """Test that force=True rewrites the repo even when the fact says it is current."""
+        run, commands = self._install("pgdg3", current=True, force=True, known=True)
+        run.assert_not_called()
+        self.assertIn("apt update", commands)
+
+
+class TestFleetRunner(unittest.TestCase):
+    """Test parallel fleet execution with per-host output and failure isolation."""
+
+    def test_inventory_groups(self):
+        """Test that inventory groups resolve in order, deduped, with an implicit 'all'."""
+        import tempfile
+
+        from cloudy.util.fleet import load_inventory, resolve_hosts
+
+        with tempfile.NamedTemporaryFile("w", suffix=".ini", delete=False) as f:
+            f.write(
+                "# fleet\n[web]\nadmin@w1:22022\nadmin@w2:22022\n[db]\nroot@db1, admin@w1:22022\n"
+            )
+        try:
+            groups = load_inventory(f.name)
+            self.assertEqual(groups["all"], ["admin@w1:22022", "admin@w2:22022", "root@db1"])
+            self.assertEqual(
+                resolve_hosts("extra", f.name, "db"), ["extra", "root@db1", "admin@w1:22022"]
+            )
+            with self.assertRaises(ValueError):
+                resolve_hosts("", f.name, "missing")
+        finally:
+            os.unlink(f.name)
+
+    def test_failures_are_isolated_and_output_buffered(self):
+        """Test that one failing host does not stop others and output is prefixed per host."""
+        import io
+
+        from cloudy.util.fleet import FleetRunner, format_summary
+
+        def recipe(c, cfg_paths=None):
+            print(f"configuring {c.host} with {cfg_paths}")
+            if c.host == "bad":
+                raise RuntimeError("boom")
+
+        out = io.StringIO()
+        runner = FleetRunner(concurrency=3, out=out)
+        results = runner.run(["web1", "bad", "web2"], recipe, cfg_paths="x.cfg")
+
+        self.assertEqual([r.status for r in results], ["OK", "FAILED", "OK"])
+        self.assertIn("RuntimeError: boom", results[1].error)
+        self.assertIn("configuring web2 with x.cfg", results[2].output)
+        self.assertRegex(out.getvalue(), r"\[web1\].* configuring web1")
+        self.assertIn("2 ok, 1 failed", format_summary(results, runner.elapsed))
+
+
+class TestStepGraph(unittest.TestCase):
+    """Test dependency-aware step scheduling with resource locks."""
+
+    def _graph(self, concurrency=4):
+        import threading
+        import time
+
+        from cloudy.util.steps import StepGraph
+
+        graph = StepGraph("test", concurrency=concurrency)
+        active = {"dpkg": 0, "max_dpkg": 0}
+        lock = threading.Lock()
+        events = []
+
+        def make(name, seconds, uses_dpkg=False):
+            def func(c):
+                with lock:
+                    events.append(("start", name))
+                    if uses_dpkg:
+                        active["dpkg"] += 1
+                        active["max_dpkg"] = max(active["max_dpkg"], active["dpkg"])
+                time.sleep(seconds)
+                with lock:
+                    events.append(("end", name))
+                    if uses_dpkg:
+                        active["dpkg"] -= 1
+
+            return func
+
+        graph.add("packages", make("packages", 0.05, True), locks=["dpkg"])
+        graph.add("postgres", make("postgres", 0.2), requires=["packages"])
+        graph.add("python", make("python", 0.05, True), requires=["packages"], locks=["dpkg"])
+        graph.add("nginx", make("nginx", 0.05, True), requires=["packages"], locks=["dpkg"])
+        graph.add("geoip", make("geoip", 0.1))
+        return graph, events, active
+
+    def test_dependencies_locks_and_critical_path(self):
+        """Test that deps are honored, locks serialize, and the critical path is reported."""
+        from cloudy.util.context import Context
+
+        graph, events, active = self._graph()
+        with patch("builtins.print"):
+            graph.run(Context("localhost"))
+
+        self.assertLess(events.index(("end", "packages")), events.index(("start", "postgres")))
+        self.assertEqual(active["max_dpkg"], 1)
+        self.assertLess(graph.elapsed, sum(s.duration for s in graph.steps.values()))
+        self.assertEqual([s.name for s in graph.critical_path()], ["packages", "postgres"])
+
+    def test_failure_skips_dependents_and_cycles_rejected(self):
+        """Test that a failed step stops its dependents and cycles are detected."""
+        from cloudy.util.context import Context
+        from cloudy.util.steps import StepFailed, StepGraph
+
+        graph = StepGraph("test", concurrency=2)
+        graph.add("a", Mock(side_effect=RuntimeError("boom")))
+        after = Mock()
+        graph.add("b", after, requires=["a"])
+        with patch("builtins.print"), self.assertRaises(StepFailed):
+            graph.run(Context("localhost"))
+        after.assert_not_called()
+        self.assertEqual(graph.steps["b"].status, "skipped")
+
+        cyclic = StepGraph("cyclic")
+        cyclic.add("x", Mock(), requires=["y"])
+        cyclic.add("y", Mock(), requires=["x"])
+        with self.assertRaises(ValueError):
+            cyclic.order()
+
+
+class TestStepJournal(unittest.TestCase):
+    """Test that journaled steps are skipped on rerun unless their inputs change."""
+
+    def _run(self, journal_store, inputs="v1", fail=None, **options):
+        from cloudy.util.context import Context
+        from cloudy.util.journal import StepJournal
+        from cloudy.util.steps import StepGraph
+
+        ran = []
+
+        def make(name):
+            def func(c):
+                if name == fail:
+                    raise RuntimeError("boom")
+                ran.append(name)
+
+            return func
+
+        graph = StepGraph("generic", concurrency=1, journal=True)
+        graph.add("init", make("init"), inputs=inputs)
+        graph.add("users", make("users"), requires=["init"])
+        graph.add("firewall", make("firewall"), requires=["users"])
+
+        def load(journal, c):
+            journal.entries = dict(journal_store)
+            return journal.entries
+
+        def record(journal, c, step, digest):
+            journal_store[step] = {"step": step, "hash": digest}
+
+        with patch.object(StepJournal, "load", load), patch.object(
+            StepJournal, "record", record
+        ), patch("builtins.print"):
+            try:
+                graph.run(Context("localhost"), **options)
+            except RuntimeError:
+                pass
+        return ran
+
+    def test_resume_after_failure(self):
+        """Test that a rerun resumes at the failed step and input changes cascade."""
+        store = {}
+        self.assertEqual(self._run(store, fail="firewall"), ["init", "users"])
+        self.assertEqual(self._run(store), ["firewall"])
+        self.assertEqual(self._run(store), [])
+        self.assertEqual(self._run(store, inputs="v2"), ["init", "users", "firewall"])
+
+    def test_from_step_and_force_step(self):
+        """Test that --from-step and --force-step override the journal."""
+        store = {}
+        self._run(store)
+        self.assertEqual(self._run(store, force_steps=["users"]), ["users"])
+        self.assertEqual(self._run(store, from_step="users"), ["users", "firewall"])
+        self.assertEqual(self._run({}, from_step="firewall"), ["firewall"])
+
+    def test_journal_is_private(self):
+        """Test that the journal is written with a root-only directory and file."""
+        import json
+        import shlex
+
+        from cloudy.util.journal import StepJournal
+
+        c = Mock()
+        StepJournal("generic").record(c, "users", "0123abcd")
+        script = shlex.split(c.sudo.call_args[0][0])[2]
+        self.assertTrue(script.startswith("umask 077;"))
+        self.assertIn("chmod 700 /var/lib/cloudy/journal", script)
+        entry = json.loads(shlex.split(script.split(" echo ", 1)[1])[0])
+        self.assertEqual(entry["step"], "users")
+
+
+class TestCommandTrace(unittest.TestCase):
+    """Test the opt-in JSON-lines command trace and its report."""
+
+    def test_trace_records_commands_per_task(self):
+        """Test that each command is recorded with its task, exit code and byte counts."""
+        import tempfile
+
+        from fabric import Connection
+
+        from cloudy.util.context import Context
+        from cloudy.util.trace import format_report, load_trace
+
+        @Context.wrap_context
+        def probe_uptime(c):
+            c.run("uptime", hide=True)
+
+        result = Mock(stdout="up 3 days", stderr="", return_code=0, failed=False)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.jsonl")
+            with patch.dict("os.environ", {"CLOUDY_TRACE": path}), patch.object(
+                Connection, "run", return_value=result
+            ), patch("builtins.print"):
+                probe_uptime(Context("web1"))
+
+            records = load_trace([path])
+
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(
+            (record["host"], record["task"], record["kind"], record["command"]),
+            ("web1", "probe_uptime", "run", "uptime"),
+        )
+        self.assertEqual((record["exit_code"], record["stdout_bytes"]), (0, 9))
+        self.assertTrue(record["hidden"])
+        self.assertIn("probe_uptime", format_report(records))
+
+
+class TestSpanTrace(unittest.TestCase):
+    """Test nested task/command spans and their Chrome trace_event export."""
+
+    def test_nested_spans_export(self):
+        """Test that nested tasks and their commands export as nested complete events."""
+        import json
+        import tempfile
+
+        from fabric import Connection
+
+        from cloudy.util.context import Context
+        from cloudy.util.trace import trace_sink
+
+        @Context.wrap_context
+        def fw_reload(c):
+            c.sudo("ufw reload", hide=True)
+
+        @Context.wrap_context
+        def fw_secure(c):
+            c.run("ufw status", hide=True)
+            fw_reload(c)
+
+        result = Mock(stdout="", stderr="", return_code=0, failed=False)
+        trace_sink.spans.clear()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "spans.json")
+            with patch.dict("os.environ", {"CLOUDY_SPANS": path}), patch.object(
+                Connection, "run", return_value=result
+            ), patch.object(Connection, "sudo", return_value=result), patch("builtins.print"):
+                fw_secure(Context("fw1"))
+                trace_sink.export_chrome()
+            trace_sink.spans.clear()
+            with open(path) as f:
+                events = [e for e in json.load(f)["traceEvents"] if e["ph"] == "X"]
+
+        by_name = {e["name"]: e for e in events}
+        self.assertEqual(set(by_name), {"fw_secure", "ufw status", "fw_reload", "ufw reload"})
+        outer, inner = by_name["fw_secure"], by_name["fw_reload"]
+        self.assertEqual(inner["args"]["parent"], outer["args"]["id"])
+        self.assertEqual(by_name["ufw reload"]["args"]["parent"], inner["args"]["id"])
+        self.assertEqual(by_name["ufw reload"]["cat"], "command")
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(outer["ts"] + outer["dur"], inner["ts"] + inner["dur"])
+
+
+class TestChecksumUpload(unittest.TestCase):
+    """Test that uploads skip files whose content, owner and mode already match."""
+
+    REMOTE = "/etc/nginx/sites available/my site.conf"
+
+    def _upload(self, remote_stdout):
+        from fabric import Connection
+
+        from cloudy.util.context import Context
+
+        probe = Mock(stdout=remote_stdout, stderr="", return_code=0, failed=False)
+        sftp = MagicMock()
+        with patch.object(Connection, "sudo", return_value=probe) as sudo, patch.object(
+            Context, "sftp", return_value=sftp
+        ), patch("builtins.print"):
+            changed = Context("web1").upload(b"worker_processes 4;\n", self.REMOTE)
+        return changed, sudo, sftp.open
+
+    def test_unchanged_file_is_not_transferred(self):
+        """Test that a matching checksum and ownership costs one probe and no transfer."""
+        import hashlib
+
+        digest = hashlib.sha256(b"worker_processes 4;\n").hexdigest()
+        changed, sudo, put = self._upload(f"{digest}  {self.REMOTE}\n644 root:root\n")
+        self.assertFalse(changed)
+        self.assertEqual(sudo.call_count, 1)
+        put.assert_not_called()
+
+    def test_changed_file_is_uploaded(self):
+        """Test that a differing or missing file is staged privately and installed."""
+        for stdout in (f"0000  {self.REMOTE}\n644 root:root\n", ""):
+            changed, sudo, put = self._upload(stdout)
+            self.assertTrue(changed)
+            put.assert_called_once()
+            staged = put.return_value.__enter__.return_value
+            self.assertEqual(
+                [name for name, _, _ in staged.mock_calls],
+                ["chmod", "write"],
+            )
+            staged.chmod.assert_called_once_with(0o600)
+            self.assertIn("my site.conf", sudo.call_args_list[-1][0][0])
+
+
+class TestConfigTemplate(unittest.TestCase):
+    """Test local rendering of cfg/ templates."""
+
+    def test_render_validates_and_caches(self):
+        """Test single-pass substitution, value validation and the render cache."""
+        from cloudy.util.template import ConfigTemplate
+
+        site = ConfigTemplate("apache2/site.conf", {"example.com": str, "port_num": int})
+        text = site.render({"example.com": "port_num.org", "port_num": "8181"})
+        self.assertIn("<VirtualHost 127.0.0.1:8181>", text)
+        self.assertIn("ServerAlias www.port_num.org", text)
+        self.assertNotIn("example.com", text)
+
+        hits = ConfigTemplate.hits
+        self.assertEqual(site.render({"example.com": "port_num.org", "port_num": 8181}), text)
+        self.assertEqual(ConfigTemplate.hits, hits + 1)
+
+        for values in ({"example.com": "a.org"}, {"example.com": "a.org", "port_num": "x"}):
+            with self.assertRaises(ValueError):
+                site.render(values)
+        stale = ConfigTemplate("apache2/site.conf", {"example.com": str, "no_such_token": str})
+        with self.assertRaises(ValueError):
+            stale.render({"example.com": "a.org", "no_such_token": "x"})
+
+    def test_unchanged_apache_site_is_still_enabled(self):
+        """Test that a rerun with an unchanged site file still enables it and its port."""
+        from cloudy.util.context import Context
+        from cloudy.web import apache
+
+        c = Context("web2")
+        with patch.object(Context, "upload", return_value=False), patch.object(
+            Context, "sudo", return_value=Mock(stdout="Enabling site a.org.")
+        ) as sudo, patch.object(apache, "web_apache2_set_port") as set_port, patch.object(
+            apache, "sys_notify_service"
+        ) as notify, patch.object(
+            apache, "sys_etc_git_commit"
+        ):
+            apache.web_apache2_setup_domain(c, "8181", "a.org")
+        sudo.assert_called_once_with("a2ensite a.org", hide=True)
+        set_port.assert_called_once_with(c, "8181")
+        notify.assert_called_once_with(c, "apache2", "reload")
+
+
+class TestReadiness(unittest.TestCase):
+    """Test backoff polling and readiness-based service restarts."""
+
+    def test_wait_until_backs_off_to_deadline(self):
+        """Test that waits grow exponentially and stop at the deadline."""
+        from cloudy.util.ready import wait_until
+
+        sleeps = []
+        with patch("cloudy.util.ready.time.sleep", side_effect=sleeps.append):
+            self.assertTrue(wait_until(iter([False, False, True]).__next__, timeout=10))
+        self.assertEqual(sleeps, [0.1, 0.2])
+
+        with patch("cloudy.util.ready.time.sleep"):
+            self.assertFalse(wait_until(lambda: False, timeout=0))
+
+    def test_restart_polls_readiness(self):
+        """Test that a restart checks the config first and returns once the probe passes."""
+        from fabric import Connection
+
+        from cloudy.sys.core import sys_restart_service
+        from cloudy.util.context import Context
+
+        ok, down = Mock(ok=True, stdout=""), Mock(ok=False, stdout="")
+        results = iter([ok, ok, down, ok])
+        with patch.object(
+            Connection, "sudo", side_effect=lambda *a, **k: next(results)
+        ) as sudo, patch("cloudy.util.ready.time.sleep") as sleep, patch("builtins.print"):
+            sys_restart_service(Context("web1"), "nginx")
+
+        commands = [call[0][0] for call in sudo.call_args_list]
+        self.assertEqual(commands[:2], ["nginx -t -q", "systemctl restart nginx"])
+        self.assertEqual(len(commands), 4)
+        self.assertIn("is-active", commands[2])
+        sleep.assert_called_once()
+
+
+class TestServiceHandlers(unittest.TestCase):
+    """Test deferred, coalesced service restarts/reloads and /etc commits."""
+
+    def test_deferred_actions_coalesce(self):
+        """Test that queued actions merge per service and run once at the end of the scope."""
+        from fabric import Connection
+
+        from cloudy.sys.core import deferred_changes, sys_notify_service
+        from cloudy.util.context import Context
+
+        ran = []
+        c = Context("cache1")
+        with patch("cloudy.sys.core.sys_restart_service") as restart, patch(
+            "cloudy.sys.core.sys_reload_service"
+        ) as reload, patch.object(Connection, "sudo"), patch("builtins.print"):
+            restart.side_effect = lambda ctx, service: ran.append(("restart", service))
+            reload.side_effect = lambda ctx, service: ran.append(("reload", service))
+            with deferred_changes(c):
+                for _ in range(5):
+                    sys_notify_service(c, "redis-server")
+                with deferred_changes(c):
+                    sys_notify_service(c, "nginx", "reload")
+                sys_notify_service(c, "nginx", "restart")
+                sys_notify_service(c, "postgresql", "reload")
+                self.assertEqual(ran, [])
+            self.assertEqual(
+                ran,
+                [("restart", "redis-server"), ("restart", "nginx"), ("reload", "postgresql")],
+            )
+
+            sys_notify_service(c, "nginx", "reload")
+            self.assertEqual(ran[-1], ("reload", "nginx"))
+
+    def test_flush_uses_reconnected_context(self):
+        """Test that a restart queued before a reconnect runs on the new connection."""
+        from cloudy.sys.core import deferred_changes, sys_notify_service
+        from cloudy.util.context import Context
+
+        ran = []
+        c = Context("mail1", user="root", port=22)
+        with patch("cloudy.sys.core.sys_restart_service") as restart, patch.object(
+            Context, "open"
+        ), patch.object(Context, "run"), patch.object(Context, "sudo"), patch("builtins.print"):
+            restart.side_effect = lambda ctx, service: ran.append(
+                (ctx.user, int(ctx.port), service)
+            )
+            with deferred_changes(c):
+                sys_notify_service(c, "postfix")
+                c = c.reconnect(new_port="22022")
+                c = c.reconnect(new_port="22022", new_user="admin")
+        self.assertEqual(ran, [("admin", 22022, "postfix")])
+
+    def test_etc_commits_are_batched(self):
+        """Test that /etc commits queued in a recipe become one git add/commit."""
+        from fabric import Connection
+
+        from cloudy.sys.core import deferred_changes
+        from cloudy.sys.etc import sys_etc_git_commit
+        from cloudy.util.context import Context
+
+        c = Context("etc1")
+        c.facts.set("git_installed", True)
+        c.facts.set("etc_git_tracked", True)
+        result = Mock(ok=True, stdout="", stderr="", return_code=0, failed=False)
+        with patch.dict("os.environ", {"CLOUDY_ETC_GIT": "1"}), patch.object(
+            Context, "upload", return_value=False
+        ), patch.object(Connection, "sudo", return_value=result) as sudo, patch("builtins.print"):
+            with deferred_changes(c):
+                for msg in ("Installed nginx", "Configured redis", "Added user"):
+                    sys_etc_git_commit(c, msg)
+                sudo.assert_not_called()
+
+        self.assertEqual(sudo.call_count, 1)
+        command = sudo.call_args[0][0]
+        self.assertIn("git add -A", command)
+        self.assertIn("Installed nginx (+2 more)", command)
+        self.assertIn("- Added user", command)
+
+
+class TestFirewallRules(unittest.TestCase):
+    """Test the declarative ufw rule diff."""
+
+    STATUS = (
+        "Status: active\nLogging: on (low)\n"
+        "Default: deny (incoming), allow (outgoing), disabled (routed)\n"
+        "Added user rules (see 'ufw status' for running firewall):\n"
+        "ufw allow 22022\nufw allow 80/tcp\nufw allow 8080\n"
+    )
+
+    def test_diff_is_minimal(self):
+        """Test that only missing rules are added and unwanted ones deleted."""
+        from cloudy.sys.firewall import FirewallRules, util_fw_parse
+
+        active, defaults, current = util_fw_parse(self.STATUS)
+        self.assertTrue(active)
+        self.assertEqual(defaults["incoming"], "deny")
+        self.assertEqual(current, ["allow 22022", "allow 80/tcp", "allow 8080"])
+
+        rules = FirewallRules().default("incoming", "deny").allow("22022").allow("http")
+        rules.allow("https").allow("6379", "tcp", source="10.0.0.5").remove("8080")
+        add, delete, policies = rules.diff(current, defaults)
+        self.assertEqual(add, ["allow 443/tcp", "allow from 10.0.0.5 to any port 6379 proto tcp"])
+        self.assertEqual(delete, ["allow 8080"])
+        self.assertEqual(policies, {})
+
+    def test_matching_host_is_a_noop(self):
+        """Test that applying rules the host already has costs a single probe."""
+        from fabric import Connection
+
+        from cloudy.sys.firewall import FirewallRules
+        from cloudy.util.context import Context
+
+        result = Mock(ok=True, stdout=self.STATUS, stderr="", return_code=0, failed=False)
+        with patch.object(Connection, "sudo", return_value=result) as sudo, patch("builtins.print"):
+            changed = FirewallRules().allow("22022").allow("http").apply(Context("fw1"))
+        self.assertFalse(changed)
+        self.assertEqual(sudo.call_count, 1)
+
+
+class TestPortAllocator(unittest.TestCase):
+    """Test the single-snapshot port allocator."""
+
+    SNAPSHOT = (
+        "LISTEN 0 128 0.0.0.0:22 0.0.0.0:*\n"
+        "LISTEN 0 511 127.0.0.1:8181 0.0.0.0:*\n"
+        "LISTEN 0 511 [::]:8183 [::]:*\n"
+        "---\n"
+        "8182 shop.example.com\n"
+    )
+
+    def test_free_ports_from_one_snapshot(self):
+        """Test parsing ss output and reservations, then picking ports locally."""
+        from cloudy.sys.ports import util_ports_free, util_ports_parse
+
+        listening, reserved = util_ports_parse(self.SNAPSHOT)
+        self.assertEqual(listening, {22, 8181, 8183})
+        self.assertEqual(reserved, {8182: "shop.example.com"})
+        used = listening | set(reserved)
+        self.assertEqual(util_ports_free(used, 8181, count=3), [8184, 8185, 8186])
+        self.assertEqual(util_ports_free(used, 8181, count=2, max_tries=4), [8184])
+
+    def test_owner_gets_its_reservation_back(self):
+        """Test that a rerun for the same owner reuses its port with a single probe."""
+        from fabric import Connection
+
+        from cloudy.sys.ports import sys_allocate_ports
+        from cloudy.util.context import Context
+
+        result = Mock(ok=True, stdout=self.SNAPSHOT, stderr="", return_code=0, failed=False)
+        with patch.object(Connection, "sudo", return_value=result) as sudo:
+            ports = sys_allocate_ports(Context("web1"), owner="shop.example.com")
+        self.assertEqual(ports, ["8182"])
+        self.assertEqual(sudo.call_count, 1)
+
+
+class TestEC2Session(unittest.TestCase):
+    """Test the shared EC2 driver, its call counters and the listing cache."""
+
+    def test_shared_driver_counts_calls(self):
+        """Test that a region gets one driver and its requests are counted by action."""
+        from libcloud.common.base import Connection
+
+        from cloudy.aws.session import EC2Session
+
+        session = EC2Session()
+        with patch.object(Connection, "request", return_value=Mock(object=None)):
+            conn = session.driver("id", "secret", "us-west-2")
+            self.assertIs(session.driver("id", "secret", "us-west-2"), conn)
+            self.assertIsNot(session.driver("id", "secret", "eu-west-1"), conn)
+            conn.connection.request("/", params={"Action": "DescribeKeyPairs"})
+        self.assertEqual(dict(session.calls), {"DescribeKeyPairs": 1})
+        self.assertIn("1 API call(s)", session.summary())
+
+    def test_drivers_are_per_thread(self):
+        """Test that each thread gets its own driver and drops it when it exits."""
+        import gc
+        import threading
+        import weakref
+
+        from cloudy.aws.session import EC2Session
+
+        session = EC2Session()
+        main = session.driver("id", "secret", "us-west-2")
+        seen = []
+
+        def worker():
+            conn = session.driver("id", "secret", "us-west-2")
+            self.assertIs(session.driver("id", "secret", "us-west-2"), conn)
+            seen.append(weakref.ref(conn))
+
+        for _ in range(3):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        gc.collect()
+        self.assertEqual(len(seen), 3)
+        self.assertTrue(all(ref() is None for ref in seen))
+        self.assertIs(session.driver("id", "secret", "us-west-2"), main)
+
+    def test_listing_cache_ttl(self):
+        """Test that cached listings are loaded once, and not at all kept with a TTL of 0."""
+        from cloudy.aws.session import AWS_CACHE_TTL_ENV, EC2Session
+
+        session = EC2Session()
+        loader = Mock(return_value=["default", "web"])
+        for _ in range(3):
+            self.assertEqual(
+                session.cached("us-east-1", "security_groups", loader), ["default", "web"]
+            )
+        self.assertEqual(loader.call_count, 1)
+        session.invalidate("security_groups")
+        with patch.dict(os.environ, {AWS_CACHE_TTL_ENV: "0"}):
+            session.cached("us-east-1", "security_groups", loader)
+            session.cached("us-east-1", "security_groups", loader)
+        self.assertEqual(loader.call_count, 3)
+
+
+class TestImageCatalog(unittest.TestCase):
+    """Test the on-disk EC2 image catalog."""
+
+    ROWS = [
+        {
+            "id": "ami-0b2",
+            "name": "ubuntu-22.04",
+            "arch": "x86_64",
+            "owner": "amazon",
+            "created": "2",
+        },
+        {
+            "id": "ami-0a1",
+            "name": "Ubuntu-20.04",
+            "arch": "x86_64",
+            "owner": "amazon",
+            "created": "1",
+        },
+        {"id": "ami-1c3", "name": "debian-12", "arch": "arm64", "owner": "123456", "created": "3"},
+    ]
+
+    def test_prefix_search_and_reload(self):
+        """Test ID and name prefix search, owner filter and a round trip through disk."""
+        import tempfile
+
+        from cloudy.aws.images import ImageCatalog
+
+        with tempfile.TemporaryDirectory() as tmp:
+            ImageCatalog("us-east-1", tmp).replace(self.ROWS, ["amazon", "self"])
+            catalog = ImageCatalog("us-east-1", tmp)
+            self.assertTrue(catalog.load())
+            self.assertTrue(catalog.fresh(["self", "amazon"]))
+            self.assertFalse(catalog.fresh(["amazon"]))
+        self.assertEqual([r["id"] for r in catalog.search("ami-0")], ["ami-0a1", "ami-0b2"])
+        self.assertEqual([r["id"] for r in catalog.search("ubuntu")], ["ami-0a1", "ami-0b2"])
+        self.assertEqual([r["id"] for r in catalog.search(owner="123456")], ["ami-1c3"])
+        self.assertEqual(catalog.get("ami-1c3")["arch"], "arm64")
+        self.assertIsNone(catalog.get("ami-9"))
+
+    def test_get_image_only_hides_not_found(self):
+        """Test that an unknown AMI is None while credential and throttling errors propagate."""
+        from libcloud.common.exceptions import BaseHTTPError
+        from libcloud.common.types import InvalidCredsError
+
+        from cloudy.aws import ec2
+        from cloudy.util.context import Context
+
+        conn = Mock(region_name="us-east-1")
+        errors = [
+            BaseHTTPError(400, "InvalidAMIID.NotFound: The image id '[ami-123]' does not exist"),
+            InvalidCredsError("AuthFailure: AWS was not able to validate the credentials"),
+            BaseHTTPError(503, "RequestLimitExceeded: Request limit exceeded."),
+        ]
+        with patch.object(ec2, "util_get_connection", return_value=conn), patch.object(
+            ec2.ImageCatalog, "load", return_value=False
+        ):
+            conn.list_images.side_effect = errors[0]
+            self.assertIsNone(ec2.aws_get_image(Context("aws"), "ami-123"))
+            for error in errors[1:]:
+                conn.list_images.side_effect = error
+                with self.assertRaises(type(error)):
+                    ec2.aws_get_image(Context("aws"), "ami-123")
+
+
+class TestNodeWaiter(unittest.TestCase):
+    """Test the batched EC2 node state waiter."""
+
+    def test_batched_polls_drop_ready_nodes(self):
+        """Test that one describe call covers all pending nodes and ready ones drop out."""
+        from libcloud.compute.types import NodeState
+
+        from cloudy.aws.waiters import NodeWaiter
+
+        def node(node_id, state):
+            return Mock(id=node_id, state=state)
+
+        conn = Mock()
+        conn.list_nodes.side_effect = [
+            [node("i-a", NodeState.RUNNING), node("i-b", NodeState.PENDING)],
+            [node("i-b", NodeState.RUNNING)],
+        ]
+        waiter = NodeWaiter(conn, timeout=60, initial=0.01, maximum=0.01)
+        with patch("cloudy.aws.waiters.time.sleep") as sleep:
+            seen = waiter.wait(["i-a", "i-b"], NodeState.RUNNING)
+        self.assertEqual(
+            {k: v.state for k, v in seen.items()}, {"i-a": "running", "i-b": "running"}
+        )
+        self.assertEqual(conn.list_nodes.call_args_list[1].kwargs, {"ex_node_ids": ["i-b"]})
+        self.assertEqual(waiter.calls, 2)
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_deadline_and_jitter(self):
+        """Test that a wait gives up at the deadline and jitter only shortens delays."""
+        from libcloud.compute.types import NodeState
+
+        from cloudy.aws.waiters import NodeWaiter
+        from cloudy.util.ready import backoff_delays
+
+        conn = Mock()
+        conn.list_nodes.return_value = [Mock(id="i-a", state=NodeState.PENDING)]
+        seen = NodeWaiter(conn, timeout=0.05, initial=0.01, maximum=0.01).wait(
+            ["i-a"], NodeState.RUNNING
+        )
+        self.assertEqual(seen["i-a"].state, NodeState.PENDING)
+        delays = backoff_delays(1.0, maximum=4.0, jitter=0.5)
+        for expected in (1.0, 2.0, 4.0, 4.0):
+            self.assertTrue(expected * 0.5 <= next(delays) <= expected)
+
+    def test_only_transient_errors_are_retried(self):
+        """Test that throttling and unknown IDs are polled through, other errors raise."""
+        from libcloud.common.exceptions import BaseHTTPError
+        from libcloud.common.types import InvalidCredsError
+        from libcloud.compute.types import NodeState
+
+        from cloudy.aws.waiters import NodeWaiter
+
+        running = [Mock(id="i-a", state=NodeState.RUNNING)]
+        for error in (
+            BaseHTTPError(400, "InvalidInstanceID.NotFound: The instance ID 'i-a' does not exist"),
+            BaseHTTPError(503, "RequestLimitExceeded: Request limit exceeded."),
+            ConnectionResetError("reset by peer"),
+        ):
+            conn = Mock()
+            conn.list_nodes.side_effect = [error, running]
+            with patch("cloudy.aws.waiters.time.sleep"):
+                seen = NodeWaiter(conn, timeout=60).wait(["i-a"], NodeState.RUNNING)
+            self.assertEqual(seen["i-a"].state, NodeState.RUNNING)
+
+        for error in (
+            InvalidCredsError("AuthFailure: AWS was not able to validate the credentials"),
+            BaseHTTPError(400, "InvalidParameterValue: Invalid region"),
+        ):
+            conn = Mock()
+            conn.list_nodes.side_effect = error
+            with patch("cloudy.aws.waiters.time.sleep"), self.assertRaises(type(error)):
+                NodeWaiter(conn, timeout=60).wait(["i-a"], NodeState.RUNNING)
+            self.assertEqual(conn.list_nodes.call_count, 1)
+
+
+class TestBulkNodeCreation(unittest.TestCase):
+    """Test aws.create-nodes name expansion, parallel creation and inventory output."""
+
+    def test_node_names(self):
+        """Test name lists and {n} patterns."""
+        from cloudy.aws.ec2 import util_node_names
+
+        self.assertEqual(
+            util_node_names(pattern="web-{n:02d}", count=3), ["web-01", "web-02", "web-03"]
+        )
+        self.assertEqual(util_node_names(names="a, b,a"), ["a", "b"])
+        with self.assertRaises(ValueError):
+            util_node_names(pattern="web", count=2)
+
+    def test_create_nodes_validates_once_and_returns_inventory(self):
+        """Test that shared parameters are checked once and running nodes form an inventory."""
+        import io
+        from contextlib import redirect_stdout
+        from types import SimpleNamespace
+
+        from libcloud.compute.types import NodeState
+
+        from cloudy.aws import ec2
+        from cloudy.util.context import Context
+
+        conn = Mock()
+        conn.list_nodes.return_value = []
+        conn.create_node.side_effect = lambda name, **kw: SimpleNamespace(
+            name=name,
+            id=f"i-{name}",
+            state=NodeState.PENDING,
+            extra={},
+            public_ips=[],
+            private_ips=[],
+        )
+
+        def running(c, nodes, state, timeout):
+            for i, node in enumerate(nodes):
+                node.state, node.public_ips = state, [f"10.0.0.{i + 1}"]
+            return nodes
+
+        out = io.StringIO()
+        with patch.object(ec2, "util_get_connection", return_value=conn), patch.object(
+            ec2, "util_validate_node_params", return_value=("size", "image")
+        ) as validate, patch.object(ec2, "util_wait_for_nodes", side_effect=running), patch.object(
+            ec2, "util_ready_context"
+        ) as ready, redirect_stdout(
+            out
+        ):
+            nodes = ec2.aws_create_nodes(
+                Context("localhost"),
+                "ami-1",
+                "t3.micro",
+                "web",
+                "deploy",
+                count=3,
+                pattern="web-{n}",
+                group="web",
+            )
+        self.assertEqual(len(nodes), 3)
+        self.assertEqual(validate.call_count, 1)
+        self.assertEqual(conn.create_node.call_count, 3)
+        self.assertEqual(ready.call_count, 3)
+        import tempfile
+
+        from cloudy.util.fleet import load_inventory
+
+        with tempfile.NamedTemporaryFile("w", suffix=".ini") as f:
+            f.write(out.getvalue())
+            f.flush()
+            self.assertEqual(load_inventory(f.name)["web"], ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+
+
+class TestInventoryIndex(unittest.TestCase):
+    """Test the SQLite EC2 inventory index and its use as a fleet host source."""
+
+    @staticmethod
+    def node(node_id, name, state, zone, ip, role):
+        return {
+            "id": node_id,
+            "region": zone[:-1],
+            "name": name,
+            "state": state,
+            "zone": zone,
+            "size": "t3.small",
+            "image": "ami-1",
+            "key": "deploy",
+            "public_ip": ip,
+            "private_ip": "",
+            "launched": "",
+            "tags": {"Name": name, "role": role},
+        }
+
+    def test_query_and_fleet_hosts(self):
+        """Test tag/state/zone queries, name globs, region resync and ec2: fleet inventories."""
+        import tempfile
+
+        from cloudy.aws.index import INVENTORY_DB_ENV, InventoryIndex
+        from cloudy.util.fleet import resolve_hosts
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "inventory.sqlite")
+            index = InventoryIndex(path)
+            index.sync(
+                "us-east-1",
+                [
+                    self.node("i-1", "web-1", "running", "us-east-1a", "1.1.1.1", "web"),
+                    self.node("i-2", "web-2", "running", "us-east-1b", "1.1.1.2", "web"),
+                    self.node("i-3", "web-3", "stopped", "us-east-1a", "", "web"),
+                    self.node("i-4", "db-1", "running", "us-east-1a", "1.1.1.4", "db"),
+                ],
+            )
+            index.sync(
+                "eu-west-1", [self.node("i-5", "web-4", "running", "eu-west-1a", "2.2.2.5", "web")]
+            )
+            found = index.query(**{"tag:role": "web", "state": "running", "zone": "us-east-1a"})
+            self.assertEqual([r["name"] for r in found], ["web-1"])
+            self.assertEqual(found[0]["tags"]["role"], "web")
+            self.assertEqual(len(index.query(name="web-*")), 4)
+            index.sync("us-east-1", [])
+            self.assertEqual([r["id"] for r in index.query()], ["i-5"])
+            index.close()
+
+            with patch.dict(os.environ, {INVENTORY_DB_ENV: path}):
+                self.assertEqual(resolve_hosts(inventory="ec2:role=web,state=running"), ["2.2.2.5"])
+                with self.assertRaises(ValueError):
+                    resolve_hosts(inventory="ec2:role")
+
+
+class TestRegionFanOut(unittest.TestCase):
+    """Test concurrent multi-region listing, retries and per-region rate limiting."""
+
+    def test_regions_run_concurrently(self):
+        """Test that regions overlap, keep their order and fail independently."""
+        import time
+
+        from cloudy.aws.regions import fan_out, util_region_list
+
+        def fetch(region):
+            time.sleep(0.2)
+            if region == "eu-west-1":
+                raise ValueError("boom")
+            return [f"{region}-node"]
+
+        regions = ["us-east-1", "us-west-2", "eu-west-1", "ap-south-1"]
+        started = time.monotonic()
+        with patch("cloudy.aws.regions.backoff_delays", return_value=iter([0.0] * 5)):
+            results = fan_out(regions, fetch)
+        self.assertLess(time.monotonic() - started, 0.2 * len(regions) - 0.1)
+        self.assertEqual([r.region for r in results], regions)
+        self.assertEqual(results[0].items, ["us-east-1-node"])
+        self.assertEqual((results[2].attempts, results[2].items), (3, []))
+        self.assertIn("ValueError", results[2].error)
+
+        self.assertEqual(util_region_list("", [], "us-east-1"), ["us-east-1"])
+        self.assertEqual(util_region_list("all", ["eu-west-1"], "us-east-1"), ["eu-west-1"])
+        with self.assertRaises(ValueError):
+            util_region_list("us-east-1,mars-1", [], "us-east-1")
+
+    def test_retry_and_rate_limit(self):
+        """Test that a throttled region is retried and requests are spaced per region."""
+        import time
+
+        from libcloud.common.types import InvalidCredsError
+
+        from cloudy.aws.regions import fan_out
+        from cloudy.aws.session import RateLimiter
+
+        fetch = Mock(side_effect=[RuntimeError("RequestLimitExceeded"), ["node"]])
+        with patch("cloudy.aws.regions.backoff_delays", return_value=iter([0.0] * 5)):
+            self.assertEqual(fan_out(["us-east-1"], fetch)[0].items, ["node"])
+            denied = fan_out(["us-east-1"], Mock(side_effect=InvalidCredsError("bad key")))
+        self.assertEqual(denied[0].attempts, 1)
+
+        limiter = RateLimiter()
+        started = time.monotonic()
+        for _ in range(5):
+            limiter.wait(50)
+        self.assertGreaterEqual(time.monotonic() - started, 0.07)
+
+
+class TestSSHReadiness(unittest.TestCase):
+    """Test waiting for sshd and pre-seeding host keys."""
+
+    CONSOLE = (
+        "cloud-init: boot\n"
+        "-----BEGIN SSH HOST KEY KEYS-----\n"
+        "ecdsa-sha2-nistp256 AAAAE2VjZHNh root@ip-10-0-0-1\n"
+        "ssh-ed25519 AAAAC3NzaC1lZDI1 root@ip-10-0-0-1\n"
+        "-----END SSH HOST KEY KEYS-----\n"
+    )
+
+    def test_console_keys_seed_known_hosts(self):
+        """Test parsing cloud-init console keys and replacing stale known_hosts entries."""
+        import tempfile
+
+        from cloudy.util.hostkeys import parse_console_host_keys, seed_known_hosts
+
+        keys = parse_console_host_keys(self.CONSOLE)
+        self.assertEqual([k[0] for k in keys], ["ecdsa-sha2-nistp256", "ssh-ed25519"])
+        self.assertEqual(parse_console_host_keys("no keys yet"), [])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "known_hosts")
+            with open(path, "w") as f:
+                f.write("[1.2.3.4]:2222 ssh-rsa OLD\nother.host ssh-rsa KEEP\n")
+            seed_known_hosts("1.2.3.4", 2222, keys, path)
+            with open(path) as f:
+                lines = f.read().splitlines()
+        self.assertIn("other.host ssh-rsa KEEP", lines)
+        self.assertNotIn("[1.2.3.4]:2222 ssh-rsa OLD", lines)
+        self.assertIn("[1.2.3.4]:2222 ssh-ed25519 AAAAC3NzaC1lZDI1", lines)
+
+    def test_seed_known_hosts_from_parallel_workers(self):
+        """Test that seeding from many threads at once keeps every host's entry."""
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+
+        from cloudy.util.hostkeys import seed_known_hosts
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "known_hosts")
+            hosts = [f"10.0.0.{i}" for i in range(40)]
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                list(
+                    pool.map(
+                        lambda h: seed_known_hosts(h, 22, [("ssh-ed25519", f"KEY{h}")], path),
+                        hosts,
+                    )
+                )
+            with open(path) as f:
+                lines = f.read().splitlines()
+            leftovers = [n for n in os.listdir(tmp) if n != "known_hosts"]
+            mode = os.stat(path).st_mode & 0o777
+        self.assertEqual(sorted(lines), sorted(f"{h} ssh-ed25519 KEY{h}" for h in hosts))
+        self.assertEqual(leftovers, [])
+        self.assertEqual(mode, 0o600)
+
+    def test_wait_for_ssh_needs_banner(self):
+        """Test that an open port counts as ready only once it sends an SSH banner."""
+        import socket
+        import threading
+
+        from cloudy.util.ready import wait_for_ssh
+
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(5)
+        port = server.getsockname()[1]
+        banners = [b"", b"SSH-2.0-OpenSSH_9.6\r\n"]
+
+        def serve():
+            for banner in banners:
+                conn, _ = server.accept()
+                conn.sendall(banner)
+                conn.close()
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        with patch("cloudy.util.ready.backoff_delays", return_value=iter([0.01] * 10)):
+            self.assertTrue(wait_for_ssh("127.0.0.1", port, timeout=5))
+        thread.join(2)
+        server.close()
+
 
 class TestTaskDiscovery(unittest.TestCase):
     """Test that Fabric can discover tasks correctly."""
@@ -268,6 +1631,29 @@ def run_minimal_tests():
         TestImports,
         TestFabfileStructure,
         TestConfigurationSystem,
+        TestConnectionRegistry,
+        TestCommandBatch,
+        TestFactStore,
+        TestAptPlan,
+        TestPostgresRepo,
+        TestFleetRunner,
+        TestStepGraph,
+        TestStepJournal,
+        TestCommandTrace,
+        TestSpanTrace,
+        TestChecksumUpload,
+        TestConfigTemplate,
+        TestReadiness,
+        TestServiceHandlers,
+        TestFirewallRules,
+        TestPortAllocator,
+        TestEC2Session,
+        TestImageCatalog,
+        TestNodeWaiter,
+        TestBulkNodeCreation,
+        TestInventoryIndex,
+        TestRegionFanOut,
+        TestSSHReadiness,
         TestTaskDiscovery,
     ]
 